@@ -1,7 +1,7 @@
 from datetime import timedelta
 import datetime
 from decimal import Decimal
-from transaction import Transaction
+from transaction import TransactionList
 
 class Account():
     """
@@ -12,29 +12,44 @@ class Account():
     2. List all transactions
     3. Check if a new transaction will violate the balance limit
     4. Interest and fee: Add a transaction to the list of transactions with the interest: total_balance * monthly interest rate; Add fee if balance is less than 100
+    5. Find the balance on any past date
     """
 
     # Store the next available id for all new notes
     last_id = 0
 
+    # no per-account __dict__, the attributes are fixed
+    __slots__ = ("balance", "_transactions", "_latest_transaction_date", "id", "type")
+
     def __init__(self):
         """initialize a note with memo and optional
         space-separated tags. Automatically set the note's
         creation date and a unique id."""
 
         self.balance =  Decimal(0)
-        self._transactions = []
+        self._transactions = TransactionList()
         self._latest_transaction_date = None
 
         Account.last_id += 1
         self.id = Account.last_id
 
+    def __setstate__(self, state):
+        """Restore an account from a pickle. Accounts saved before __slots__ was added pickled their __dict__,
+        with the transactions as a list of Transaction objects, which are moved into a TransactionList"""
+        if isinstance(state, tuple):
+            state = state[1]
+        for name, value in state.items():
+            setattr(self, name, value)
+        if isinstance(self._transactions, list):
+            transactions = TransactionList()
+            for t in self._transactions:
+                transactions.add(t.amount, t.type, t.date)
+            self._transactions = transactions
+
     def transaction_record(self, amount, type, date):
         """Add a transaction with the amount and date to the list of transactions, sorted by date"""
         
-        new_transaction = Transaction(amount, type, date)
-        self._transactions.append(new_transaction)
-        self._transactions.sort(key=lambda x: x.date)
+        self._transactions.add(amount, type, date)
 
         if not self._latest_transaction_date:
             self._latest_transaction_date = date
@@ -48,6 +63,10 @@ class Account():
         for transaction in self._transactions:
             print(f'{transaction.date}, ${transaction.amount:,.2f}')
 
+    def balance_as_of(self, date):
+        """Return the balance at the end of date. After the latest transaction it equals balance."""
+        return self._transactions.total(date)
+
     def check_balance_limit(self, amount):
         """Check if a new transaction will violate the balance limit"""
         if self.balance + amount < 0:
@@ -77,6 +96,8 @@ class CheckingAccount(Account):
     It has 2 methods defined further than parent class:
     1. add_transaction: Add a transaction to the list of transactions if it does not violate the balance limit
     2. interest_and_fee: with interest rate of 0.08% and fee of $5.44"""
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.type = 'Checking'
@@ -96,6 +117,8 @@ class SavingsAccount(Account):
     1. add_transaction: Add a transaction to the list of transactions if it does not violate the balance limit and if it does not violate the frequency limit
     2. interest_and_fee: with interest rate of 0.41% and fee of $5.44"""
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.type = 'Savings'
@@ -106,15 +129,12 @@ class SavingsAccount(Account):
 
     def check_frequency_limit(self, date):
         """Check if a new transaction will violate the frequency limit, daily limit = 2, monthly limit = 5"""
-        day_count, month_count = 0, 0
-        for transaction in self._transactions:
-            if transaction.date == date and transaction.type == 1:
-                day_count += 1
-            if transaction.date.month == date.month and transaction.type == 1:
-                month_count += 1
-            if day_count >= 2 or month_count >= 5:
-                return False
-        return True
+        ## Transactions are sorted by date, so the ones on the day and in the month are found by binary search
+        first_of_month = date.replace(day=1)
+        end_of_month = (first_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        day_count = self._transactions.count(1, date, date)
+        month_count = self._transactions.count(1, first_of_month, end_of_month)
+        return day_count < 2 and month_count < 5
 
     def add_transaction(self, amount, date):
         """Add a transaction to the list of transactions if it does not violate the balance limit and if it does not violate the frequency limit"""
@@ -0,0 +1,81 @@
+import sys
+import time
+import random
+import datetime
+import tracemalloc
+from decimal import Decimal
+from transaction import TransactionList
+
+
+class PlainTransaction():
+    """How transactions were stored before TransactionList: one object with a __dict__ per transaction"""
+    def __init__(self, amount, type, date):
+        self.amount = amount
+        self.type = type
+        self.date = date
+
+
+def main():
+    '''
+    Measures the memory and insert time of an account's transactions, stored as a sorted list of objects
+    ("before", re-sorted after every append) and as a TransactionList.
+    Dates are in order for "in order", and 1 in 10 is up to a month early for "out of order".
+    Input: number of transactions (default 10000)
+    Output: bytes per transaction and microseconds per insert for each store
+    '''
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(327)
+    start = datetime.date(2020, 1, 1)
+    in_order = [(Decimal(random.randint(-5000, 5000)) / 100, 1, start + datetime.timedelta(days=i // 3))
+                for i in range(count)]
+    out_of_order = [(amount, type, date - datetime.timedelta(days=random.randint(0, 30)) if i % 10 == 0 else date)
+                    for i, (amount, type, date) in enumerate(in_order)]
+
+    print(f"{'store':<18}{'dates':<14}{'bytes/txn':>12}{'us/insert':>12}")
+    for dates, transactions in (("in order", in_order), ("out of order", out_of_order)):
+        for name, build in (("before", build_list), ("TransactionList", build_columns)):
+            size, seconds = measure(build, transactions)
+            print(f"{name:<18}{dates:<14}{size / count:>12.1f}{seconds / count * 1e6:>12.2f}")
+
+def build_list(transactions):
+    '''
+    Stores transactions the way accounts did before TransactionList.
+    Input: list of (amount, type, date)
+    Output: list of PlainTransaction sorted by date
+    '''
+    store = []
+    for amount, type, date in transactions:
+        ## new Decimal and date objects, as parsing user input makes them
+        store.append(PlainTransaction(Decimal(str(amount)), type, datetime.date(date.year, date.month, date.day)))
+        store.sort(key=lambda x: x.date)
+    return store
+
+def build_columns(transactions):
+    '''
+    Stores transactions in a TransactionList.
+    Input: list of (amount, type, date)
+    Output: TransactionList
+    '''
+    store = TransactionList()
+    for amount, type, date in transactions:
+        store.add(Decimal(str(amount)), type, datetime.date(date.year, date.month, date.day))
+    return store
+
+def measure(build, transactions):
+    '''
+    Builds a store while tracing allocations.
+    Input: function that builds the store, transactions to put in it
+    Output: (bytes still allocated by the store, seconds taken to build it without tracing)
+    '''
+    tracemalloc.start()
+    store = build(transactions)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+
+    start = time.perf_counter()
+    build(transactions)
+    return size, time.perf_counter() - start
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from datetime import timedelta
 import datetime
 from decimal import Decimal
-from transaction import Transaction
+from transaction import TransactionList
 import logging
 
 logger = logging.getLogger('bank_application')
@@ -27,6 +27,10 @@ class TransactionLimitError(Exception):
             self.message = "This transaction could not be completed because this account already has 5 transactions in this month."
         super().__init__(self.message)
 
+def _parse_date(text):
+    """Turn a date saved as YYYY-MM-DD back into a date, None stays None"""
+    return datetime.date.fromisoformat(text) if text else None
+
 class Account():
     """
     Represent an Account in the Bank. This is the parent class for  Checking and Savings accounts.
@@ -36,22 +40,41 @@ class Account():
     2. List all transactions
     3. Check if a new transaction will violate the balance limit
     4. Interest and fee: Add a transaction to the list of transactions with the interest: total_balance * monthly interest rate; Add fee if balance is less than 100
+    5. Find the balance on any past date
     """
 
     # Store the next available id for all new notes
     last_id = 0
 
-    def __init__(self):
+    # no per-account __dict__, the attributes are fixed
+    __slots__ = ("balance", "_transactions", "latest_transaction_date", "_day_count", "_month_count",
+                 "_latest_system_date", "_ledger", "id", "type")
+
+    def __init__(self, id=None):
         """initialize a note with memo and optional
         space-separated tags. Automatically set the note's
-        creation date and a unique id."""
+        creation date and a unique id.
+        An account replayed from the ledger keeps the id it was given when it was opened."""
 
         self.balance =  Decimal(0)
-        self._transactions = []
+        self._transactions = TransactionList()
         self.latest_transaction_date = None
 
-        Account.last_id += 1
-        self.id = Account.last_id
+        ## Counts that the frequency limit and the interest check need, so they never scan the transactions.
+        ## Transactions can't be older than the latest one, so only the latest day and month matter.
+        self._day_count = 0
+        self._month_count = 0
+        self._latest_system_date = None
+
+        ## Ledger that every transaction is appended to, None if the account isn't saved anywhere
+        self._ledger = None
+
+        if id is None:
+            Account.last_id += 1
+            self.id = Account.last_id
+        else:
+            self.id = id
+            Account.last_id = max(Account.last_id, id)
 
     def transaction_record(self, amount, type, date):
         """Add a transaction with the amount and date to the list of transactions, sorted by date"""
@@ -60,19 +83,78 @@ class Account():
         if self.latest_transaction_date and date < self.latest_transaction_date:
             raise TransactionSequenceError
         
-        new_transaction = Transaction(amount, type, date)
-        self._transactions.append(new_transaction)
-        self._transactions.sort(key=lambda x: x.date)
+        self.apply_transaction(amount, type, date)
+        if self._ledger:
+            self._ledger.record_transaction(self, amount, type, date)
+
+        logger.debug(f"Created transaction: {self.id}, {amount:,.6f}")
+
+    def apply_transaction(self, amount, type, date):
+        """Update the balance, dates and counts for a transaction that has already been checked.
+        Used directly when replaying the ledger."""
+        if self._transactions is not None:
+            self._transactions.add(amount, type, date)
+
+        if type == 1:
+            latest = self.latest_transaction_date
+            self._day_count = self._day_count + 1 if latest == date else 1
+            same_month = latest and (latest.year, latest.month) == (date.year, date.month)
+            self._month_count = self._month_count + 1 if same_month else 1
+        else:
+            self._latest_system_date = date
+            ## a later day or month starts the counts over even if this transaction doesn't count itself
+            latest = self.latest_transaction_date
+            if latest != date:
+                self._day_count = 0
+            if latest and (latest.year, latest.month) != (date.year, date.month):
+                self._month_count = 0
+
         self.latest_transaction_date = date
         self.balance += amount
 
-        logger.debug(f"Created transaction: {self.id}, {amount:,.6f}")
+    def snapshot(self):
+        """Return the state of the account as a dict of JSON values, without its transactions"""
+        return {
+            "id": self.id,
+            "type": self.type.lower(),
+            "balance": str(self.balance),
+            "latest_transaction_date": self.latest_transaction_date.isoformat() if self.latest_transaction_date else None,
+            "day_count": self._day_count,
+            "month_count": self._month_count,
+            "latest_system_date": self._latest_system_date.isoformat() if self._latest_system_date else None,
+        }
+
+    def restore(self, state):
+        """Set the state of the account from a dict made by snapshot().
+        The transactions aren't in the snapshot, they are read from the ledger when first listed."""
+        self.balance = Decimal(state["balance"])
+        self.latest_transaction_date = _parse_date(state["latest_transaction_date"])
+        self._day_count = state["day_count"]
+        self._month_count = state["month_count"]
+        self._latest_system_date = _parse_date(state["latest_system_date"])
+        self._transactions = None
+
+    def has_transactions(self):
+        """Check if the transactions are in memory. They aren't after restore() until the ledger reads them back."""
+        return self._transactions is not None
+
+    def restore_transactions(self, transactions):
+        """Set the transactions of an account restored from a snapshot, read back from the ledger"""
+        self._transactions = transactions
 
     def list_transactions(self):
         """List all transactions"""
+        if self._transactions is None:
+            self._ledger.load_transactions()
         for transaction in self._transactions:
             print(f'{transaction.date}, ${transaction.amount:,.2f}')
 
+    def balance_as_of(self, date):
+        """Return the balance at the end of date. After the latest transaction it equals balance."""
+        if self._transactions is None:
+            self._ledger.load_transactions()
+        return self._transactions.total(date)
+
     def check_balance_limit(self, amount):
         """Check if a new transaction will violate the balance limit"""
         if self.balance + amount < 0:
@@ -95,9 +177,8 @@ class Account():
         latest_month_end = next_month - timedelta(days=next_month.day)
 
         ## Test for Transaction Sequence Error
-        for transaction in self._transactions:
-            if transaction.date == latest_month_end and transaction.type == 0:
-                raise TransactionSequenceError
+        if self._latest_system_date == latest_month_end:
+            raise TransactionSequenceError
 
         ## Adjsut the interest to the last day of the month of latest transaction
         self.transaction_record(interest, 0, latest_month_end)
@@ -111,8 +192,10 @@ class CheckingAccount(Account):
     It has 2 methods defined further than parent class:
     1. add_transaction: Add a transaction to the list of transactions if it does not violate the balance limit
     2. interest_and_fee: with interest rate of 0.08% and fee of $5.44"""
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    def __init__(self, id=None):
+        super().__init__(id)
         self.type = 'Checking'
 
     def interest_and_fee(self):
@@ -132,8 +215,10 @@ class SavingsAccount(Account):
     1. add_transaction: Add a transaction to the list of transactions if it does not violate the balance limit and if it does not violate the frequency limit
     2. interest_and_fee: with interest rate of 0.41% and fee of $5.44"""
 
-    def __init__(self):
-        super().__init__()
+    __slots__ = ()
+
+    def __init__(self, id=None):
+        super().__init__(id)
         self.type = 'Savings'
 
     def interest_and_fee(self):
@@ -142,16 +227,11 @@ class SavingsAccount(Account):
 
     def check_frequency_limit(self, date):
         """Check if a new transaction will violate the frequency limit, daily limit = 2, monthly limit = 5"""
-        day_count, month_count = 0, 0
-        for transaction in self._transactions:
-            if transaction.date == date and transaction.type == 1:
-                day_count += 1
-            if transaction.date.month == date.month and transaction.type == 1:
-                month_count += 1
-            if day_count >= 2:
-                raise TransactionLimitError("daily")
-            if month_count >= 5:
-                raise TransactionLimitError("monthly")
+        latest = self.latest_transaction_date
+        if latest == date and self._day_count >= 2:
+            raise TransactionLimitError("daily")
+        if latest and (latest.year, latest.month) == (date.year, date.month) and self._month_count >= 5:
+            raise TransactionLimitError("monthly")
         return True
 
     def add_transaction(self, amount, date):
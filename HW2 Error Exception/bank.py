@@ -10,15 +10,30 @@ class Bank():
     def __init__(self, accounts = {}):
         """Initialize a bank with a dict of accounts"""
         self._accounts = accounts
+        self._ledger = None
 
-    def open_account(self, type):
-        """Open a new account based on the type of account"""
+    def open_account(self, type, id=None):
+        """Open a new account based on the type of account.
+        id is only given when replaying the ledger, so the account gets the id it had before."""
         if type == 'checking':
-            account = CheckingAccount()
+            account = CheckingAccount(id)
         elif type == 'savings':
-            account = SavingsAccount()
+            account = SavingsAccount(id)
         self._accounts[account.id] = account
+        if self._ledger:
+            account._ledger = self._ledger
+            self._ledger.record_open(account)
         return account.id
+
+    def attach(self, ledger):
+        """Append every change to the bank and its accounts from now on to the ledger"""
+        self._ledger = ledger
+        for account in self._accounts.values():
+            account._ledger = ledger
+
+    def accounts(self):
+        """Return every account, in the order they were opened"""
+        return list(self._accounts.values())
         
     def summary(self):
         """Summarize all accounts print their balance, account type, and account_id"""
@@ -1,7 +1,7 @@
+import os
 import sys
-import pickle
 import logging
-from bank import Bank
+from ledger import Ledger
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 from account import TransactionSequenceError, OverdrawError, TransactionLimitError
@@ -9,8 +9,14 @@ from account import TransactionSequenceError, OverdrawError, TransactionLimitErr
 class BankCli():
     """Display a menu and respond to choices when run."""
 
-    def __init__(self):
-        self._bank = Bank()
+    def __init__(self, ledger=None):
+        ## Every change is appended to the ledger as it happens, so starting up only replays what came after the last snapshot
+        self._ledger = ledger or Ledger("bank")
+        if not self._ledger.exists() and os.path.exists("bank.pickle"):
+            ## a bank saved before the ledger existed becomes its first saved state
+            self._bank = self._ledger.import_pickle("bank.pickle")
+        else:
+            self._bank = self._ledger.load()
         self._current_account = None
         self._choices = {
             "1": self._open_account,
@@ -115,16 +121,22 @@ class BankCli():
         logger.debug("Triggered interest and fees")
                 
     def _save(self):
-        with open("bank.pickle", "wb") as f:
-            pickle.dump(self._bank, f)
-        logger.debug("Saved to bank.pickle")
+        ## Changes are already in the ledger, saving marks a snapshot as the state load goes back to
+        self._ledger.snapshot(saved=True)
+        logger.debug("Saved a snapshot of the bank")
 
     def _load(self):
-        with open("bank.pickle", "rb") as f:   
-            self._bank = pickle.load(f)
-        logger.debug("Loaded from bank.pickle")
+        ## Go back to the last save, dropping the changes made since
+        bank = self._ledger.revert()
+        if bank is None:
+            print("There is no saved bank to load.")
+            return
+        self._bank = bank
+        self._current_account = None
+        logger.debug("Loaded the saved bank")
 
     def _quit(self):
+        self._ledger.close()
         sys.exit(0)
 
 if __name__ == "__main__":
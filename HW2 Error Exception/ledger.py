@@ -0,0 +1,224 @@
+import os
+import json
+import pickle
+import logging
+import datetime
+from decimal import Decimal
+from bank import Bank
+from transaction import TransactionList
+
+logger = logging.getLogger('bank_application')
+
+class Ledger():
+    """This class saves a bank as an append-only ledger of events, plus snapshots of the state of every account.
+    Files, for the name "bank":
+    1. bank.ledger: one JSON event per line (an account was opened, or a transaction was added). Lines are only ever appended.
+    2. bank.snapshots/<seq>.json: balance, latest date and limit counts of every account after event number seq,
+       and the position in bank.ledger where the next event starts. A snapshot taken by saving the bank is marked as saved.
+    Loading reads the newest snapshot and replays only the events after it, so it takes the same time however long the history is.
+    It includes methods to:
+    1. Load the bank, and save every later change to it
+    2. Take a snapshot
+    3. Go back to the last saved snapshot, dropping the events after it
+    4. Replay the ledger up to any event or date
+    5. Read the transactions of the accounts loaded from a snapshot back from the ledger
+    6. Start the ledger from a bank saved with pickle before the ledger existed"""
+
+    def __init__(self, name="bank", snapshot_every=1000):
+        """Initialize a ledger stored in name.ledger and name.snapshots/, taking a snapshot after every snapshot_every events"""
+        self._path = f"{name}.ledger"
+        self._snapshot_dir = f"{name}.snapshots"
+        self._snapshot_every = snapshot_every
+        self._bank = None
+        self._file = None
+        self._seq = 0
+        self._since_snapshot = 0
+
+    def load(self):
+        """Build the bank from the newest snapshot and the events after it, then start saving its changes.
+        A half-written last event, left by a crash, is cut off."""
+        bank = Bank({})
+        offset = 0
+        snapshot = self._latest_snapshot()
+        if snapshot:
+            for state in snapshot["accounts"]:
+                bank.open_account(state["type"], state["id"])
+                bank.select_account(state["id"]).restore(state)
+            self._seq = snapshot["seq"]
+            offset = snapshot["offset"]
+
+        self._since_snapshot = 0
+        end = offset
+        for event, end in self._read(offset):
+            self._apply(bank, event)
+            self._seq = event["seq"]
+            self._since_snapshot += 1
+
+        if self._file:
+            self._file.close()
+        self._file = open(self._path, "ab")
+        if self._file.tell() > end:
+            logger.error(f"Dropping a half-written event at the end of {self._path}")
+            self._file.truncate(end)
+
+        self._bank = bank
+        bank.attach(self)
+        logger.debug(f"Loaded {self._path} up to event {self._seq}, replayed {self._since_snapshot} events")
+        return bank
+
+    def exists(self):
+        """Check if the ledger has been started"""
+        return os.path.exists(self._path)
+
+    def revert(self):
+        """Go back to the newest saved snapshot: the events after it and the snapshots taken since are deleted, and the
+        bank is loaded from it. Return the bank, or None if the bank was never saved, leaving everything as it was."""
+        snapshot = self._latest_snapshot(saved=True)
+        if snapshot is None:
+            return None
+        self.close()
+        with open(self._path, "r+b") as f:
+            f.truncate(snapshot["offset"])
+        for name in os.listdir(self._snapshot_dir):
+            if name.endswith(".json") and int(name[:-len(".json")]) > snapshot["seq"]:
+                os.remove(os.path.join(self._snapshot_dir, name))
+        logger.debug(f"Went back to the bank saved at event {snapshot['seq']}")
+        return self.load()
+
+    def import_pickle(self, path):
+        """Start the ledger from a bank pickled by the version of the program before the ledger, then save it.
+        Each account and its transactions are appended to the ledger as they were, without checking them again."""
+        with open(path, "rb") as f:
+            saved = _PickledBank(f).load()
+        bank = self.load()
+        for id, account in saved._accounts.items():
+            bank.open_account(account.type.lower(), id)
+            restored = bank.select_account(id)
+            for t in account._transactions:
+                restored.apply_transaction(t.amount, t.type, t.date)
+                self.record_transaction(restored, t.amount, t.type, t.date)
+        self.snapshot(saved=True)
+        logger.debug(f"Imported {len(saved._accounts)} accounts from {path}")
+        return bank
+
+    def replay(self, seq=None, date=None):
+        """Build a separate copy of the bank as it was after event number seq, or at the end of date.
+        Opening an account has no date, so with date every account is in the copy, with the transactions up to that date.
+        Reads the ledger from the start. The copy isn't saved anywhere."""
+        bank = Bank({})
+        for event, _ in self._read(0):
+            if seq is not None and event["seq"] > seq:
+                break
+            if date is not None and event["event"] == "transaction" and event["date"] > date.isoformat():
+                continue
+            self._apply(bank, event)
+        return bank
+
+    def record_open(self, account):
+        """Append an event for a newly opened account"""
+        self._append({"event": "open", "account": account.id, "type": account.type.lower()})
+
+    def record_transaction(self, account, amount, type, date):
+        """Append an event for a transaction added to an account"""
+        self._append({"event": "transaction", "account": account.id, "amount": str(amount),
+                      "type": type, "date": date.isoformat()})
+
+    def snapshot(self, saved=False):
+        """Save the state of every account as of the latest event. saved marks it as the state revert() goes back to.
+        The snapshot is written to a temporary file first, so a crash never leaves a partial one."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        os.makedirs(self._snapshot_dir, exist_ok=True)
+        snapshot = {
+            "seq": self._seq,
+            "offset": self._file.tell(),
+            "saved": saved,
+            "accounts": [account.snapshot() for account in self._bank.accounts()],
+        }
+        path = os.path.join(self._snapshot_dir, f"{self._seq:09}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._since_snapshot = 0
+        logger.debug(f"Saved snapshot at event {self._seq}")
+
+    def load_transactions(self):
+        """Read the transactions of every account restored from a snapshot back from the ledger, in one pass over it.
+        Listing each account then costs one read of the ledger in total, however many accounts there are."""
+        self._file.flush()
+        missing = {account.id: account for account in self._bank.accounts() if not account.has_transactions()}
+        transactions = {id: TransactionList() for id in missing}
+        for event, _ in self._read(0):
+            if event["event"] == "transaction" and event["account"] in transactions:
+                transactions[event["account"]].add(Decimal(event["amount"]), event["type"],
+                                                   datetime.date.fromisoformat(event["date"]))
+        for id, account in missing.items():
+            account.restore_transactions(transactions[id])
+
+    def close(self):
+        """Write out any buffered events and close the ledger"""
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _append(self, event):
+        """Number the event, append it and take a snapshot if enough events have been appended since the last one"""
+        self._seq += 1
+        self._file.write(json.dumps({"seq": self._seq, **event}).encode() + b"\n")
+        self._file.flush()
+        self._since_snapshot += 1
+        if self._since_snapshot >= self._snapshot_every:
+            self.snapshot()
+
+    def _apply(self, bank, event):
+        """Make the change an event records, without checking it again or appending it"""
+        if event["event"] == "open":
+            bank.open_account(event["type"], event["account"])
+        elif event["event"] == "transaction":
+            bank.select_account(event["account"]).apply_transaction(
+                Decimal(event["amount"]), event["type"], datetime.date.fromisoformat(event["date"]))
+
+    def _read(self, offset):
+        """Yield (event, offset after it) for every complete event from offset on"""
+        if not os.path.exists(self._path):
+            return
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    return
+                offset += len(line)
+                yield event, offset
+
+    def _latest_snapshot(self, saved=False):
+        """Return the newest snapshot, or the newest saved one if saved is True. None if there is none"""
+        if not os.path.isdir(self._snapshot_dir):
+            return None
+        names = sorted(name for name in os.listdir(self._snapshot_dir) if name.endswith(".json"))
+        for name in reversed(names):
+            with open(os.path.join(self._snapshot_dir, name)) as f:
+                snapshot = json.load(f)
+            if not saved or snapshot.get("saved"):
+                return snapshot
+        return None
+
+
+class _PickledBank(pickle.Unpickler):
+    """Reads a bank pickled before the ledger existed. Its Bank, accounts and transactions are loaded as plain objects
+    with the attributes they had then, since today's classes store them differently."""
+
+    class Saved():
+        """An object of the old bank, holding whatever attributes were pickled"""
+
+    def find_class(self, module, name):
+        if module in ("bank", "account", "transaction"):
+            return self.Saved
+        if (module, name) in (("decimal", "Decimal"), ("datetime", "date")):
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"{module}.{name} is not part of a saved bank")
@@ -0,0 +1,182 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from datetime import date
+from decimal import Decimal
+
+import account
+import bank
+import transaction
+from ledger import Ledger
+from account import TransactionLimitError
+
+
+class LedgerTestCase(unittest.TestCase):
+    """Keeps each test's ledger in its own directory"""
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._name = os.path.join(self._directory, "bank")
+        self.ledger = Ledger(self._name, snapshot_every=4)
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self._directory)
+
+    def reopen(self):
+        """Close the ledger and load the bank again from its files, as starting the program does"""
+        self.ledger.close()
+        self.ledger = Ledger(self._name, snapshot_every=4)
+        return self.ledger.load()
+
+    def make_bank(self):
+        """Checking account with interest and a fee, savings account with deposits on two days"""
+        b = self.ledger.load()
+        checking = b.select_account(b.open_account("checking"))
+        checking.add_transaction(Decimal("100.50"), date(2024, 1, 2))
+        checking.add_transaction(Decimal("-20"), date(2024, 1, 20))
+        checking.interest_and_fee()
+        savings = b.select_account(b.open_account("savings"))
+        savings.add_transaction(Decimal("50"), date(2024, 2, 1))
+        savings.add_transaction(Decimal("10.25"), date(2024, 2, 1))
+        savings.add_transaction(Decimal("-5"), date(2024, 2, 3))
+        return b, checking.id, savings.id
+
+
+class TestReplay(LedgerTestCase):
+    """Focus on rebuilding the bank from its snapshots and events"""
+    def test_reload_keeps_balances(self):
+        b, checking, savings = self.make_bank()
+        balances = {x.id: x.balance for x in b.accounts()}
+        reloaded = self.reopen()
+        self.assertEqual({x.id: x.balance for x in reloaded.accounts()}, balances)
+
+    def test_balance_as_of_round_trips(self):
+        b, checking, savings = self.make_bank()
+        days = [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 31), date(2024, 2, 1), date(2024, 2, 3), date(2024, 3, 1)]
+        expected = {id: [b.select_account(id).balance_as_of(day) for day in days] for id in (checking, savings)}
+        reloaded = self.reopen()
+        for id in (checking, savings):
+            restored = reloaded.select_account(id)
+            self.assertEqual([restored.balance_as_of(day) for day in days], expected[id])
+            self.assertEqual(restored.balance_as_of(days[-1]), restored.balance)
+
+    def test_replay_to_event_and_date(self):
+        b, checking, savings = self.make_bank()
+        self.assertEqual(self.ledger.replay(seq=2).select_account(checking).balance, Decimal("100.50"))
+        copy = self.ledger.replay(date=date(2024, 2, 1))
+        self.assertEqual(copy.select_account(savings).balance, Decimal("60.25"))
+        self.assertEqual(copy.select_account(checking).balance, b.select_account(checking).balance)
+        full = self.ledger.replay()
+        self.assertEqual({x.id: x.balance for x in full.accounts()}, {x.id: x.balance for x in b.accounts()})
+
+    def test_limits_survive_reload(self):
+        b, checking, savings = self.make_bank()
+        b.select_account(savings).add_transaction(Decimal("1"), date(2024, 2, 3))
+        reloaded = self.reopen()
+        with self.assertRaises(TransactionLimitError):
+            reloaded.select_account(savings).add_transaction(Decimal("1"), date(2024, 2, 3))
+
+    def test_half_written_event_is_dropped(self):
+        self.make_bank()
+        with open(self._name + ".ledger", "ab") as f:
+            f.write(b'{"seq": 99, "event": "open"')
+        reloaded = self.reopen()
+        self.assertEqual(len(reloaded.accounts()), 2)
+
+
+class TestSaveAndLoad(LedgerTestCase):
+    """Focus on going back to the last saved bank"""
+    def test_revert_drops_changes_since_save(self):
+        b, checking, savings = self.make_bank()
+        self.ledger.snapshot(saved=True)
+        saved = {x.id: x.balance for x in b.accounts()}
+        b.select_account(checking).add_transaction(Decimal("500"), date(2024, 3, 1))
+        b.open_account("savings")
+        reverted = self.ledger.revert()
+        self.assertEqual({x.id: x.balance for x in reverted.accounts()}, saved)
+        ## the dropped changes are gone for good
+        self.assertEqual({x.id: x.balance for x in self.reopen().accounts()}, saved)
+
+    def test_revert_keeps_ledger_usable(self):
+        b, checking, savings = self.make_bank()
+        self.ledger.snapshot(saved=True)
+        b.select_account(checking).add_transaction(Decimal("500"), date(2024, 3, 1))
+        reverted = self.ledger.revert()
+        reverted.select_account(checking).add_transaction(Decimal("1"), date(2024, 3, 2))
+        reloaded = self.reopen()
+        self.assertEqual(reloaded.select_account(checking).balance_as_of(date(2024, 3, 1)),
+                         reverted.select_account(checking).balance - 1)
+        self.assertEqual(reloaded.select_account(checking).balance, reverted.select_account(checking).balance)
+
+    def test_revert_without_save(self):
+        b, checking, savings = self.make_bank()
+        self.assertIsNone(self.ledger.revert())
+        self.assertEqual(len(self.reopen().accounts()), 2)
+
+
+def _old_class(module, name):
+    """A class with the name of one from before the ledger, which kept its attributes in a __dict__"""
+    return type(name, (), {"__module__": module.__name__, "__qualname__": name})
+
+
+def _old(cls, **state):
+    """An object of an old class with the given attributes"""
+    obj = cls()
+    obj.__dict__.update(state)
+    return obj
+
+
+class TestImportPickle(LedgerTestCase):
+    """Focus on starting the ledger from a bank.pickle saved before it existed"""
+    def write_pickle(self):
+        """Pickle a bank the way the program before the ledger did: the same class names, with the attributes in a __dict__"""
+        path = os.path.join(self._directory, "bank.pickle")
+        Bank = _old_class(bank, "Bank")
+        Checking = _old_class(account, "CheckingAccount")
+        Savings = _old_class(account, "SavingsAccount")
+        Transaction = _old_class(transaction, "Transaction")
+        checking = _old(Checking, balance=Decimal("80.50"), _transactions=[
+            _old(Transaction, amount=Decimal("100.50"), type=1, date=date(2024, 1, 2)),
+            _old(Transaction, amount=Decimal("-20"), type=1, date=date(2024, 1, 20))],
+            latest_transaction_date=date(2024, 1, 20), id=1, type="Checking")
+        savings = _old(Savings, balance=Decimal("60"), _transactions=[
+            _old(Transaction, amount=Decimal("50"), type=1, date=date(2024, 2, 1)),
+            _old(Transaction, amount=Decimal("10"), type=1, date=date(2024, 2, 1))],
+            latest_transaction_date=date(2024, 2, 1), id=2, type="Savings")
+        with patch.object(bank, "Bank", Bank), patch.object(account, "CheckingAccount", Checking), \
+                patch.object(account, "SavingsAccount", Savings), patch.object(transaction, "Transaction", Transaction):
+            with open(path, "wb") as f:
+                pickle.dump(_old(Bank, _accounts={1: checking, 2: savings}), f)
+        return path
+
+    def test_import(self):
+        self.assertFalse(self.ledger.exists())
+        imported = self.ledger.import_pickle(self.write_pickle())
+        self.assertTrue(self.ledger.exists())
+        self.assertEqual([(x.id, x.type, x.balance) for x in imported.accounts()],
+                         [(1, "Checking", Decimal("80.50")), (2, "Savings", Decimal("60"))])
+        self.assertEqual(imported.select_account(1).balance_as_of(date(2024, 1, 10)), Decimal("100.50"))
+        with self.assertRaises(TransactionLimitError):
+            imported.select_account(2).add_transaction(Decimal("1"), date(2024, 2, 1))
+
+    def test_import_is_saved(self):
+        self.ledger.import_pickle(self.write_pickle())
+        reloaded = self.reopen()
+        reloaded.select_account(1).add_transaction(Decimal("5"), date(2024, 3, 1))
+        reverted = self.ledger.revert()
+        self.assertEqual(reverted.select_account(1).balance, Decimal("80.50"))
+        self.assertEqual(reverted.select_account(1).balance_as_of(date(2024, 1, 31)), Decimal("80.50"))
+
+    def test_other_classes_are_refused(self):
+        path = os.path.join(self._directory, "bank.pickle")
+        with open(path, "wb") as f:
+            pickle.dump({1: unittest.TestCase()}, f)
+        with self.assertRaises(pickle.UnpicklingError):
+            self.ledger.import_pickle(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
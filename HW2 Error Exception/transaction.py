@@ -1,7 +1,79 @@
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
 class Transaction():
     """This is a Transaction class that stores: date, amount, type (1: user_initiated; 0: system_initiated/fees & interests)"""
+    __slots__ = ("amount", "type", "date")
+
     def __init__(self, amount, type, date):
         self.amount = amount
         self.type = type
         self.date = date
-    
\ No newline at end of file
+
+class TransactionList():
+    """This class stores the transactions of an account in three parallel lists sorted by date:
+    date ordinals, the exact Decimal amounts and type codes. That is 5 bytes and a reference to the amount per transaction
+    instead of a Transaction object and a date for each.
+    Once a total up to a date has been asked for, a fourth list keeps the running total after each transaction,
+    so later totals take a binary search.
+    It includes methods to:
+    1. Insert a transaction at its place by date with a binary search
+    2. Count the user transactions between two dates
+    3. Total the transactions up to a date
+    4. Iterate over the transactions as Transaction objects, oldest first"""
+    __slots__ = ("_dates", "_amounts", "_types", "_totals")
+
+    def __init__(self):
+        """Initialize an empty list"""
+        self._dates = array("i")
+        self._amounts = []
+        self._types = array("b")
+        ## running totals, None until first needed. Only the first len(_totals) are up to date.
+        self._totals = None
+
+    def add(self, amount, type, date):
+        """Insert a transaction after the ones with the same or an earlier date"""
+        ordinal = date.toordinal()
+        ## Transactions usually come in date order, which is just an append
+        if not self._dates or ordinal >= self._dates[-1]:
+            self._dates.append(ordinal)
+            self._amounts.append(amount)
+            self._types.append(type)
+            if self._totals is not None and len(self._totals) == len(self._amounts) - 1:
+                self._totals.append((self._totals[-1] if self._totals else Decimal(0)) + amount)
+        else:
+            i = bisect_right(self._dates, ordinal)
+            self._dates.insert(i, ordinal)
+            self._amounts.insert(i, amount)
+            self._types.insert(i, type)
+            ## the totals from the new transaction on are stale, total() catches up on them when next called
+            if self._totals is not None:
+                del self._totals[i:]
+
+    def count(self, type, start, end):
+        """Count the transactions of a type dated from start up to and including end"""
+        first = bisect_left(self._dates, start.toordinal())
+        last = bisect_right(self._dates, end.toordinal())
+        return self._types[first:last].count(type)
+
+    def total(self, end):
+        """Add up the transactions dated up to and including end, from Decimal(0) in date order as Account.balance is,
+        so the total after the latest transaction is the account's balance"""
+        if self._totals is None:
+            self._totals = []
+        ## bring the running totals up to date with the transactions added since they were last used
+        running = self._totals[-1] if self._totals else Decimal(0)
+        for amount in self._amounts[len(self._totals):]:
+            running += amount
+            self._totals.append(running)
+        last = bisect_right(self._dates, end.toordinal())
+        return self._totals[last - 1] if last else Decimal(0)
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __iter__(self):
+        for ordinal, amount, type in zip(self._dates, self._amounts, self._types):
+            yield Transaction(amount, type, datetime.date.fromordinal(ordinal))
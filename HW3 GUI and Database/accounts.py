@@ -1,11 +1,21 @@
 import logging
+from bisect import bisect_right
+from collections import Counter
 from decimal import Decimal
+from datetime import date
 
-from transactions import Transaction, Base
+from money import amount, interest
+from transactions import Transaction, Base, Amount, last_day_of_month
+from statements import MonthlyStatement
 from exceptions import TransactionSequenceError, OverdrawError, TransactionLimitError
 
-from sqlalchemy import Column, Integer, create_engine, ForeignKey, String
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, create_engine, ForeignKey, String, Date, func, not_, and_, or_, event
+from sqlalchemy.orm import relationship, backref, reconstructor, object_session, Session
+
+# number of transactions fetched per query when listing transactions
+TRANSACTION_PAGE_SIZE = 100
+
+logger = logging.getLogger("bank.accounts")
 
 
 class Account(Base):
@@ -17,21 +27,79 @@ class Account(Base):
     __tablename__ = 'accounts'
 
     _id = Column(Integer, primary_key=True)
-    _account_number = Column(Integer)
-    _transactions = relationship("Transaction", backref=backref("accounts"))
+    _account_number = Column(Integer, unique=True, index=True)
+    # dynamic so that appending a transaction or querying the latest ones
+    # does not load the whole history
+    _transactions = relationship("Transaction", backref=backref("accounts"), lazy="dynamic")
+    # running balance kept in step with _transactions so that reading it does
+    # not need the ledger; reconcile() recomputes it from the ledger
+    _balance = Column(Amount)
+    # date of the newest transaction, the earliest date a new one may have
+    _latest_date = Column(Date)
+
+    # bumped by every UPDATE of the row. An update made with a stale version
+    # matches no row and raises StaleDataError instead of overwriting the
+    # balance written by another process, see storage.run_with_retry
+    _version = Column(Integer, nullable=False, server_default="0")
 
     _type = Column(String)
     __mapper_args__ = {
         'polymorphic_identity': 'account',
         'polymorphic_on': _type,
+        'version_id_col': _version,
     }
 
     _bank_id = Column(Integer, ForeignKey("banks._id"))
+
+    # limits on the number of non-exempt transactions, None means no limit
+    _daily_limit = None
+    _monthly_limit = None
     
     def __init__(self, acct_num, type):
         self._account_number = acct_num
         self._type = type
-        logging.debug(f"Created account: {self._account_number}")
+        self._balance = amount(0)
+        # a new account has no transactions, so its counts start out built
+        self._day_counts = Counter()
+        self._month_counts = Counter()
+        self._exempt_months = set()
+        self._statement = None
+        self._balance_index = ([], [])
+        # version of the row the counts, interest months and balance index
+        # match, None for an account that has not been inserted yet
+        self._state_version = None
+        logger.debug("Created account: %s", acct_num)
+
+    @reconstructor
+    def _init_on_load(self):
+        "Called by SQLAlchemy instead of __init__ when an account is loaded from the database"
+        # the transaction counts are not persisted, they are rebuilt from the
+        # transactions table the first time a limit has to be checked
+        self._day_counts = None
+        self._month_counts = None
+        self._exempt_months = None
+        # statement of the month transactions are currently being added to
+        self._statement = None
+        # dates of the transactions in date order and the balance after each,
+        # built from the transactions table the first time balance_as_of needs it
+        self._balance_index = None
+        # nothing is built, so the version is taken when something first is
+        self._state_version = None
+
+    def _check_state_version(self):
+        """Drops the counts, interest months and balance index if the account's row changed since they were built,
+        e.g. because another session or process committed a transaction on it. Changes flushed by this session
+        keep them, see _keep_flushed_state.
+        """
+        version = self._version
+        if self._state_version != version:
+            if self._state_version is not None:
+                logger.debug("Account %s changed elsewhere, rebuilding its counts", self._account_number)
+                self._day_counts = None
+                self._month_counts = None
+                self._exempt_months = None
+                self._balance_index = None
+            self._state_version = version
 
     def _get_acct_num(self):
         return self._account_number
@@ -39,11 +107,13 @@ class Account(Base):
     account_number = property(_get_acct_num)
 
     def add_transaction(self, amt, date, session, exempt=False):
-        """Creates a new transaction and checks to see if it is allowed, adding it to the account if it is.
+        """Creates a new transaction and checks to see if it is allowed, adding it to the account and the session if it is.
+        The caller commits the session.
 
         Args:
             amt (Decimal): amount for new transaction
             date (Date): Date for the new transaction.
+            session (Session): session to add the transaction to
             exempt (bool, optional): Determines whether the transaction is exempt from account limits. Defaults to False.
         """
 
@@ -52,14 +122,32 @@ class Account(Base):
                         date=date, 
                         exempt=exempt)
 
+        self._check_transaction(t)
+        self._record_transaction(t)
+
+        # the transaction already carries the account number, appending it to
+        # the dynamic _transactions relationship would only build a query
+        session.add(t)
+
+    def _check_transaction(self, t):
+        """Checks whether an incoming transaction is allowed, raising the matching exception if it is not. Exempt transactions are always allowed.
+
+        Args:
+            t (Transaction): pending transaction
+        """
         if not t.is_exempt():
             self._check_balance(t)
             self._check_limits(t)
             self._check_date(t)
-        self._transactions.append(t)
 
-        session.add(t)
-        session.commit()
+    def _load_state(self):
+        """Builds the running balance, latest date and transaction counts of this account if they have not been built yet. 
+        Transactions inserted without going through the ORM are only tracked once this has been called.
+        """
+        self.get_balance()
+        self._get_latest_date()
+        self._get_counts()
+        self._get_exempt_months()
 
     def _check_balance(self, t):
         """Checks whether an incoming transaction would overdraw the account
@@ -74,40 +162,335 @@ class Account(Base):
             raise OverdrawError()
 
     def _check_limits(self, t):
-        pass
+        """Checks whether an incoming transaction would go over the daily or monthly limit of this account type
+
+        Args:
+            t (Transaction): pending transaction
+        """
+        if self._daily_limit is None and self._monthly_limit is None:
+            return
+        day_counts, month_counts = self._get_counts()
+        if self._daily_limit is not None and day_counts[t.date] >= self._daily_limit:
+            raise TransactionLimitError("day", self._daily_limit)
+        if self._monthly_limit is not None and month_counts[(t.date.year, t.date.month)] >= self._monthly_limit:
+            raise TransactionLimitError("month", self._monthly_limit)
+
+    def _get_counts(self):
+        """Gets the number of non-exempt transactions on this account per day and per month, 
+        building the counts from the transactions table if they have not been built yet
+
+        Returns:
+            tuple: Counter keyed by date, Counter keyed by (year, month)
+        """
+        self._check_state_version()
+        if self._day_counts is None:
+            self._day_counts = Counter()
+            self._month_counts = Counter()
+            for day, count in self._counts_query(object_session(self)):
+                self._day_counts[day] += count
+                self._month_counts[(day.year, day.month)] += count
+        return self._day_counts, self._month_counts
+
+    def _count_transaction(self, t):
+        "Adds a new transaction to the counts if they have been built"
+        # counts that have not been built yet will pick the transaction up
+        # from the table when they are
+        if self._day_counts is not None and not t.is_exempt():
+            self._day_counts[t.date] += 1
+            self._month_counts[(t.date.year, t.date.month)] += 1
+        if self._exempt_months is not None and t.is_exempt():
+            self._exempt_months.add((t.date.year, t.date.month))
 
     def _check_date(self, t):
-        if len(self._transactions) > 0:
-            latest_transaction = max(self._transactions)
-            if t < latest_transaction:
-                raise TransactionSequenceError(latest_transaction.date)
+        latest_date = self._get_latest_date()
+        if latest_date is not None and t.date < latest_date:
+            raise TransactionSequenceError(latest_date)
+
+    def _get_latest_date(self):
+        """Gets the date of the newest transaction on this account
+
+        Returns:
+            Date: latest transaction date or None if there are no transactions
+        """
+        # accounts saved before the column existed look it up once
+        if self._latest_date is None:
+            self._latest_date = self._latest_date_query(object_session(self)).scalar()
+        return self._latest_date
+
+    def _get_exempt_months(self):
+        """Gets the months that already have an interest or fee transaction, 
+        loading them from the transactions table if they have not been loaded yet
+
+        Returns:
+            set: (year, month) tuples
+        """
+        self._check_state_version()
+        if self._exempt_months is None:
+            rows = self._exempt_dates_query(object_session(self))
+            self._exempt_months = {(day.year, day.month) for day, in rows}
+        return self._exempt_months
+
+    def _counts_query(self, session):
+        "Query for the number of non-exempt transactions on this account per date"
+        return session.query(Transaction._date, func.count(Transaction.id)) \
+            .filter(Transaction._acct_num == self._account_number, not_(Transaction._exempt)) \
+            .group_by(Transaction._date)
+
+    def _latest_date_query(self, session):
+        "Query for the date of the newest transaction on this account"
+        return session.query(func.max(Transaction._date)) \
+            .filter(Transaction._acct_num == self._account_number)
+
+    def _balance_index_query(self, session):
+        "Query for the date and amount of every transaction on this account, in the order they were added"
+        return session.query(Transaction._date, Transaction._amt) \
+            .filter(Transaction._acct_num == self._account_number) \
+            .order_by(Transaction._date, Transaction.id)
+
+    def _exempt_dates_query(self, session):
+        "Query for the distinct dates of interest and fee transactions on this account"
+        return session.query(Transaction._date) \
+            .filter(Transaction._acct_num == self._account_number, Transaction._exempt) \
+            .distinct()
+
+    def _record_transaction(self, t):
+        """Updates the running balance, latest date, counts and monthly statement for a transaction that is being added.
+        Must be called before the transaction is added to the session, since anything not built yet is loaded from the table.
+
+        Args:
+            t (Transaction): accepted transaction
+        """
+        self._check_state_version()
+        balance = self.get_balance()
+        self._get_statement_for(t.date, balance).add(t)
+        self._balance = balance + t._amt
+        if self._balance_index is not None:
+            dates, balances = self._balance_index
+            if dates and t.date < dates[-1]:
+                # only a transaction at the end keeps the index in date order
+                self._balance_index = None
+            else:
+                dates.append(t.date)
+                balances.append(self._balance)
+        latest_date = self._get_latest_date()
+        if latest_date is None or latest_date < t.date:
+            self._latest_date = t.date
+        self._count_transaction(t)
+
+    def _get_statement_for(self, day, balance):
+        """Gets the statement a new transaction on the given date belongs to, creating it if the month has none yet.
+
+        Args:
+            day (Date): date of the new transaction
+            balance (Decimal): balance before the new transaction
+
+        Returns:
+            MonthlyStatement: statement for the month of day
+        """
+        if self._statement is None or not self._statement.covers(day):
+            session = object_session(self)
+            self._statement = self.get_statement(day.year, day.month)
+            if self._statement is None:
+                # the month may already have transactions if they were added
+                # before statements existed, so they are totalled first
+                self._statement = self._statement_from_ledger(day.year, day.month, balance)
+                session.add(self._statement)
+        return self._statement
+
+    def _statement_from_ledger(self, year, month, balance):
+        """Builds the statement for a month from the transactions table.
+
+        Args:
+            year (int): year of the month
+            month (int): month number
+            balance (Decimal): balance after the last transaction in the month so far
+
+        Returns:
+            MonthlyStatement: new statement that has not been added to a session
+        """
+        first = date(year, month, 1)
+        transactions = self._transactions \
+            .filter(Transaction._date.between(first, last_day_of_month(first))) \
+            .order_by(Transaction._date, Transaction.id).all()
+        statement = MonthlyStatement(self._account_number, year, month, balance - sum(transactions, amount(0)))
+        for t in transactions:
+            statement.add(t)
+        return statement
+
+    def get_statement(self, year, month):
+        """Gets the statement of one month.
+
+        Args:
+            year (int): year of the month
+            month (int): month number
+
+        Returns:
+            MonthlyStatement: statement or None if the account had no transactions that month
+        """
+        return object_session(self).query(MonthlyStatement) \
+            .filter(MonthlyStatement._acct_num == self._account_number,
+                    MonthlyStatement._year == year, MonthlyStatement._month == month).first()
+
+    def reconcile_statements(self):
+        """Recomputes every monthly statement from the transactions and rewrites those that do not match.
+
+        Returns:
+            list: (year, month) of each statement that was missing or wrong
+        """
+        session = object_session(self)
+        expected = {}
+        balance = amount(0)
+        for t in self.iter_transactions():
+            key = (t.date.year, t.date.month)
+            if key not in expected:
+                expected[key] = MonthlyStatement(self._account_number, key[0], key[1], balance)
+            expected[key].add(t)
+            balance += t._amt
+
+        stored = {(x._year, x._month): x for x in session.query(MonthlyStatement)
+                  .filter(MonthlyStatement._acct_num == self._account_number)}
+        fixed = []
+        for key, statement in sorted(expected.items()):
+            if key not in stored:
+                session.add(statement)
+                fixed.append(key)
+            elif stored[key].totals() != statement.totals():
+                stored[key].copy_totals(statement)
+                fixed.append(key)
+        for key in sorted(stored.keys() - expected.keys()):
+            session.delete(stored[key])
+            fixed.append(key)
+        self._statement = None
+        return fixed
 
     def get_balance(self):
-        """Gets the balance for an account by summing its transactions
+        """Gets the balance for an account from its running balance
 
         Returns:
             Decimal: current balance
         """
-        # could have a balance variable updated when transactions are added (or removed) which is faster
-        # but this is more foolproof since it's always in sync with transactions
-        # this could be improved by caching the sum to avoid too much
-        # recalculation, while still maintaining the list as the ground truth
-        return sum(self._transactions)
+        # the transactions stay the ground truth, the running balance is only
+        # a cache of their sum. Accounts saved before the column existed have
+        # no running balance yet, so it is filled in from the ledger once.
+        if self._balance is None:
+            self._balance = self._ledger_balance()
+        return self._balance
 
-    def _assess_interest(self, latest_transaction, session):
-        """Calculates interest for an account balance and adds it as a new transaction exempt from limits.
+    def balance_as_of(self, day):
+        """Gets the balance at the end of a day, with a binary search over the running balance after each transaction
+
+        Args:
+            day (Date): date to get the balance on
+
+        Returns:
+            Decimal: balance after the last transaction on or before day, zero before the first one
+        """
+        dates, balances = self._get_balance_index()
+        i = bisect_right(dates, day)
+        return balances[i - 1] if i else amount(0)
+
+    def _get_balance_index(self):
+        """Gets the dates of the transactions on this account in date order and the balance after each one,
+        building them from the transactions table if they have not been built yet
+
+        Returns:
+            tuple: list of dates, list of balances
+        """
+        self._check_state_version()
+        if self._balance_index is None:
+            dates = []
+            balances = []
+            balance = amount(0)
+            for day, amt in self._balance_index_query(object_session(self)):
+                balance += amt
+                dates.append(day)
+                balances.append(balance)
+            self._balance_index = (dates, balances)
+        return self._balance_index
+
+    def _ledger_balance(self):
+        "Sums the transactions on this account"
+        return sum(self._transactions, amount(0))
+
+    def reconcile(self):
+        """Recomputes the running balance from the transactions and replaces it.
+
+        Returns:
+            Decimal: drift of the running balance from the ledger (running - ledger), zero if they agreed
         """
+        ledger = self._ledger_balance()
+        drift = self.get_balance() - ledger
+        if drift:
+            logger.warning("Balance drift on account %s: %s", self._account_number, drift)
+        self._balance = ledger
+        return drift
+
+    def _interest(self, balance):
+        "Returns the interest earned in one month on the given balance, rounded by money.interest"
         if self._type == 'checking':
             interest_rate = Decimal("0.0008")
         else:
             interest_rate = Decimal("0.0041")
-        self.add_transaction(self.get_balance() * interest_rate, 
-                        date=latest_transaction.last_day_of_month(), 
+        return interest(balance, interest_rate)
+
+    def _fee(self, balance):
+        "Returns the month end fee for the given balance, or None if no fee applies"
+        return None
+
+    def _assess_interest(self, month_end, session):
+        """Calculates interest for an account balance and adds it as a new transaction exempt from limits.
+        """
+        self.add_transaction(self._interest(self.get_balance()), 
+                        date=month_end, 
                         session = session,
                         exempt=True)
 
-    def _assess_fees(self, latest_transaction, session):
-        pass
+    def _assess_fees(self, month_end, session):
+        """Adds the month end fee, if any, as a new transaction exempt from limits.
+        """
+        fee = self._fee(self.get_balance())
+        if fee is not None:
+            self.add_transaction(fee,
+                                 date=month_end, 
+                                 session=session,
+                                 exempt=True)
+
+    def _month_end_amounts(self, balance):
+        """Computes the interest and fee for a month without changing the account.
+        Follows the same rules as _assess_interest and _assess_fees: the fee is based on the balance after interest.
+
+        Args:
+            balance (Decimal): balance at the end of the month, before interest
+
+        Returns:
+            list: amounts of the transactions to add, interest first
+        """
+        amounts = []
+        for amount_for in (self._interest, self._fee):
+            amt = amount_for(balance)
+            if amt is not None:
+                amounts.append(amt)
+                balance = balance + amount(amt)
+        return amounts
+
+    def _month_end_transactions(self, month_end, amounts=None):
+        """Creates the interest and fee transactions for a month and records them on this account without adding them to a session.
+
+        Args:
+            month_end (Date): last day of the month being assessed
+            amounts (list, optional): amounts from _month_end_amounts on the current balance. Defaults to None to compute them.
+
+        Returns:
+            list: new Transactions, interest first
+        """
+        if amounts is None:
+            amounts = self._month_end_amounts(self.get_balance())
+        transactions = []
+        for amt in amounts:
+            t = Transaction(amt, self._account_number, date=month_end, exempt=True)
+            self._record_transaction(t)
+            transactions.append(t)
+        return transactions
 
     def assess_interest_and_fees(self, session):
         """Used to apply interest and/or fees for this account
@@ -116,14 +499,17 @@ class Account(Base):
             TransactionSequenceError: Indicates that the new transactions were
             not newer than the most recent interest or fees transactions
         """
-        latest_transaction = max(self._transactions)
-        for t in self._transactions:
-            if t.is_exempt() and t.in_same_month(latest_transaction):
-                # found an interest or fee transaction that is already in the
-                # same month as the most recent transaction
-                raise TransactionSequenceError(t.date)
-        self._assess_interest(latest_transaction, session)
-        self._assess_fees(latest_transaction, session)
+        latest_date = self._get_latest_date()
+        if latest_date is None:
+            # nothing to assess on an account without transactions
+            return
+        month_end = last_day_of_month(latest_date)
+        if (latest_date.year, latest_date.month) in self._get_exempt_months():
+            # there is already an interest or fee transaction in the same
+            # month as the most recent transaction
+            raise TransactionSequenceError(month_end)
+        self._assess_interest(month_end, session)
+        self._assess_fees(month_end, session)
 
     def __str__(self):
         """Formats the account number and balance of the account.
@@ -133,7 +519,46 @@ class Account(Base):
 
     def get_transactions(self):
         "Returns sorted list of transactions on this account"
-        return sorted(self._transactions)
+        return list(self.iter_transactions())
+
+    def iter_transactions(self, after=None, limit=None, newest_first=False):
+        """Yields the transactions on this account ordered by date, fetching them a page at a time. 
+        Transactions on the same date are ordered by when they were added.
+
+        Args:
+            after (Transaction, optional): start after this transaction, usually the last one of the previous page. Defaults to None to start at the beginning.
+            limit (int, optional): maximum number of transactions to yield. Defaults to None for all of them.
+            newest_first (bool, optional): order from latest to oldest instead. Defaults to False.
+        """
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = TRANSACTION_PAGE_SIZE if remaining is None else min(remaining, TRANSACTION_PAGE_SIZE)
+            page = self._transaction_page(after, page_size, newest_first)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]
+            if remaining is not None:
+                remaining -= len(page)
+
+    def _transaction_page(self, after, page_size, newest_first):
+        "Fetches the page_size transactions that follow after in date order"
+        return self._transaction_page_query(after, page_size, newest_first).all()
+
+    def _transaction_page_query(self, after, page_size, newest_first):
+        "Query for the page_size transactions that follow after in date order, using (date, id) as the key"
+        query = self._transactions
+        if newest_first:
+            if after is not None:
+                query = query.filter(or_(Transaction._date < after._date,
+                                         and_(Transaction._date == after._date, Transaction.id < after.id)))
+            query = query.order_by(Transaction._date.desc(), Transaction.id.desc())
+        else:
+            if after is not None:
+                query = query.filter(or_(Transaction._date > after._date,
+                                         and_(Transaction._date == after._date, Transaction.id > after.id)))
+            query = query.order_by(Transaction._date, Transaction.id)
+        return query.limit(page_size)
 
 
 class SavingsAccount(Account):
@@ -143,30 +568,12 @@ class SavingsAccount(Account):
         'polymorphic_identity': 'savings',
     }
 
+    _daily_limit = 2
+    _monthly_limit = 5
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def _check_limits(self, t1):
-        """determines if the incoming trasaction is within the accounts transaction limits
-
-        Args:
-            t1 (Transaction): pending transaction to be checked
-
-        Returns:
-            bool: true if within limits and false if beyond limits
-        """
-        # Count number of non-exempt transactions on the same day as t1
-        num_today = len(
-            [t2 for t2 in self._transactions if not t2.is_exempt() and t2.in_same_day(t1)])
-        # Count number of non-exempt transactions in the same month as t1
-        num_this_month = len(
-            [t2 for t2 in self._transactions if not t2.is_exempt() and t2.in_same_month(t1)])
-        # check counts against daily and monthly limits
-        if num_today >= 2:
-            raise TransactionLimitError("day", 2)
-        if num_this_month >= 5:
-            raise TransactionLimitError("month", 5)
-
     def __str__(self):
         """Formats the type, account number, and balance of the account.
         For example, 'Savings#000000001,<tab>balance: $50.00'
@@ -184,14 +591,12 @@ class CheckingAccount(Account):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def _assess_fees(self, latest_transaction, session):
-        """Adds a low balance fee if balance is below a particular threshold. Fee amount and balance threshold are defined on the CheckingAccount.
+    def _fee(self, balance):
+        """Returns a low balance fee if balance is below a particular threshold. Fee amount and balance threshold are defined on the CheckingAccount.
         """
-        if self.get_balance() < 100:
-            self.add_transaction(Decimal("-5.44"),
-                                 date=latest_transaction.last_day_of_month(), 
-                                 session=session,
-                                 exempt=True)
+        if balance < 100:
+            return Decimal("-5.44")
+        return None
 
     def __str__(self):
         """Formats the type, account number, and balance of the account.
@@ -199,6 +604,27 @@ class CheckingAccount(Account):
         """
         return "Checking" + super().__str__()
 
+@event.listens_for(Session, "after_flush")
+def _keep_flushed_state(session, flush_context):
+    """Moves the state version of accounts this session just inserted or updated to their new row version,
+    when the counts were up to date before the flush. The flush bumped the version for this session's own changes,
+    which the counts already include. An update made on a stale version raises StaleDataError instead."""
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Account) or obj._version is None:
+            continue
+        before = None if obj in session.new else obj._version - 1
+        if obj._state_version == before:
+            obj._state_version = obj._version
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_account_state(session):
+    """Drops the in-memory counts and statement of every account in a session that was rolled back. 
+    They may include work that was undone, or miss work another process committed meanwhile."""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Account):
+            obj._init_on_load()
+
 if __name__ == "__main__":
     # if the db file already exists, this does nothing
     engine = create_engine(f"sqlite:///notebook.db")
@@ -1,37 +1,100 @@
-from accounts import SavingsAccount, CheckingAccount, Base
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from datetime import date as Date
 
-from sqlalchemy import Column, Integer, create_engine
-from sqlalchemy.orm import declarative_base, relationship, backref
+from accounts import Account, SavingsAccount, CheckingAccount, Base
+from transactions import Transaction, last_day_of_month
+from statements import MonthlyStatement
+from money import amount
+from exceptions import AccountNotFoundError, OverdrawError, TransactionLimitError, TransactionSequenceError
+
+from sqlalchemy import Column, Integer, create_engine, insert, update, select, bindparam, func, not_, event
+from sqlalchemy.orm import declarative_base, relationship, backref, reconstructor, object_session, Session
+from sqlalchemy.orm.exc import StaleDataError
 
 SAVINGS = "savings"
 CHECKING = "checking"
 
+# number of imported transactions sent to the database per executemany
+IMPORT_BATCH_SIZE = 10000
+# number of accounts import_transactions reads the state of per query
+IMPORT_QUERY_SIZE = 500
+# MonthlyStatement columns in the order of MonthlyStatement.totals
+_STATEMENT_FIELDS = ("_opening", "_closing", "_deposits", "_withdrawals", "_interest", "_fees", "_count")
+
 class Bank(Base):
 
     ## initilaize SQLAlchemy table
     __tablename__ = 'banks'
     _id = Column(Integer, primary_key=True)
     _accounts = relationship("Account", backref=backref("banks"))
+    # SQLite has no sequences, so the last account number handed out is kept
+    # here. Numbers are never reused, unlike counting the accounts.
+    _last_account_number = Column(Integer)
+    # guards _last_account_number against two processes opening accounts at once
+    _version = Column(Integer, nullable=False, server_default="0")
+    __mapper_args__ = {
+        'version_id_col': _version,
+    }
+    # place of this bank's file in a bank split over several files, see
+    # shards.py. Its account numbers are those with (number - 1) % _shard_count == _shard.
+    # Both are null for a bank kept in one file.
+    _shard = Column(Integer)
+    _shard_count = Column(Integer)
+
+    def __init__(self, shard=None, shard_count=None):
+        """
+        Args:
+            shard (int, optional): index of this bank's file among the shards. Defaults to None, for a bank in one file.
+            shard_count (int, optional): number of shards. Defaults to None, for a bank in one file.
+        """
+        self._last_account_number = 0
+        self._shard = shard
+        self._shard_count = shard_count
+        self._accounts_by_number = {}
+
+    @reconstructor
+    def _init_on_load(self):
+        "Called by SQLAlchemy instead of __init__ when a bank is loaded from the database"
+        # identity cache for get_account, filled as accounts are looked up
+        self._accounts_by_number = {}
 
     def add_account(self, acct_type, session):
-        """Creates a new Account object and adds it to this bank object. The Account will be a SavingsAccount or CheckingAccount, depending on the type given.
+        """Creates a new Account object and adds it to this bank object and the session. The Account will be a SavingsAccount or CheckingAccount, depending on the type given.
+        The caller commits the session.
 
         Args:
             type (string): "Savings" or "Checking" to indicate the type of account to create
+
+        Returns:
+            Account: the new account, or None if the type was not recognized
         """
-        acct_num = self._generate_account_number()
         if acct_type == SAVINGS:
-            a = SavingsAccount(acct_num, acct_type)
+            a = SavingsAccount(self._generate_account_number(), acct_type)
         elif acct_type == CHECKING:
-            a = CheckingAccount(acct_num, acct_type)
+            a = CheckingAccount(self._generate_account_number(), acct_type)
         else:
             return None
-        self._accounts.append(a)
+        # setting the backref links the account without loading self._accounts,
+        # which would read every account of the bank
+        a.banks = self
+        self._accounts_by_number[a.account_number] = a
         session.add(a)
-        session.commit()
+        return a
 
     def _generate_account_number(self):
-        return len(self._accounts) + 1
+        self._last_account_number = self.next_account_number()
+        return self._last_account_number
+
+    def next_account_number(self):
+        "Returns the number the next new account will be given"
+        # banks saved before the column existed continue after the highest
+        # account number in use
+        if self._last_account_number is None:
+            self._last_account_number = object_session(self).query(func.max(Account._account_number)).scalar() or 0
+        if not self._last_account_number:
+            return (self._shard or 0) + 1
+        return self._last_account_number + (self._shard_count or 1)
 
     def show_accounts(self):
         "Accessor method to return accounts"
@@ -46,10 +109,408 @@ class Bank(Base):
         Returns:
             Account: matching account or None if not found
         """        
+        account = self._accounts_by_number.get(account_num)
+        if account is None:
+            account = self._account_query(object_session(self), account_num).first()
+            if account is not None:
+                self._accounts_by_number[account_num] = account
+        return account
+
+    def import_transactions(self, rows, session):
+        """Adds many transactions at once, checking each one against the same rules as Account.add_transaction.
+        Accepted transactions are inserted in batches in the session's transaction, the caller commits them together. Rejected rows are skipped and reported.
+
+        The rows are checked against plain copies of the accounts' balances, latest dates, counts and statements,
+        loaded for all of them in a few queries. The transactions, statements and accounts are then written with
+        executemany and the accounts are expired, so they pick the new state up from the tables.
+
+        Args:
+            rows (iterable): (account number, amount, date) rows. Values may be strings, dates are then YYYY-MM-DD
+            session (Session): session to insert the transactions with
+
+        Returns:
+            list: (row number, exception) for each rejected row, counting rows from 1
+        """
+        errors = []
+        parsed = []
+        for row_num, row in enumerate(rows, start=1):
+            try:
+                acct_num, amt, date = row
+                acct_num = int(acct_num)
+                amt = amount(Decimal(amt))
+                if isinstance(date, str):
+                    date = Date.fromisoformat(date)
+            except (ValueError, InvalidOperation) as ex:
+                errors.append((row_num, ex))
+                continue
+            parsed.append((row_num, acct_num, amt, date))
+        if not parsed:
+            return errors
+
+        # the tables must hold everything the session changed before they are
+        # read, and nothing the import changes may be flushed behind its back
+        session.flush()
+        with session.no_autoflush:
+            imports = self._load_imports({(acct_num, date.year, date.month) for _, acct_num, _, date in parsed}, session)
+            batch = []
+            for row_num, acct_num, amt, date in parsed:
+                try:
+                    x = imports.get(acct_num)
+                    if x is None:
+                        raise AccountNotFoundError(acct_num)
+                    x.add(amt, date)
+                except (AccountNotFoundError, OverdrawError, TransactionLimitError, TransactionSequenceError) as ex:
+                    errors.append((row_num, ex))
+                    continue
+
+                batch.append({"_amt": amt, "_date": date, "_exempt": False, "_acct_num": acct_num})
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    session.execute(insert(Transaction), batch)
+                    batch = []
+
+            if batch:
+                session.execute(insert(Transaction), batch)
+            self._save_imports([x for x in imports.values() if x.changed()], session)
+        return sorted(errors, key=lambda x: x[0])
+
+    def _load_imports(self, months, session):
+        """Loads what import_transactions checks rows against for every account that has rows, in a few queries.
+
+        Args:
+            months (set): (account number, year, month) of every row
+            session (Session): session the bank was loaded in
+
+        Returns:
+            dict: _ImportedAccount by account number, for the accounts of this bank
+        """
+        numbers = sorted({acct_num for acct_num, _, _ in months})
+        missing = [n for n in numbers if n not in self._accounts_by_number]
+        for i in range(0, len(missing), IMPORT_QUERY_SIZE):
+            for x in self._accounts_query(session, missing[i:i + IMPORT_QUERY_SIZE]):
+                self._accounts_by_number[x.account_number] = x
+        accounts = [self._accounts_by_number[n] for n in numbers if n in self._accounts_by_number]
+        first = min(Date(year, month, 1) for _, year, month in months)
+        last = max((year, month) for _, year, month in months)
+
+        imports = {}
+        for i in range(0, len(accounts), IMPORT_QUERY_SIZE):
+            chunk = accounts[i:i + IMPORT_QUERY_SIZE]
+            limited = [x.account_number for x in chunk
+                       if x._daily_limit is not None or x._monthly_limit is not None]
+            counts = {}
+            if limited:
+                for acct_num, day, count in session.execute(
+                        select(Transaction._acct_num, Transaction._date, func.count(Transaction.id))
+                        .where(Transaction._acct_num.in_(limited), not_(Transaction._exempt), Transaction._date >= first)
+                        .group_by(Transaction._acct_num, Transaction._date)):
+                    counts.setdefault(acct_num, []).append((day, count))
+            statements = {}
+            for statement_id, acct_num, year, month, *totals in session.execute(
+                    select(MonthlyStatement.id, MonthlyStatement._acct_num, MonthlyStatement._year,
+                           MonthlyStatement._month, *(getattr(MonthlyStatement, f) for f in _STATEMENT_FIELDS))
+                    .where(MonthlyStatement._acct_num.in_([x.account_number for x in chunk]),
+                           (MonthlyStatement._year * 12 + MonthlyStatement._month)
+                           .between(first.year * 12 + first.month, last[0] * 12 + last[1]))):
+                if (acct_num, year, month) in months:
+                    statements.setdefault(acct_num, {})[(year, month)] = dict(zip(_STATEMENT_FIELDS, totals), id=statement_id)
+            for x in chunk:
+                imports[x.account_number] = _ImportedAccount(x, counts.get(x.account_number, ()),
+                                                            statements.get(x.account_number, {}))
+        return imports
+
+    def _save_imports(self, imports, session):
+        """Writes the statements, balances and latest dates of the accounts import_transactions added to,
+        then expires the accounts and their statements in the session.
+
+        Raises:
+            StaleDataError: an account was changed by someone else since it was loaded
+        """
+        if not imports:
+            return
+        new = []
+        changed = []
+        for x in imports:
+            for (year, month), totals in x.statements.items():
+                if totals.get("id") is None:
+                    new.append(dict(totals, _acct_num=x.account.account_number, _year=year, _month=month))
+                else:
+                    changed.append(totals)
+        if new:
+            session.execute(insert(MonthlyStatement), new)
+        if changed:
+            session.execute(update(MonthlyStatement), changed)
+
+        # the version is checked and bumped as the ORM does for an account it
+        # flushes, so a concurrent change is retried by storage.run_with_retry
+        accounts = Account.__table__
+        result = session.execute(
+            update(accounts)
+            .where(accounts.c._id == bindparam("b_id"), accounts.c._version == bindparam("b_version"))
+            .values(_balance=bindparam("b_balance"), _latest_date=bindparam("b_latest_date"),
+                    _version=accounts.c._version + 1),
+            [{"b_id": x.account._id, "b_version": x.account._version, "b_balance": x.balance,
+              "b_latest_date": x.latest_date} for x in imports])
+        if result.rowcount != len(imports):
+            raise StaleDataError(f"An account changed while transactions were imported: "
+                                 f"{len(imports)} expected to be updated, {result.rowcount} were")
+
+        changed_ids = {totals["id"] for totals in changed}
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, MonthlyStatement) and obj.id in changed_ids:
+                session.expire(obj)
+        for x in imports:
+            session.expire(x.account, ["_balance", "_latest_date", "_version"])
+            x.account._init_on_load()
+
+    def run_month_end(self, month, session):
+        """Assesses interest and fees on every account for one month in a single pass and inserts them in one batch.
+        Uses the same rules as Account.assess_interest_and_fees. Running it again for the same month adds nothing.
+        The caller commits the session. month_end.run_month_end_in_processes does the same with a pool of processes.
+
+        Args:
+            month (Date): any day in the month to assess
+            session (Session): session to insert the transactions with
+
+        Returns:
+            list: (account number, TransactionSequenceError) for each account that was skipped, because
+            interest and fees were already assessed for the month or because it has newer transactions
+        """
+        month_end = last_day_of_month(month)
+        accounts = sorted(self._accounts, key=lambda x: x.account_number)
+
+        plan = self._month_end_plan(month_end, session, accounts)
+        self._load_statements([x for x, error in plan if error is None], month_end, session)
+        errors = []
+        transactions = []
+        for x, error in plan:
+            if error is not None:
+                errors.append((x.account_number, error))
+            else:
+                transactions.extend(x._month_end_transactions(month_end))
+        self._insert_month_end(transactions, session)
+        return errors
+
+    def _month_end_plan(self, month_end, session, accounts):
+        """Decides which accounts month end assesses. Only reads, so it can run in a session on a read-only database.
+
+        Args:
+            month_end (Date): last day of the month being assessed
+            session (Session): session the accounts were loaded in
+            accounts (list): accounts to decide for, in the order to assess them
+
+        Returns:
+            list: (account, None) for each account to assess, and (account, TransactionSequenceError) for each one
+            that must be skipped. Accounts without transactions are left out.
+        """
+        # accounts saved before the latest date column existed get theirs
+        # from one grouped query instead of one query each
+        if any(x._latest_date is None for x in accounts):
+            latest_dates = dict(session.query(Transaction._acct_num, func.max(Transaction._date))
+                                .group_by(Transaction._acct_num))
+            for x in accounts:
+                if x._latest_date is None and x.account_number in latest_dates:
+                    x._latest_date = latest_dates[x.account_number]
+
+        assessed = {acct_num for acct_num, in self._assessed_query(session, month_end)}
+
+        plan = []
+        for x in accounts:
+            if x._latest_date is None:
+                # nothing to assess on an account without transactions
+                continue
+            if x.account_number in assessed:
+                plan.append((x, TransactionSequenceError(month_end)))
+            elif x._latest_date > month_end:
+                plan.append((x, TransactionSequenceError(x._latest_date)))
+            else:
+                plan.append((x, None))
+        return plan
+
+    def _load_statements(self, accounts, day, session):
+        """Loads the statements of the month of day for many accounts in one query, so recording a transaction
+        on each does not look its statement up on its own. Accounts without one yet get it made as usual.
+
+        Args:
+            accounts (list): accounts that will have transactions recorded in the month
+            day (Date): any day in the month
+            session (Session): session the accounts were loaded in
+        """
+        statements = session.query(MonthlyStatement) \
+            .join(Account, Account._account_number == MonthlyStatement._acct_num) \
+            .filter(Account._bank_id == self._id, MonthlyStatement._year == day.year, MonthlyStatement._month == day.month)
+        by_number = {x._acct_num: x for x in statements}
+        for x in accounts:
+            if (x._statement is None or not x._statement.covers(day)) and x.account_number in by_number:
+                x._statement = by_number[x.account_number]
+
+    def _insert_month_end(self, transactions, session):
+        "Inserts interest and fee transactions made by Account._month_end_transactions in one batch, in the order given"
+        batch = [{"_amt": t._amt, "_date": t._date, "_exempt": True, "_acct_num": t._acct_num} for t in transactions]
+        if batch:
+            session.execute(insert(Transaction), batch)
+
+    def month_totals(self, month, session):
+        """Adds up the monthly statements of every account for one month.
+
+        Args:
+            month (Date): any day in the month to report on
+            session (Session): session to read the statements with
+
+        Returns:
+            dict: "deposits", "withdrawals", "interest" and "fees" totals, withdrawals and fees negative,
+            and "transactions", the number of transactions
+        """
+        statements = session.query(MonthlyStatement) \
+            .join(Account, Account._account_number == MonthlyStatement._acct_num) \
+            .filter(Account._bank_id == self._id,
+                    MonthlyStatement._year == month.year, MonthlyStatement._month == month.month)
+        totals = {"deposits": amount(0), "withdrawals": amount(0), "interest": amount(0), "fees": amount(0),
+                  "transactions": 0}
+        for x in statements:
+            totals["deposits"] += x._deposits
+            totals["withdrawals"] += x._withdrawals
+            totals["interest"] += x._interest
+            totals["fees"] += x._fees
+            totals["transactions"] += x._count
+        return totals
+
+    def _assessed_query(self, session, month_end):
+        "Query for the numbers of accounts that already have interest or fee transactions in the month ending on month_end"
+        return session.query(Transaction._acct_num) \
+            .filter(Transaction._exempt, Transaction._date.between(month_end.replace(day=1), month_end)) \
+            .distinct()
+
+    def _accounts_in_range_query(self, session, first, last):
+        "Query for the accounts numbered from first to last, in number order"
+        return session.query(Account) \
+            .filter(Account._bank_id == self._id, Account._account_number.between(first, last)) \
+            .order_by(Account._account_number)
+
+    def _accounts_query(self, session, numbers):
+        "Query for the accounts with the given numbers"
+        return session.query(Account) \
+            .filter(Account._account_number.in_(numbers), Account._bank_id == self._id)
+
+    def _account_query(self, session, account_num):
+        "Query for the account with the given number"
+        return session.query(Account) \
+            .filter(Account._account_number == account_num, Account._bank_id == self._id)
+
+    def reconcile(self, session):
+        """Recomputes the running balance of every account from its transactions. The caller commits the session.
+
+        Returns:
+            dict: account number to drift for each account whose running balance did not match its ledger
+        """
+        drifts = {}
+        for x in self._accounts:
+            drift = x.reconcile()
+            if drift:
+                drifts[x.account_number] = drift
+        return drifts
+
+    def reconcile_statements(self, session):
+        """Recomputes the monthly statements of every account from its transactions. The caller commits the session.
+
+        Returns:
+            dict: account number to the (year, month) of each statement that was missing or wrong
+        """
+        fixed = {}
         for x in self._accounts:
-            if x.account_number == account_num:
-                return x
-        return None
+            months = x.reconcile_statements()
+            if months:
+                fixed[x.account_number] = months
+        return fixed
+
+class _ImportedAccount:
+    """Plain copy of what Account._check_transaction checks for one account, with the totals of the statements
+    that import_transactions adds to. Applies the same rules, in the same order, without building Transactions."""
+
+    def __init__(self, account, counts, statements):
+        """
+        Args:
+            account (Account): account being imported to
+            counts (iterable): (date, number of non-exempt transactions) for the dates of the imported months
+            statements (dict): totals of the existing statements of the imported months by (year, month),
+                keyed by MonthlyStatement column name and with the statement's "id"
+        """
+        self.account = account
+        self.balance = account.get_balance()
+        self.latest_date = account._get_latest_date()
+        # the only month that can have transactions without a statement, see _statement_for
+        self._ledger_month = None if self.latest_date is None else (self.latest_date.year, self.latest_date.month)
+        self._daily_limit = account._daily_limit
+        self._monthly_limit = account._monthly_limit
+        self._day_counts = Counter()
+        self._month_counts = Counter()
+        for day, count in counts:
+            self._day_counts[day] += count
+            self._month_counts[(day.year, day.month)] += count
+        self._existing = statements
+        # statements the import added to by (year, month)
+        self.statements = {}
+        self._month = None
+        self._totals = None
+
+    def changed(self):
+        "Checks whether any transaction was added"
+        return bool(self.statements)
+
+    def add(self, amt, day):
+        """Checks a transaction the way Account._check_transaction does and adds it if it is allowed.
+
+        Args:
+            amt (Decimal): amount, as money.amount makes it
+            day (Date): date of the transaction
+        """
+        if not (amt >= 0 or self.balance >= abs(amt)):
+            raise OverdrawError()
+        if self._daily_limit is not None and self._day_counts[day] >= self._daily_limit:
+            raise TransactionLimitError("day", self._daily_limit)
+        if self._monthly_limit is not None and self._month_counts[(day.year, day.month)] >= self._monthly_limit:
+            raise TransactionLimitError("month", self._monthly_limit)
+        if self.latest_date is not None and day < self.latest_date:
+            raise TransactionSequenceError(self.latest_date)
+
+        totals = self._statement_for(day)
+        if amt >= 0:
+            totals["_deposits"] += amt
+        else:
+            totals["_withdrawals"] += amt
+        totals["_closing"] += amt
+        totals["_count"] += 1
+        self.balance += amt
+        self.latest_date = day
+        self._day_counts[day] += 1
+        self._month_counts[(day.year, day.month)] += 1
+
+    def _statement_for(self, day):
+        "Gets the totals of the statement of the month of day, as Account._get_statement_for does"
+        month = (day.year, day.month)
+        if month != self._month:
+            self._month = month
+            self._totals = self.statements.get(month)
+            if self._totals is None:
+                self._totals = self._existing.get(month)
+                if self._totals is None:
+                    # transactions are never older than the newest one, so only its
+                    # month can already have some, saved before statements existed
+                    if month == self._ledger_month:
+                        statement = self.account._statement_from_ledger(day.year, day.month, self.balance)
+                    else:
+                        statement = MonthlyStatement(self.account.account_number, day.year, day.month, self.balance)
+                    self._totals = dict(zip(_STATEMENT_FIELDS, statement.totals()))
+                self.statements[month] = self._totals
+        return self._totals
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_bank_state(session):
+    """Empties the account cache of every bank in a session that was rolled back. 
+    It may hold accounts whose creation was undone."""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Bank):
+            obj._init_on_load()
 
 if __name__ == "__main__":
     # if the db file already exists, this does nothing
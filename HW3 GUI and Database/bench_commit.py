@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal, setcontext, BasicContext
+
+from bank import Bank, CHECKING
+from storage import PROFILES, create_bank_engine, unit_of_work
+
+from sqlalchemy.orm import sessionmaker
+
+
+def main():
+    '''
+    Measures how long adding one transaction and committing it takes, before and after storage profiles.
+    "before" is the stock SQLite settings with the two commits per transaction the CLI used to make,
+    the other rows use one commit per unit of work with each profile.
+    Input: number of transactions per run (default 500)
+    Output: mean, median and p99 latency in milliseconds per run
+    '''
+    setcontext(BasicContext)
+    logging.disable(logging.CRITICAL)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    runs = [("before (stock, 2 commits)", PROFILES["stock"], 2)]
+    runs += [(f"{name} (1 commit)", profile, 1) for name, profile in sorted(PROFILES.items())]
+
+    print(f"{'run':<28}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, profile, commits in runs:
+        ## Each run gets a fresh database file
+        with tempfile.TemporaryDirectory() as directory:
+            latencies = time_transactions(os.path.join(directory, "bank.db"), profile, commits, count)
+        latencies.sort()
+        mean = sum(latencies) / len(latencies)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{name:<28}{mean * 1000:>10.3f}{p50 * 1000:>10.3f}{p99 * 1000:>10.3f}")
+
+def time_transactions(path, profile, commits, count):
+    '''
+    Adds count deposits to a new checking account, committing after each one.
+    Input: database file, storage profile, commits per transaction, number of transactions
+    Output: list of seconds taken by each transaction including its commits
+    '''
+    engine = create_bank_engine(path, profile)
+    session = sessionmaker(bind=engine)()
+    bank = Bank()
+    session.add(bank)
+    with unit_of_work(session):
+        bank.add_account(CHECKING, session)
+    account = bank.get_account(1)
+
+    latencies = []
+    day = date(2024, 1, 1)
+    for i in range(count):
+        day += timedelta(days=1)
+        start = time.perf_counter()
+        with unit_of_work(session):
+            account.add_transaction(Decimal("10.00"), day, session)
+        ## the redundant commit the CLI made after add_transaction had already committed
+        for _ in range(commits - 1):
+            session.commit()
+        latencies.append(time.perf_counter() - start)
+
+    session.close()
+    engine.dispose()
+    return latencies
+
+if __name__ == "__main__":
+    main()
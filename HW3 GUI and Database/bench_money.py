@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import random
+import logging
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal, setcontext, BasicContext
+
+from money import amount, interest, use_integer_money
+
+RATES = (Decimal("0.0008"), Decimal("0.0041"))
+FEE = Decimal("-5.44")
+
+
+def main():
+    '''
+    Compares keeping amounts as Decimal with keeping them as integer micro-cents (money.Money).
+    First the same random accounts are run in both modes and every balance, interest and statement figure is compared,
+    exactly and as displayed with 2 decimals. Then the arithmetic the bank does on amounts is timed in each mode,
+    and last a bank.db is filled and assessed through the ORM in each mode.
+    Input: number of accounts (default 200), transactions per account (default 120)
+    Output: number of figures that differ between the modes, exactly (only where Decimal interest has more than 8
+    decimal places) and at 2 decimals (should be 0), operations per second of each mode
+    '''
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    per_account = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    setcontext(BasicContext)
+    logging.disable(logging.CRITICAL)
+
+    compared, exact, displayed = compare_modes(accounts, per_account)
+    print(f"figures compared: {compared}, differing exactly: {exact}, differing at 2 decimals: {displayed}")
+
+    print(f"\n{'operation':<22}{'decimal ops/s':>16}{'integer ops/s':>16}{'ratio':>8}")
+    for name, run in (("add", time_add), ("interest", time_interest), ("compare", time_compare),
+                      ("format ,.2f", time_format), ("sum of 1000", time_sum)):
+        rates = []
+        for integer in (False, True):
+            use_integer_money(integer)
+            rates.append(run())
+        print(f"{name:<22}{rates[0]:>16,.0f}{rates[1]:>16,.0f}{rates[1] / rates[0]:>8.2f}")
+
+    print(f"\n{'database':<22}{'decimal txn/s':>16}{'integer txn/s':>16}{'ratio':>8}")
+    rates = []
+    balances = []
+    for integer in (False, True):
+        use_integer_money(integer)
+        rate, figures = time_database(accounts // 4 or 1, per_account)
+        rates.append(rate)
+        balances.append(figures)
+    print(f"{'import and month end':<22}{rates[0]:>16,.0f}{rates[1]:>16,.0f}{rates[1] / rates[0]:>8.2f}")
+    print("database figures identical: " + ("yes" if balances[0] == balances[1] else "NO"))
+    use_integer_money(False)
+
+def random_amount(rng):
+    '''
+    Makes a transaction amount like the ones users enter, sometimes with more than 2 decimals.
+    Input: random number generator
+    Output: amount as a string
+    '''
+    if rng.random() < 0.9:
+        return f"{rng.randint(-20000, 50000) / 100:.2f}"
+    return f"{rng.randint(-2000000, 5000000) / 10 ** 6:.6f}"
+
+def run_account(amounts, rate, months):
+    '''
+    Runs one account the way Account does: a balance, transactions that would overdraw it are refused,
+    interest and the low balance fee at the end of every month, and monthly totals like MonthlyStatement.
+    Input: amounts as strings, interest rate, number of months to spread them over
+    Output: list of every figure produced, as amounts of the current mode
+    '''
+    figures = []
+    balance = amount(0)
+    per_month = len(amounts) // months or 1
+    for start in range(0, len(amounts), per_month):
+        deposits = withdrawals = amount(0)
+        for text in amounts[start:start + per_month]:
+            amt = amount(Decimal(text))
+            if amt < 0 and balance < abs(amt):
+                continue
+            if amt >= 0:
+                deposits += amt
+            else:
+                withdrawals += amt
+            balance = balance + amt
+        earned = interest(balance, rate)
+        balance = balance + amount(earned)
+        if balance < 100:
+            balance = balance + amount(FEE)
+        figures.extend((deposits, withdrawals, earned, balance))
+    return figures
+
+def compare_modes(accounts, per_account):
+    '''
+    Runs the same random accounts in both modes.
+    Input: number of accounts, transactions per account
+    Output: (figures compared, figures that differ exactly, figures that differ at 2 decimals)
+    '''
+    rng = random.Random(327)
+    workloads = [([random_amount(rng) for _ in range(per_account)], RATES[i % 2]) for i in range(accounts)]
+    results = []
+    for integer in (False, True):
+        use_integer_money(integer)
+        results.append([x for amounts, rate in workloads for x in run_account(amounts, rate, 12)])
+    use_integer_money(False)
+
+    exact = displayed = 0
+    for d, m in zip(*results):
+        exact += d != m.to_decimal()
+        displayed += f"{d:,.2f}" != f"{m:,.2f}"
+    return len(results[0]), exact, displayed
+
+def rate_of(operation, count):
+    '''
+    Times an operation.
+    Input: function doing count operations, count
+    Output: operations per second, best of 3 runs
+    '''
+    best = min(_seconds(operation) for _ in range(3))
+    return count / best
+
+def _seconds(operation):
+    start = time.perf_counter()
+    operation()
+    return time.perf_counter() - start
+
+def _amounts(count):
+    rng = random.Random(1)
+    return [amount(Decimal(f"{rng.randint(-50000, 50000) / 100:.2f}")) for _ in range(count)]
+
+def time_add():
+    values = _amounts(10000)
+    def run():
+        balance = amount(0)
+        for x in values:
+            balance = balance + x
+    return rate_of(run, len(values))
+
+def time_interest():
+    values = [abs(x) for x in _amounts(10000)]
+    def run():
+        for x in values:
+            interest(x, RATES[1])
+    return rate_of(run, len(values))
+
+def time_compare():
+    values = _amounts(10000)
+    def run():
+        for x in values:
+            x >= 0
+    return rate_of(run, len(values))
+
+def time_format():
+    values = _amounts(10000)
+    def run():
+        for x in values:
+            f"{x:,.2f}"
+    return rate_of(run, len(values))
+
+def time_sum():
+    values = _amounts(1000)
+    start = amount(0)
+    def run():
+        for _ in range(20):
+            sum(values, start)
+    return rate_of(run, 20)
+
+def time_database(accounts, per_account):
+    '''
+    Fills a new bank.db with deposits through Bank.import_transactions and runs month end on it, in the current mode.
+    Input: number of accounts, transactions per account
+    Output: (transactions per second, every balance and statement as displayed)
+    '''
+    from bank import Bank, CHECKING, SAVINGS
+    from storage import create_bank_engine, unit_of_work
+    from sqlalchemy.orm import sessionmaker
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_bank_engine(os.path.join(directory, "bank.db"))
+        session = sessionmaker(bind=engine)()
+        bank = Bank()
+        session.add(bank)
+        with unit_of_work(session):
+            for i in range(accounts):
+                bank.add_account(CHECKING if i % 2 else SAVINGS, session)
+
+        rng = random.Random(2)
+        start = time.perf_counter()
+        for month in range(1, 13):
+            rows = [(acct_num, f"{rng.randint(1, 9000) / 100:.2f}", date(2024, month, 1) + timedelta(days=day))
+                    for acct_num in range(1, accounts + 1) for day in range(per_account // 12)]
+            with unit_of_work(session):
+                bank.import_transactions(rows, session)
+            with unit_of_work(session):
+                bank.run_month_end(date(2024, month, 1), session)
+        seconds = time.perf_counter() - start
+
+        session.expire_all()
+        figures = []
+        for account in bank.show_accounts():
+            figures.append(str(account))
+            figures.extend(str(account.get_statement(2024, month)) for month in range(1, 13))
+        session.close()
+        engine.dispose()
+    return accounts * (per_account // 12) * 12 / seconds, figures
+
+if __name__ == "__main__":
+    main()
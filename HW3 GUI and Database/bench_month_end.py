@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import random
+import logging
+import tempfile
+from datetime import date, timedelta
+from decimal import setcontext, BasicContext
+
+from bank import Bank, CHECKING, SAVINGS
+from month_end import run_month_end_in_processes
+from money import use_integer_money
+from storage import create_bank_engine, unit_of_work
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+# every table month end writes to, with the columns compared between the runs
+TABLES = {
+    "transactions": "id, _acct_num, _date, _amt, _exempt",
+    "accounts": "_account_number, _balance, _latest_date, _version",
+    "monthly_statements": "*",
+}
+
+
+def main():
+    '''
+    Runs month end on copies of the same bank.db with Bank.run_month_end and with run_month_end_in_processes.
+    Both get the same deposits and withdrawals for 3 months in a row, each followed by month end, and every row of
+    the transactions, accounts and statements tables is compared afterwards.
+    This is done with Decimal and with integer money.
+    Input: number of accounts (default 2000), transactions per account and month (default 4), worker processes
+    (default one per CPU)
+    Output: seconds each way takes for each month, and whether the tables are identical (should be yes)
+    '''
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_month = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    setcontext(BasicContext)
+    logging.disable(logging.CRITICAL)
+
+    for integer in (False, True):
+        use_integer_money(integer)
+        with tempfile.TemporaryDirectory() as directory:
+            serial_path = os.path.join(directory, "serial.db")
+            parallel_path = os.path.join(directory, "parallel.db")
+            open_accounts(serial_path, accounts)
+            shutil.copy(serial_path, parallel_path)
+
+            print(f"{'integer' if integer else 'decimal'} money, {accounts} accounts, {workers} workers")
+            print(f"{'month':<10}{'serial s':>10}{'processes s':>14}")
+            for month in (date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 1)):
+                for path in (serial_path, parallel_path):
+                    run(path, lambda bank, session: bank.import_transactions(transactions(accounts, per_month, month),
+                                                                             session))
+                serial = run(serial_path, lambda bank, session: bank.run_month_end(month, session))
+                parallel = run(parallel_path,
+                               lambda bank, session: run_month_end_in_processes(bank, month, session, workers))
+                print(f"{month:%Y-%m}{serial:>13.3f}{parallel:>14.3f}")
+            print("tables identical: " + ("yes" if dump(serial_path) == dump(parallel_path) else "NO") + "\n")
+    use_integer_money(False)
+
+def open_accounts(path, accounts):
+    '''
+    Creates a bank with accounts of both types.
+    Input: database file, number of accounts
+    Output: none
+    '''
+    engine = create_bank_engine(path)
+    session = sessionmaker(bind=engine)()
+    bank = Bank()
+    session.add(bank)
+    with unit_of_work(session):
+        for i in range(accounts):
+            bank.add_account(CHECKING if i % 2 else SAVINGS, session)
+    session.close()
+    engine.dispose()
+
+def transactions(accounts, per_month, month):
+    '''
+    Makes a month of deposits and withdrawals, the same every time for the same month. Some accounts stay below
+    the checking fee threshold and every tenth account has none.
+    Input: number of accounts, transactions per account, first day of the month
+    Output: list of (account number, amount, date) rows in date order
+    '''
+    rng = random.Random(month.toordinal())
+    rows = []
+    for acct_num in range(1, accounts + 1):
+        if acct_num % 10 == 0:
+            continue
+        for day in range(per_month):
+            cents = rng.randint(1, 30000) if day == 0 else rng.randint(-3000, 9000)
+            rows.append((acct_num, f"{cents / 100:.2f}", month + timedelta(days=day * 5)))
+    return sorted(rows, key=lambda x: x[2])
+
+def run(path, work):
+    '''
+    Opens a bank and runs work on it in one unit of work.
+    Input: database file, function(bank, session) that does the work
+    Output: seconds it took, loading the bank and committing included
+    '''
+    engine = create_bank_engine(path)
+    session = sessionmaker(bind=engine)()
+    start = time.perf_counter()
+    bank = session.query(Bank).first()
+    with unit_of_work(session):
+        work(bank, session)
+    seconds = time.perf_counter() - start
+    session.close()
+    engine.dispose()
+    return seconds
+
+def dump(path):
+    '''
+    Input: database file
+    Output: every row of the compared tables, in a fixed order
+    '''
+    engine = create_bank_engine(path)
+    with engine.connect() as connection:
+        rows = {table: connection.execute(text(f"SELECT {columns} FROM {table} ORDER BY 1, 2")).all()
+                for table, columns in TABLES.items()}
+    engine.dispose()
+    return rows
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import logging
+import tempfile
+import subprocess
+from datetime import date, timedelta
+from decimal import setcontext, BasicContext
+
+# wall time to the first menu that scripted use of the CLI should stay under
+TARGET_MS = 100
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    '''
+    Measures how long cli.py takes to start, by running it in new processes like a script would.
+    "python only" is the interpreter starting and doing nothing, the floor for every other row.
+    "menu and quit" shows the menu and quits without touching bank.db, "summary" also opens bank.db
+    and lists its accounts. The slowest imports come from python -X importtime.
+    Input: number of runs of each command (default 20), number of accounts in bank.db (default 50)
+    Output: mean, median and p99 wall time in milliseconds per command, and the slowest imports
+    '''
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    cli = [sys.executable, os.path.join(HERE, "cli.py")]
+    commands = [
+        ("python only", [sys.executable, "-c", "pass"], ""),
+        ("menu and quit", cli, "7\n"),
+        ("summary", cli, "2\n7\n"),
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_bank(os.path.join(directory, "bank.db"), accounts)
+
+        print(f"{'command':<16}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for name, command, stdin in commands:
+            timings = sorted(time_command(command, stdin, directory) for _ in range(runs))
+            mean = sum(timings) / len(timings)
+            p50 = timings[len(timings) // 2]
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            print(f"{name:<16}{mean * 1000:>10.1f}{p50 * 1000:>10.1f}{p99 * 1000:>10.1f}")
+            if name == "menu and quit":
+                menu_p50 = p50
+
+    print(f"\nmenu and quit p50 {menu_p50 * 1000:.1f} ms, target {TARGET_MS} ms: "
+          + ("met" if menu_p50 * 1000 < TARGET_MS else "missed"))
+
+    print("\nslowest imports of cli.py (cumulative ms):")
+    for module, cumulative in slowest_imports("cli", 5):
+        print(f"    {module:<24}{cumulative / 1000:>8.1f}")
+
+def make_bank(path, accounts):
+    '''
+    Creates a bank database with checking accounts that each have a year of daily deposits.
+    Input: database file, number of accounts
+    Output: none, the database is written to path
+    '''
+    sys.path.insert(0, HERE)
+    from bank import Bank, CHECKING
+    from storage import create_bank_engine, unit_of_work
+    from sqlalchemy.orm import sessionmaker
+
+    setcontext(BasicContext)
+    logging.disable(logging.CRITICAL)
+    engine = create_bank_engine(path)
+    session = sessionmaker(bind=engine)()
+    bank = Bank()
+    session.add(bank)
+    with unit_of_work(session):
+        for _ in range(accounts):
+            bank.add_account(CHECKING, session)
+    rows = [(acct_num, "10.00", (date(2024, 1, 1) + timedelta(days=day)).isoformat())
+            for acct_num in range(1, accounts + 1) for day in range(365)]
+    with unit_of_work(session):
+        bank.import_transactions(rows, session)
+    session.close()
+    engine.dispose()
+
+def time_command(command, stdin, directory):
+    '''
+    Runs a command to completion.
+    Input: command line, text typed into it, directory to run it in
+    Output: seconds from starting the process until it exited
+    '''
+    start = time.perf_counter()
+    subprocess.run(command, input=stdin, text=True, cwd=directory, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+def slowest_imports(module, count):
+    '''
+    Imports a module in a new process with python -X importtime.
+    Input: module to import, number of imports to return
+    Output: list of (module, cumulative microseconds), slowest first
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=HERE, capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        ## lines look like "import time:  self [us] | cumulative | imported package"
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((fields[2].strip(), int(fields[1])))
+    imports.sort(key=lambda x: x[1], reverse=True)
+    return imports[:count]
+
+if __name__ == "__main__":
+    main()
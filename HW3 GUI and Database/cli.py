@@ -1,32 +1,52 @@
 import sys
+import csv
+import json
+import argparse
+import itertools
 import logging
 from decimal import Decimal, setcontext, BasicContext, InvalidOperation
 from datetime import datetime
 
-from bank import Bank, Base
-from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError
+from storage import PROFILES, DEFAULT_PROFILE, create_bank_engine, unit_of_work, run_with_retry
+from client import BankClient, RemoteBank, RemoteSession
+from protocol import encode_error
+from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError, AccountNotFoundError
+from logs import add_logging_arguments, configure_logging_from
+from money import add_money_argument, use_integer_money
 
-import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+# SQLAlchemy and the models are most of the startup time, so they are only
+# imported when a command first needs bank.db, see BankCLI._session
 
 # context with ROUND_HALF_UP
 setcontext(BasicContext)
 
-logging.basicConfig(filename='bank.log', level=logging.DEBUG,
-                    format='%(asctime)s|%(levelname)s|%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger("bank.cli")
+
+# commands committed together by run_batch
+BATCH_SIZE = 1000
+
+# errors that only fail the batch command that raised them: bad arguments and
+# transactions the bank refuses. Anything else is a bug and fails the batch.
+BATCH_ERRORS = (OverdrawError, TransactionLimitError, TransactionSequenceError, AccountNotFoundError,
+                ValueError, InvalidOperation)
 
 class BankCLI():
     """Driver class for a command-line REPL interface to the Bank application"""
 
-    def __init__(self):
-        self._session = Session()
-        self._bank = self._session.query(Bank).first()
-        if not self._bank:
-            self._bank = Bank()
-            self._session.add(self._bank)
-            self._session.commit()
-        else:
-            logging.debug("Loaded from bank.db")
+    def __init__(self, session=None, bank=None, profile=DEFAULT_PROFILE, shards=1, month_end_workers=1):
+        """
+        Args:
+            session (Session, optional): session to work in. Defaults to a session on bank.db, opened by the first command that needs it.
+            bank (Bank, optional): bank to work on. Defaults to the bank in the session's database, loaded when first needed.
+            profile (str, optional): storage profile used to open bank.db. Defaults to DEFAULT_PROFILE.
+            shards (int, optional): number of files the default bank is split into, see shards.py. Defaults to 1, bank.db alone.
+            month_end_workers (int, optional): processes month end computes interest and fees in, see month_end.py. Defaults to 1, this process.
+        """
+        self._opened_session = session
+        self._loaded_bank = bank
+        self._profile = profile
+        self._shards = shards
+        self._month_end_workers = month_end_workers
 
         # establishes relationship to Accounts
         self._selected_account = None
@@ -39,8 +59,57 @@ class BankCLI():
             "5": self._list_transactions,
             "6": self._monthly_triggers,
             "7": self._quit,
+            "8": self._reconcile,
+            "9": self._import,
+            "10": self._month_end,
+            "11": self._explain,
+            "12": self._statement,
+            "13": self._month_totals,
+        }
+
+        # commands of run_batch, with the names of the arguments a script line gives in order
+        self._batch_commands = {
+            "open": (self._batch_open, ["type"]),
+            "select": (self._batch_select, ["account"]),
+            "txn": (self._batch_transaction, ["amount", "date"]),
+            "interest": (self._batch_interest, []),
+            "month-end": (self._batch_month_end, ["month"]),
+            "summary": (self._batch_summary, []),
+            "list": (self._batch_list, []),
+            "statement": (self._batch_statement, ["month"]),
+            "balance": (self._batch_balance, ["date"]),
+            "totals": (self._batch_totals, ["month"]),
         }
 
+    @property
+    def _session(self):
+        "Session to work in, bank.db is opened the first time this is used"
+        if self._opened_session is None and self._shards > 1:
+            from shards import open_sharded_bank
+            self._opened_session, self._loaded_bank = open_sharded_bank("bank.db", self._shards, self._profile)
+        elif self._opened_session is None:
+            from sqlalchemy.orm import sessionmaker
+            engine = create_bank_engine("bank.db", PROFILES[self._profile])
+            self._opened_session = sessionmaker(bind=engine)()
+        return self._opened_session
+
+    @property
+    def _bank(self):
+        "Bank to work on, loaded the first time this is used. Its accounts are only loaded when a command needs them."
+        if self._loaded_bank is None and self._shards > 1:
+            # opening the shards loads the bank of each one
+            self._session
+        if self._loaded_bank is None:
+            from bank import Bank
+            self._loaded_bank = self._session.query(Bank).first()
+            if not self._loaded_bank:
+                self._loaded_bank = Bank()
+                self._session.add(self._loaded_bank)
+                self._session.commit()
+            else:
+                logger.debug("Loaded from bank.db")
+        return self._loaded_bank
+
     def _display_menu(self):
         print(f"""--------------------------------
 Currently selected account: {self._selected_account}
@@ -51,7 +120,13 @@ Enter command
 4: add transaction
 5: list transactions
 6: interest and fees
-7: quit""")
+7: quit
+8: reconcile balances
+9: import transactions
+10: interest and fees for all accounts
+11: explain query plans
+12: monthly statement
+13: totals for a month""")
 
     def run(self):
         """Display the menu and respond to choices."""
@@ -67,6 +142,145 @@ Enter command
                 # not officially part of spec since we don't give invalid options
                 print("{0} is not a valid choice".format(choice))
 
+    def run_batch(self, lines, out=sys.stdout, batch_size=BATCH_SIZE):
+        """Runs commands without the menu and writes one JSON line with the result of each.
+
+        Each line is a command such as "txn 100.00 2024-01-05", or the same as a JSON object such as
+        {"op": "txn", "amount": "100.00", "date": "2024-01-05"}. Blank lines and lines starting with # are skipped.
+        A result is {"line": n, "ok": true, "result": ...} or {"line": n, "ok": false, "error": ...}
+        and a failed command does not stop the ones after it. Every batch_size commands are committed
+        together and their results are written once the commit succeeds. A month end that runs in other
+        processes (shards or month end workers) is a batch of its own, as they only see what is committed.
+
+        Args:
+            lines (iterable): lines of the script, e.g. sys.stdin
+            out (file, optional): where the results are written. Defaults to sys.stdout.
+            batch_size (int, optional): commands per commit. Defaults to BATCH_SIZE.
+
+        Returns:
+            bool: True if every batch was committed. A batch that could not be committed stops the run
+            and is reported as {"line": n, "committed": false, "error": ...} with the line it started at.
+        """
+        numbered = ((n, line.strip()) for n, line in enumerate(lines, 1))
+        commands = ((n, line) for n, line in numbered if line and not line.startswith("#"))
+        while True:
+            batch = []
+            for n, line in commands:
+                if batch and self._runs_alone(line):
+                    # it starts the next batch
+                    commands = itertools.chain([(n, line)], commands)
+                    break
+                batch.append((n, line))
+                if len(batch) >= batch_size or self._runs_alone(line):
+                    break
+            if not batch:
+                return True
+
+            # a retried batch starts again from the account selected before it
+            selected = self._selected_account
+            def run():
+                self._selected_account = selected
+                return [self._run_batch_command(n, line) for n, line in batch]
+
+            try:
+                results = run_with_retry(self._session, run)
+            except Exception as ex:
+                logger.error("Batch from line %s failed: %s: %r", batch[0][0], ex.__class__.__name__, str(ex))
+                out.write(json.dumps({"line": batch[0][0], "committed": False, **encode_error(ex)}) + "\n")
+                out.flush()
+                return False
+            out.writelines(json.dumps(result) + "\n" for result in results)
+            out.flush()
+            logger.debug("Ran %s batch commands", len(batch))
+
+    def _runs_alone(self, line):
+        "Whether a batch command must be committed on its own: a month end run in other processes"
+        if isinstance(self._opened_session, RemoteSession) or (self._shards == 1 and self._month_end_workers == 1):
+            return False
+        if line.startswith("{"):
+            try:
+                op = json.loads(line).get("op")
+            except ValueError:
+                # reported when the command runs
+                return False
+        else:
+            op = line.split()[0]
+        return op == "month-end"
+
+    def _run_batch_command(self, n, line):
+        try:
+            if line.startswith("{"):
+                args = json.loads(line)
+                op = args.pop("op", None)
+            else:
+                op, *values = line.split()
+            if op not in self._batch_commands:
+                raise ValueError(f"Unknown command {op!r}, expected one of {', '.join(self._batch_commands)}")
+            command, names = self._batch_commands[op]
+            if line.startswith("{"):
+                if sorted(args) != sorted(names):
+                    raise ValueError(f"{op} takes {len(names)} arguments: {' '.join(names)}")
+                # the commands parse strings, as they get them from plain lines
+                args = {name: str(value) for name, value in args.items()}
+            else:
+                if len(values) != len(names):
+                    raise ValueError(f"{op} takes {len(names)} arguments: {' '.join(names)}")
+                args = dict(zip(names, values))
+            return {"line": n, "ok": True, "result": command(**args)}
+        except BATCH_ERRORS as ex:
+            return {"line": n, **encode_error(ex)}
+
+    def _batch_account(self):
+        if self._selected_account is None:
+            raise ValueError("This command requires that you first select an account.")
+        return self._selected_account
+
+    def _batch_open(self, type):
+        account = self._bank.add_account(type, self._session)
+        if account is None:
+            raise ValueError(f"Unknown account type {type!r}, expected checking or savings")
+        return {"account": account.account_number}
+
+    def _batch_select(self, account):
+        selected = self._bank.get_account(int(account))
+        if selected is None:
+            raise AccountNotFoundError(int(account))
+        self._selected_account = selected
+        return {"account": selected.account_number, "summary": str(selected)}
+
+    def _batch_transaction(self, amount, date):
+        account = self._batch_account()
+        account.add_transaction(Decimal(str(amount)), datetime.fromisoformat(date).date(), self._session)
+        return {"summary": str(account)}
+
+    def _batch_interest(self):
+        account = self._batch_account()
+        account.assess_interest_and_fees(self._session)
+        return {"summary": str(account)}
+
+    def _batch_month_end(self, month):
+        errors = self._run_month_end(datetime.strptime(month, "%Y-%m").date())
+        return {"skipped": [{"account": acct_num, "latest_date": ex.latest_date.isoformat()} for acct_num, ex in errors]}
+
+    def _batch_summary(self):
+        return {"accounts": [str(x) for x in self._bank.show_accounts()]}
+
+    def _batch_list(self):
+        return {"transactions": [str(t) for t in self._batch_account().iter_transactions()]}
+
+    def _batch_statement(self, month):
+        month = datetime.strptime(month, "%Y-%m").date()
+        statement = self._batch_account().get_statement(month.year, month.month)
+        return {"statement": str(statement) if statement else None}
+
+    def _batch_balance(self, date):
+        balance = self._batch_account().balance_as_of(datetime.fromisoformat(date).date())
+        return {"balance": f"{balance:.2f}"}
+
+    def _batch_totals(self, month):
+        totals = self._bank.month_totals(datetime.strptime(month, "%Y-%m").date(), self._session)
+        return {key: value if key == "transactions" else f"{value:.2f}" for key, value in totals.items()}
+
     def _summary(self):
         # dependency on Account objects
         for x in self._bank.show_accounts():
@@ -92,7 +306,9 @@ Enter command
                 print("Please try again with a valid date in the format YYYY-MM-DD.")
 
         try:
-            self._selected_account.add_transaction(amount, date, self._session)
+            run_with_retry(self._session,
+                           lambda: self._selected_account.add_transaction(amount, date, self._session))
+            logger.debug("Saved to bank.db")
         except AttributeError:
             print("This command requires that you first select an account.")
         except OverdrawError:
@@ -104,18 +320,14 @@ Enter command
         except TransactionSequenceError as ex:
             print(f"New transactions must be from {ex.latest_date} onward.")
 
-        self._session.commit()
-        logging.debug("Saved to bank.db")
-
     def _open_account(self):
         acct_type = input("Type of account? (checking/savings)\n>")
         try:
-            self._bank.add_account(acct_type, self._session)
+            run_with_retry(self._session, lambda: self._bank.add_account(acct_type, self._session))
+            logger.debug("Saved to bank.db")
         except OverdrawError:
             print(
                 "This transaction could not be completed due to an insufficient account balance.")
-        self._session.commit()
-        logging.debug("Saved to bank.db")
 
     def _select(self):
         num = int(input("Enter account number\n>"))
@@ -123,31 +335,172 @@ Enter command
 
     def _monthly_triggers(self):
         try:
-            self._selected_account.assess_interest_and_fees(self._session)
-            logging.debug("Triggered interest and fees")
-            logging.debug("Saved to bank.db")
+            run_with_retry(self._session, lambda: self._selected_account.assess_interest_and_fees(self._session))
+            logger.debug("Triggered interest and fees")
+            logger.debug("Saved to bank.db")
         except AttributeError:
             print("This command requires that you first select an account.")
         except TransactionSequenceError as e:
             print(
                 f"Cannot apply interest and fees again in the month of {e.latest_date.strftime('%B')}.")
 
+    def _reconcile(self):
+        with unit_of_work(self._session):
+            drifts = self._bank.reconcile(self._session)
+            statements = self._bank.reconcile_statements(self._session)
+        for acct_num, drift in drifts.items():
+            print(f"#{acct_num:09}: balance was off by ${drift:,.2f}")
+        for acct_num, months in statements.items():
+            print(f"#{acct_num:09}: rebuilt statements for " + ", ".join(f"{year}-{month:02}" for year, month in months))
+        if not drifts and not statements:
+            print("All balances and statements match their transactions.")
+        logger.debug("Reconciled balances")
+
+    def _import(self):
+        """Imports transactions from a CSV file with one account number, amount and YYYY-MM-DD date per line. 
+        A header line is skipped."""
+        filename = input("File name?\n>")
+        try:
+            with open(filename, newline="") as f:
+                rows = csv.reader(f)
+                first = next(rows, None)
+                # a blank line is a row with no fields, reported as a bad row below
+                header = bool(first) and not first[0].strip().isdigit()
+                if first is not None and not header:
+                    rows = itertools.chain([first], rows)
+                with unit_of_work(self._session):
+                    errors = self._bank.import_transactions(rows, self._session)
+        except OSError:
+            print(f"Could not read {filename}.")
+            return
+
+        for row_num, ex in errors:
+            print(f"Line {row_num + header}: {self._import_error_message(ex)}")
+        logger.debug("Imported transactions from %s", filename)
+        logger.debug("Saved to bank.db")
+
+    def _import_error_message(self, ex):
+        if isinstance(ex, AccountNotFoundError):
+            return f"There is no account #{ex.account_number:09}."
+        if isinstance(ex, OverdrawError):
+            return "This transaction could not be completed due to an insufficient account balance."
+        if isinstance(ex, TransactionLimitError):
+            return f"This transaction could not be completed because this account already has {ex.limit} transactions in this {ex.limit_type}."
+        if isinstance(ex, TransactionSequenceError):
+            return f"New transactions must be from {ex.latest_date} onward."
+        return "Expected an account number, a valid dollar amount and a date in the format YYYY-MM-DD."
+
+    def _month_end(self):
+        month = None
+        while not month:
+            try:
+                month = datetime.strptime(
+                    input("Month? (YYYY-MM)\n>"), "%Y-%m").date()
+            except ValueError:
+                print("Please try again with a valid month in the format YYYY-MM.")
+
+        errors = run_with_retry(self._session, lambda: self._run_month_end(month))
+        for acct_num, ex in errors:
+            if ex.latest_date.month == month.month and ex.latest_date.year == month.year:
+                print(f"#{acct_num:09}: Cannot apply interest and fees again in the month of {ex.latest_date.strftime('%B')}.")
+            else:
+                print(f"#{acct_num:09}: Has transactions after the month of {month.strftime('%B')}.")
+        logger.debug("Triggered interest and fees for all accounts")
+        logger.debug("Saved to bank.db")
+
+    def _run_month_end(self, month):
+        "Runs month end on every account, in a pool of processes if more than one worker was asked for"
+        if self._month_end_workers > 1 and self._shards == 1 and not isinstance(self._session, RemoteSession):
+            from month_end import run_month_end_in_processes
+            return run_month_end_in_processes(self._bank, month, self._session, self._month_end_workers)
+        return self._bank.run_month_end(month, self._session)
+
+    def _statement(self):
+        if not self._selected_account:
+            print("This command requires that you first select an account.")
+            return
+
+        month = None
+        while not month:
+            try:
+                month = datetime.strptime(
+                    input("Month? (YYYY-MM)\n>"), "%Y-%m").date()
+            except ValueError:
+                print("Please try again with a valid month in the format YYYY-MM.")
+
+        statement = self._selected_account.get_statement(month.year, month.month)
+        if statement is None:
+            print(f"There were no transactions in {month.strftime('%B %Y')}.")
+        else:
+            print(statement)
+
+    def _explain(self):
+        if isinstance(self._session, RemoteSession):
+            print("Query plans can only be explained on the server.")
+            return
+        from query_plans import hot_queries, explain
+        session, bank = self._session, self._bank
+        if self._shards > 1:
+            # every shard has the same tables and indexes
+            session, bank = bank.shard(0)
+        queries = hot_queries(session, bank)
+        if not queries:
+            print("Open an account first, the query plans are shown for the first account.")
+        for description, query in queries:
+            print(f"{description}:")
+            for detail in explain(session, query):
+                print(f"    {detail}")
+
+    def _month_totals(self):
+        month = None
+        while not month:
+            try:
+                month = datetime.strptime(
+                    input("Month? (YYYY-MM)\n>"), "%Y-%m").date()
+            except ValueError:
+                print("Please try again with a valid month in the format YYYY-MM.")
+
+        totals = self._bank.month_totals(month, self._session)
+        print(f"{month.strftime('%B %Y')}: {totals['transactions']} transactions")
+        for key in ("deposits", "withdrawals", "interest", "fees"):
+            print(f"{key.capitalize()}: ${totals[key]:,.2f}")
+
     def _list_transactions(self):
         try:
-            for t in self._selected_account.get_transactions():
+            for t in self._selected_account.iter_transactions():
                 print(t)
         except AttributeError:
             print("This command requires that you first select an account.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Command-line interface to the bank in bank.db")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="SQLite storage profile (default: %(default)s)")
+    parser.add_argument("--connect", metavar="ADDRESS",
+                        help="use the bank server at host:port or a Unix socket path instead of bank.db")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the bank into this many files, bank-0.db, bank-1.db, ... (default: %(default)s, bank.db)")
+    parser.add_argument("--month-end-workers", type=int, default=1,
+                        help="processes that compute month end interest and fees on bank.db (default: %(default)s, this one)")
+    parser.add_argument("--batch", action="store_true",
+                        help="read commands from stdin and write JSON results instead of showing the menu")
+    add_money_argument(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
 
-    engine = sqlalchemy.create_engine("sqlite:///bank.db")
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
+    # bank.log is only created when the first message is written to it
+    configure_logging_from(args)
+    use_integer_money(args.money == "integer")
 
     try:
-        BankCLI().run()
+        if args.connect:
+            cli = BankCLI(RemoteSession(), RemoteBank(BankClient(args.connect)))
+        else:
+            cli = BankCLI(profile=args.profile, shards=args.shards, month_end_workers=args.month_end_workers)
+        if args.batch:
+            sys.exit(0 if cli.run_batch(sys.stdin) else 1)
+        cli.run()
     except Exception as e:
         print("Sorry! Something unexpected happened. Check the logs or contact the developer for assistance.")
-        logging.error(str(e.__class__.__name__) + ": " + repr(str(e)))
+        logger.error("%s: %r", e.__class__.__name__, str(e))
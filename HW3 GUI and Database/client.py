@@ -0,0 +1,159 @@
+import socket
+from datetime import date
+from decimal import Decimal
+
+from protocol import encode, decode, decode_error, parse_address
+from exceptions import TransactionSequenceError
+
+# number of transactions asked for per request when listing transactions
+REQUEST_PAGE_SIZE = 100
+
+
+class BankClient:
+    """Blocking connection to a BankServer that sends one request at a time."""
+
+    def __init__(self, address):
+        """
+        Args:
+            address (str): "host:port" of the server, or the path of its Unix socket
+        """
+        address = parse_address(address)
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(address)
+        self._file = self._socket.makefile("rwb")
+
+    def request(self, op, **args):
+        """Sends a request and waits for its response.
+
+        Args:
+            op (str): operation name
+            **args: arguments of the operation
+
+        Returns:
+            result of the operation
+
+        Raises:
+            the bank exception the server raised, rebuilt on this side
+        """
+        self._file.write(encode({"op": op, **args}))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The bank server closed the connection.")
+        response = decode(line)
+        if not response["ok"]:
+            raise decode_error(response)
+        return response["result"]
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class RemoteSession:
+    """Stands in for a Session when the bank is on a server, which commits every request itself."""
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class RemoteBank:
+    """Bank on a server, with the methods of Bank that the CLI and GUI use."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def add_account(self, acct_type, session):
+        acct_num = self._client.request("open", type=acct_type)
+        return RemoteAccount(self._client, acct_num) if acct_num else None
+
+    def show_accounts(self):
+        return [RemoteAccount(self._client, x["number"], x["summary"]) for x in self._client.request("summary")]
+
+    def get_account(self, account_num):
+        x = self._client.request("account", account=account_num)
+        return RemoteAccount(self._client, x["number"], x["summary"]) if x else None
+
+    def import_transactions(self, rows, session):
+        rows = [[str(value) for value in row] for row in rows]
+        errors = self._client.request("import", rows=rows)
+        return [(row_num, decode_error(error)) for row_num, error in errors]
+
+    def run_month_end(self, month, session):
+        errors = self._client.request("month_end", month=month.strftime("%Y-%m"))
+        return [(acct_num, TransactionSequenceError(date.fromisoformat(latest_date)))
+                for acct_num, latest_date in errors]
+
+    def month_totals(self, month, session):
+        totals = self._client.request("totals", month=month.strftime("%Y-%m"))
+        return {key: value if key == "transactions" else Decimal(value) for key, value in totals.items()}
+
+    def reconcile(self, session):
+        return {acct_num: Decimal(drift) for acct_num, drift in self._client.request("reconcile")}
+
+    def reconcile_statements(self, session):
+        return {acct_num: [tuple(month) for month in months]
+                for acct_num, months in self._client.request("reconcile_statements")}
+
+
+class RemoteAccount:
+    """Account on a server, with the methods of Account that the CLI and GUI use."""
+
+    def __init__(self, client, acct_num, summary=None):
+        self._client = client
+        self.account_number = acct_num
+        self._summary = summary
+
+    def add_transaction(self, amt, date, session, exempt=False):
+        self._summary = self._client.request("transaction", account=self.account_number,
+                                             amount=str(amt), date=date.isoformat())["summary"]
+
+    def assess_interest_and_fees(self, session):
+        self._summary = self._client.request("interest", account=self.account_number)["summary"]
+
+    def iter_transactions(self, after=None, limit=None, newest_first=False):
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page_size = REQUEST_PAGE_SIZE if remaining is None else min(remaining, REQUEST_PAGE_SIZE)
+            page = [RemoteTransaction(x) for x in self._client.request(
+                "transactions", account=self.account_number, after=after.id if after else None,
+                limit=page_size, newest_first=newest_first)]
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]
+            if remaining is not None:
+                remaining -= len(page)
+
+    def get_transactions(self):
+        return list(self.iter_transactions())
+
+    def balance_as_of(self, day):
+        return Decimal(self._client.request("balance", account=self.account_number, date=day.isoformat()))
+
+    def get_statement(self, year, month):
+        return self._client.request("statement", account=self.account_number, year=year, month=month)
+
+    def __str__(self):
+        if self._summary is None:
+            self._summary = self._client.request("account", account=self.account_number)["summary"]
+        return self._summary
+
+
+class RemoteTransaction:
+    "Transaction as listed by the server"
+
+    def __init__(self, data):
+        self.id = data["id"]
+        self.date = date.fromisoformat(data["date"])
+        self._amt = Decimal(data["amount"])
+        self._text = data["text"]
+
+    def __str__(self):
+        return self._text
@@ -0,0 +1,119 @@
+import queue
+import logging
+import threading
+from decimal import getcontext, setcontext
+
+logger = logging.getLogger("bank.gui")
+
+# how often the window checks for finished requests while any are outstanding, in milliseconds
+POLL_INTERVAL = 20
+
+
+class _Request:
+    "A job waiting for, or running on, the database thread, with the callbacks for its result"
+
+    __slots__ = ("job", "on_done", "on_error", "key")
+
+    def __init__(self, job, on_done, on_error, key):
+        self.job = job
+        self.on_done = on_done
+        self.on_error = on_error
+        self.key = key
+
+
+class DatabaseWorker:
+    """Runs a Tk window's database work on one background thread, so the window never waits for SQLite.
+
+    The window submits jobs, which run one at a time in the order submitted, so the session and the
+    accounts loaded in it are only ever used on this thread. The callbacks get the result on the Tk main
+    thread: the thread only puts finished requests on a queue, and the window drains it with after().
+    A job submitted with a key replaces one with the same key that hasn't started yet, so a burst of
+    refreshes of the same rows reads the database once.
+    """
+
+    def __init__(self, window):
+        """Starts the thread.
+
+        Args:
+            window (Tk): window whose main thread the callbacks run on
+        """
+        self._window = window
+        self._requests = queue.SimpleQueue()
+        self._finished = queue.SimpleQueue()
+        ## requests waiting to start, by key, guarded by the lock as the thread removes them
+        self._waiting = {}
+        self._lock = threading.Lock()
+        ## requests not handed back yet, and whether a poll is scheduled, only used on the main thread
+        self._outstanding = 0
+        self._polling = False
+        ## decimal contexts are per thread, so give the thread the one the window uses
+        self._thread = threading.Thread(target=self._run, args=(getcontext().copy(),), name="bank-db", daemon=True)
+        self._thread.start()
+
+    def submit(self, job, on_done=None, on_error=None, key=None):
+        """Queues job() to run on the database thread. Call it on the main thread.
+
+        Args:
+            job (function): does the database work, called with no arguments
+            on_done (function, optional): called on the main thread with what job() returned. Defaults to None.
+            on_error (function, optional): called on the main thread with the exception if job() raised.
+                Defaults to None, which reports it like an exception in a Tk callback.
+            key (hashable, optional): replaces a waiting job submitted with the same key instead of
+                queueing another one. Defaults to None.
+        """
+        if key is not None:
+            with self._lock:
+                waiting = self._waiting.get(key)
+                if waiting is not None:
+                    waiting.job, waiting.on_done, waiting.on_error = job, on_done, on_error
+                    logger.debug("Coalesced database request %s", key)
+                    return
+                request = self._waiting[key] = _Request(job, on_done, on_error, key)
+        else:
+            request = _Request(job, on_done, on_error, key)
+        self._outstanding += 1
+        self._requests.put(request)
+        if not self._polling:
+            self._polling = True
+            self._window.after(POLL_INTERVAL, self._poll)
+
+    def stop(self):
+        "Lets the jobs already submitted finish and ends the thread. Their callbacks are not called."
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self, context):
+        "Body of the database thread: runs requests until stop() queues None"
+        setcontext(context)
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            with self._lock:
+                if request.key is not None:
+                    del self._waiting[request.key]
+                job = request.job
+            try:
+                self._finished.put((request, True, job()))
+            except Exception as ex:
+                self._finished.put((request, False, ex))
+
+    def _poll(self):
+        "Runs the callbacks of the finished requests, and checks again later while any are outstanding"
+        while True:
+            try:
+                request, succeeded, result = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            self._outstanding -= 1
+            if succeeded:
+                if request.on_done:
+                    request.on_done(result)
+            elif request.on_error:
+                request.on_error(result)
+            else:
+                self._window.report_callback_exception(type(result), result, result.__traceback__)
+        if self._outstanding:
+            self._window.after(POLL_INTERVAL, self._poll)
+        else:
+            self._polling = False
@@ -16,4 +16,11 @@ class TransactionSequenceError(Exception):
 
     def __init__(self, date):
         super().__init__()
-        self.latest_date = date
\ No newline at end of file
+        self.latest_date = date
+
+class AccountNotFoundError(Exception):
+    "Indicates that no account has the given account number"
+
+    def __init__(self, account_number):
+        super().__init__()
+        self.account_number = account_number
@@ -2,37 +2,43 @@ import tkinter as tk
 from tkinter import messagebox
 from tkcalendar import DateEntry
 import sys
+import argparse
 
-from bank import Bank, Base
+from bank import Bank
+from accounts import TRANSACTION_PAGE_SIZE
+from storage import PROFILES, DEFAULT_PROFILE, create_bank_engine, run_with_retry
+from client import BankClient, RemoteBank, RemoteSession
+from db_worker import DatabaseWorker
 
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
 
-import sqlalchemy
 from sqlalchemy.orm import sessionmaker
 import logging
 
 from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError
+from logs import add_logging_arguments, configure_logging_from
+from money import add_money_argument, use_integer_money
 
-logging.basicConfig(filename='bank.log', level=logging.DEBUG,
-                    format='%(asctime)s|%(levelname)s|%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+logger = logging.getLogger("bank.gui")
 
 class BankGUI:
     """Display a menu and respond to choices when run."""
 
-    def __init__(self):
-        ## intialize the database
-        self._session = Session()
-        self._bank = self._session.query(Bank).first()
-        if not self._bank:
-            self._bank = Bank()
-            self._session.add(self._bank)
-            self._session.commit()
-        else:
-            logging.debug("Loaded from bank.db")
+    def __init__(self, session=None, bank=None):
+        ## the database, or the bank given (e.g. one on a server), is only used on the
+        ## worker's thread, which loads the bank once the window is up
+        self._session = session or Session()
+        self._bank = bank
 
+        ## number of the selected account
         self._selected_account = None
 
+        ## Account numbers in the order of the listbox rows and the row of each account number,
+        ## so a change to one account only redraws its row
+        self._listed_accounts = []
+        self._account_rows = {}
+
         ## Create a window
         self._window = tk.Tk()
         self._window.geometry("400x300")
@@ -69,8 +75,27 @@ class BankGUI:
         self._accounts_listbox.grid(row=3, column=1, columnspan= 3, sticky="nsew", padx=10, pady=(20, 10))
         self._accounts_listbox.bind('<<ListboxSelect>>', self._on_account_select)
 
-        self._show_accounts()
+        ## Thread that does all the database work
+        self._worker = DatabaseWorker(self._window)
+        self._worker.submit(self._load_bank, self._show_account_rows, key="accounts")
         self._window.mainloop()
+        self._worker.stop()
+
+    def _load_bank(self):
+        """Runs on the worker: load the bank, creating it if bank.db is new, and list its accounts."""
+        if not self._bank:
+            self._bank = self._session.query(Bank).first()
+            if not self._bank:
+                self._bank = Bank()
+                self._session.add(self._bank)
+                self._session.commit()
+            else:
+                logger.debug("Loaded from bank.db")
+        return self._account_rows_of(self._bank.show_accounts())
+
+    def _account_rows_of(self, accounts):
+        """Runs on the worker: the account number and row text of each account."""
+        return [(account.account_number, str(account)) for account in accounts]
 
     def _open_account(self):
         """
@@ -103,24 +128,56 @@ class BankGUI:
     def _confirm_account_creation(self, account_type):
         """Create a new account and save it to the database."""
 
-        ## Create the account
-        self._bank.add_account(account_type, self._session)
-        self._session.commit()
-        logging.debug("Saved to bank.db")
-        messagebox.showinfo("Account Created", f"New {account_type} account created.")
+        ## Create the account on the worker
+        def create():
+            account = run_with_retry(self._session, lambda: self._bank.add_account(account_type, self._session))
+            logger.debug("Saved to bank.db")
+            return self._account_rows_of([account])
 
-        ## Update the listbox
-        self._show_accounts()
+        def created(rows):
+            messagebox.showinfo("Account Created", f"New {account_type} account created.")
+            ## Add a row for it to the listbox
+            self._list_accounts(rows)
 
-    def _show_accounts(self):
-        """Display the accounts in the listbox."""
+        self._worker.submit(create, created)
+
+    def _show_account_rows(self, rows):
+        """Replace the rows of the listbox with (account number, text) rows."""
 
         # Clear current items
         self._accounts_listbox.delete(0, tk.END)
+        self._listed_accounts = []
+        self._account_rows = {}
         # Display Accounts
-        accounts = self._bank.show_accounts()
-        for account in accounts:
-            self._accounts_listbox.insert(tk.END, account)
+        self._list_accounts(rows)
+
+    def _list_accounts(self, rows):
+        """Add (account number, text) rows at the end of the listbox, in one call however many there are."""
+        texts = []
+        for acct_num, summary in rows:
+            self._account_rows[acct_num] = len(self._listed_accounts)
+            self._listed_accounts.append(acct_num)
+            texts.append(summary)
+        if texts:
+            self._accounts_listbox.insert(tk.END, *texts)
+
+    def _refresh_account(self, acct_num):
+        """Read one account again after it changed and redraw its row. Refreshes of the same account
+        that are still waiting for the worker are read once."""
+        self._worker.submit(lambda: str(self._bank.get_account(acct_num)),
+                            lambda summary: self._redraw_account(acct_num, summary),
+                            key=("account", acct_num))
+
+    def _redraw_account(self, acct_num, summary):
+        """Replace the text of one account's row, keeping it selected if it was."""
+        row = self._account_rows.get(acct_num)
+        if row is None or self._accounts_listbox.get(row) == summary:
+            return
+        selected = row in self._accounts_listbox.curselection()
+        self._accounts_listbox.delete(row)
+        self._accounts_listbox.insert(row, summary)
+        if selected:
+            self._accounts_listbox.selection_set(row)
 
     def _on_account_select(self, event):
         """When an account is selected, update the label and ask if to show the transactions."""
@@ -129,8 +186,8 @@ class BankGUI:
 
         ## update the label
         index = self._accounts_listbox.curselection()[0]
-        self._selected_account = self._bank._accounts[index]
-        self._current_account_label.config(text=f"Currently selected account: {self._selected_account._account_number}")
+        self._selected_account = self._listed_accounts[index]
+        self._current_account_label.config(text=f"Currently selected account: {self._selected_account}")
         
         ## Ask user if they want to see transactins
         popup = tk.Toplevel(self._window)
@@ -145,23 +202,63 @@ class BankGUI:
         """Show the transactions of the selected account."""
 
         ## Create a popup window
-        self.popup = tk.Toplevel()
-        self.popup.title(f"{self._selected_account}")
-        self.popup.geometry("400x200")
-        self.popup.grab_set()
-
-        ## if no transactions, print it
-        if not self._selected_account.get_transactions():
-            tk.Label(self.popup, text="No transactions found.").pack()
-            return
-        
-        ## Print transactions from latest to oldest
-        for t in self._selected_account.get_transactions()[::-1]:
+        acct_num = self._selected_account
+        self.popup = popup = tk.Toplevel()
+        ## the account's row shows its summary
+        popup.title(self._accounts_listbox.get(self._account_rows[acct_num]))
+        popup.geometry("400x200")
+        popup.grab_set()
+
+        ## Get the first page of transactions from latest to oldest, then show it
+        def show_first_page(page):
+            if not popup.winfo_exists():
+                return
+            rows, last = page
+            ## if no transactions, print it
+            if not rows:
+                tk.Label(popup, text="No transactions found.").pack()
+                return
+
+            ## Listbox that fetches the next page when scrolled near its end
+            self._transactions_scrollbar = tk.Scrollbar(popup)
+            self._transactions_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self._transactions_listbox = tk.Listbox(popup, bg="white", yscrollcommand=self._on_transactions_scroll)
+            self._transactions_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self._transactions_scrollbar.config(command=self._transactions_listbox.yview)
+            self._show_transaction_page(page)
+
+        self._transactions_account = acct_num
+        self._next_page_requested = False
+        self._worker.submit(lambda: self._transaction_page(acct_num, None), show_first_page)
+
+    def _transaction_page(self, acct_num, after):
+        """Runs on the worker: the (text, is withdrawal) rows of the page of transactions after the given one,
+        from latest to oldest, and the last transaction of the page to fetch the next one after."""
+        page = list(self._bank.get_account(acct_num).iter_transactions(
+            after=after, limit=TRANSACTION_PAGE_SIZE, newest_first=True))
+        return [(str(t), t._amt < 0) for t in page], page[-1] if page else None
+
+    def _show_transaction_page(self, page):
+        """Append a page of transactions to the transactions listbox."""
+        rows, last = page
+        for text, withdrawal in rows:
+            self._transactions_listbox.insert(tk.END, text)
             # if amount is negative, shown in red, else in green
-            if t._amt < 0:
-                tk.Label(self.popup, text=t, fg="red").pack()
-            else:
-                tk.Label(self.popup, text=t, fg="green").pack()
+            self._transactions_listbox.itemconfig(tk.END, fg="red" if withdrawal else "green")
+        ## only handed back to the worker, which reads it
+        self._last_shown_transaction = last
+        self._all_transactions_shown = len(rows) < TRANSACTION_PAGE_SIZE
+        self._next_page_requested = False
+
+    def _on_transactions_scroll(self, first, last):
+        """Keep the scrollbar in sync and load the next page once the end of the listbox is in view."""
+        self._transactions_scrollbar.set(first, last)
+        if not self._all_transactions_shown and not self._next_page_requested and float(last) > 0.9:
+            self._next_page_requested = True
+            listbox = self._transactions_listbox
+            acct_num, after = self._transactions_account, self._last_shown_transaction
+            self._worker.submit(lambda: self._transaction_page(acct_num, after),
+                                lambda page: listbox.winfo_exists() and self._show_transaction_page(page))
 
     def _add_transaction(self):
         """
@@ -212,45 +309,82 @@ class BankGUI:
         except ValueError:
             messagebox.showerror("Please try again with a valid date in the format YYYY-MM-DD.", message="Please try again with a valid date in the format YYYY-MM-DD.")
 
-        ## Add the transaction to the account
-        try:
-            self._selected_account.add_transaction(amount, date, self._session)
-            self._session.commit()
-            logging.debug("Saved to bank.db")
+        ## Add the transaction to the account on the worker
+        acct_num = self._selected_account
+        popup = self.popup
+
+        def add():
+            run_with_retry(self._session,
+                           lambda: self._bank.get_account(acct_num).add_transaction(amount, date, self._session))
+            logger.debug("Saved to bank.db")
+
+        def added(result):
             ## Distroy the popup
-            self.popup.destroy()
-            ## Update the listbox and label and show the transactions
-            self._show_accounts()
-        except OverdrawError:
-            messagebox.showerror("Insufficient account balance.", message="This transaction could not be completed due to an insufficient account balance.")
-        except TransactionLimitError as ex:
-            messagebox.showerror("Transaction Limit Error", message=f"This transaction could not be completed because this account already has {ex.limit} transactions in this {ex.limit_type}.")
-        except TransactionSequenceError as ex:
-            messagebox.showerror("Transaction Sequence Error", message=f"New transactions must be from {ex.latest_date} onward.")
+            popup.destroy()
+            ## Update the account's row
+            self._refresh_account(acct_num)
+
+        def failed(ex):
+            if isinstance(ex, OverdrawError):
+                messagebox.showerror("Insufficient account balance.", message="This transaction could not be completed due to an insufficient account balance.")
+            elif isinstance(ex, TransactionLimitError):
+                messagebox.showerror("Transaction Limit Error", message=f"This transaction could not be completed because this account already has {ex.limit} transactions in this {ex.limit_type}.")
+            elif isinstance(ex, TransactionSequenceError):
+                messagebox.showerror("Transaction Sequence Error", message=f"New transactions must be from {ex.latest_date} onward.")
+            else:
+                self._window.report_callback_exception(type(ex), ex, ex.__traceback__)
+
+        self._worker.submit(add, added, failed)
 
-        
-        
     def _interests_and_fees(self):
         """Apply interest and fees to the selected account and save it to the database."""
-        try:
-            self._selected_account.assess_interest_and_fees(self._session)
-            self._show_accounts()
-            logging.debug("Triggered interest and fees")
-            logging.debug("Saved to bank.db")
-        except AttributeError:
+        ## Check if an account is selected
+        if not self._selected_account:
             messagebox.showerror("Please select an account first.", message="This command requires that you first select an account.")
-        except TransactionSequenceError as e:
-            messagebox.showerror("Transaction Sequence Error", message=f"Cannot apply interest and fees again in the month of {e.latest_date.strftime('%B')}.")
+            return
+
+        acct_num = self._selected_account
+
+        def assess():
+            run_with_retry(self._session, lambda: self._bank.get_account(acct_num).assess_interest_and_fees(self._session))
+            logger.debug("Triggered interest and fees")
+            logger.debug("Saved to bank.db")
+
+        def failed(ex):
+            if isinstance(ex, TransactionSequenceError):
+                messagebox.showerror("Transaction Sequence Error", message=f"Cannot apply interest and fees again in the month of {ex.latest_date.strftime('%B')}.")
+            else:
+                self._window.report_callback_exception(type(ex), ex, ex.__traceback__)
+
+        self._worker.submit(assess, lambda result: self._refresh_account(acct_num), failed)
 
 def handle_exception(exception, value, traceback):
     print("Sorry! Something unexpected happened. If this problem persists please contact our support team for assistance.")
-    logging.error(f"{exception.__name__}: {repr(value)}")
+    logger.error("%s: %r", exception.__name__, value)
     sys.exit(0)
 
 if __name__ == "__main__":
-    engine = sqlalchemy.create_engine("sqlite:///bank.db")
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    BankGUI()
+    parser = argparse.ArgumentParser(description="Graphical interface to the bank in bank.db")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="SQLite storage profile (default: %(default)s)")
+    parser.add_argument("--connect", metavar="ADDRESS",
+                        help="use the bank server at host:port or a Unix socket path instead of bank.db")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="split the bank into this many files, bank-0.db, bank-1.db, ... (default: %(default)s, bank.db)")
+    add_money_argument(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging_from(args)
+    use_integer_money(args.money == "integer")
+
+    if args.connect:
+        BankGUI(RemoteSession(), RemoteBank(BankClient(args.connect)))
+    elif args.shards > 1:
+        from shards import open_sharded_bank
+        BankGUI(*open_sharded_bank("bank.db", args.shards, args.profile))
+    else:
+        engine = create_bank_engine("bank.db", PROFILES[args.profile])
+        Session = sessionmaker(bind=engine)
+        BankGUI()
 
 
@@ -0,0 +1,105 @@
+import asyncio
+import argparse
+import random
+import time
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+
+from protocol import encode, decode, parse_address
+
+
+def main():
+    '''
+    Drives a running bank server with many concurrent clients and reports throughput and latency.
+    Every client adds deposits and withdrawals to a small set of shared checking accounts, so
+    writes to the same account contend. Afterwards no account may have a negative balance.
+    Input: command-line options, see --help
+    Output: transactions per second, p50/p99 latency and the outcome of every request
+    '''
+    parser = argparse.ArgumentParser(description="Load generator for server.py")
+    parser.add_argument("--address", default="127.0.0.1", help="server address (default: %(default)s)")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent connections (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=200, help="transactions per client (default: %(default)s)")
+    parser.add_argument("--accounts", type=int, default=4, help="accounts shared by the clients (default: %(default)s)")
+    args = parser.parse_args()
+    asyncio.run(run(parse_address(args.address), args.clients, args.requests, args.accounts))
+
+async def connect(address):
+    '''
+    Opens a connection to the server.
+    Input: (host, port) or Unix socket path
+    Output: (reader, writer) streams
+    '''
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+    return await asyncio.open_connection(*address)
+
+async def request(reader, writer, op, **args):
+    '''
+    Sends one request and waits for its response.
+    Input: streams of a connection, operation name and arguments
+    Output: response dict
+    '''
+    writer.write(encode({"op": op, **args}))
+    await writer.drain()
+    return decode(await reader.readline())
+
+async def run(address, clients, requests, accounts):
+    '''
+    Opens the shared accounts, runs the clients and prints the results.
+    Input: server address, number of clients, transactions per client, number of accounts
+    Output: printed report
+    '''
+    ## Set up the accounts with an opening deposit
+    reader, writer = await connect(address)
+    numbers = []
+    today = date.today().isoformat()
+    for _ in range(accounts):
+        number = (await request(reader, writer, "open", type="checking"))["result"]
+        await request(reader, writer, "transaction", account=number, amount="100.00", date=today)
+        numbers.append(number)
+
+    ## Run every client at once
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client(address, numbers, requests, today) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latencies, _ in results for latency in latencies)
+    outcomes = sum((outcomes for _, outcomes in results), Counter())
+    print(f"{len(latencies)} transactions from {clients} clients on {accounts} accounts in {elapsed:.2f} s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} transactions/s")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"p99: {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.2f} ms")
+    for outcome, count in sorted(outcomes.items()):
+        print(f"{outcome}: {count}")
+
+    ## A withdrawal that raced past a balance check would show up here
+    for account in (await request(reader, writer, "summary"))["result"]:
+        if account["number"] in numbers:
+            print(account["summary"])
+    writer.close()
+
+async def client(address, numbers, requests, today):
+    '''
+    Sends transactions to random accounts, mostly withdrawals so that overdrafts are attempted.
+    Input: server address, account numbers, number of transactions, date to use
+    Output: (latency of each request in seconds, Counter of outcomes)
+    '''
+    reader, writer = await connect(address)
+    latencies = []
+    outcomes = Counter()
+    for _ in range(requests):
+        amount = Decimal(random.randint(1, 2000)) / 100
+        if random.random() < 0.7:
+            amount = -amount
+        start = time.perf_counter()
+        response = await request(reader, writer, "transaction", account=random.choice(numbers),
+                                 amount=str(amount), date=today)
+        latencies.append(time.perf_counter() - start)
+        outcomes["ok" if response["ok"] else response["error"]] += 1
+    writer.close()
+    return latencies, outcomes
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import json
+import queue
+import argparse
+import random
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+# every logger of the bank is a child of this one, e.g. "bank.transactions",
+# so each subsystem's level can be set on its own
+ROOT = "bank"
+
+TEXT_FORMAT = '%(asctime)s|%(levelname)s|%(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object with its time, level, logger, message, the arguments of the message and any extra fields."""
+
+    # attributes every record has, anything else was passed with extra=
+    _STANDARD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if isinstance(record.args, tuple) and record.args:
+            entry["args"] = record.args
+        entry.update((key, value) for key, value in vars(record).items() if key not in self._STANDARD)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleDebug(logging.Filter):
+    """Keeps a random fraction of the debug records. Records of other levels always pass."""
+
+    def __init__(self, rate):
+        """
+        Args:
+            rate (float): fraction of debug records to keep, between 0 and 1
+        """
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class _LazyQueueHandler(QueueHandler):
+    """Puts records on the queue unformatted, so the message is built on the listener thread.
+    Only pass arguments that do not change afterwards, such as numbers, strings and dates."""
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(path="bank.log", level="DEBUG", levels=None, sample=1.0, json_format=False):
+    """Sends the bank's log records to a file from a background thread.
+
+    A logging call below the level of its logger returns right away. Otherwise it only puts the record
+    on a queue, and a listener thread formats the message and writes it to the file.
+
+    Args:
+        path (str, optional): log file, created when the first record is written. Defaults to "bank.log".
+        level (str, optional): level of every bank logger. Defaults to "DEBUG".
+        levels (dict, optional): subsystem name, e.g. "transactions", to the level of its logger. Defaults to none.
+        sample (float, optional): fraction of the debug records to keep. Defaults to 1.0, keeping all of them.
+        json_format (bool, optional): write one JSON object per record instead of "time|level|message". Defaults to False.
+
+    Returns:
+        QueueListener: the running listener, which is stopped and drained at exit
+    """
+    handler = logging.FileHandler(path, delay=True)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+
+    records = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(records)
+    if sample < 1:
+        queue_handler.addFilter(SampleDebug(sample))
+
+    ## Records of other libraries still reach the file, but only warnings and worse
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(logging.WARNING)
+    logging.getLogger(ROOT).setLevel(level.upper())
+    for name, subsystem_level in (levels or {}).items():
+        logging.getLogger(f"{ROOT}.{name}").setLevel(subsystem_level.upper())
+
+    listener = QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def _subsystem_level(option):
+    "Splits a --log option into (subsystem, level)"
+    name, _, level = option.partition("=")
+    if not name or not level:
+        raise argparse.ArgumentTypeError(f"expected SUBSYSTEM=LEVEL, got {option!r}")
+    return name, level
+
+
+def add_logging_arguments(parser):
+    """Adds the options of configure_logging to a command line parser"""
+    parser.add_argument("--log-level", default="DEBUG",
+                        help="level of the messages written to bank.log (default: %(default)s)")
+    parser.add_argument("--log", action="append", default=[], type=_subsystem_level, metavar="SUBSYSTEM=LEVEL",
+                        help="level of one subsystem, e.g. transactions=WARNING. May be repeated.")
+    parser.add_argument("--log-sample", type=float, default=1.0, metavar="RATE",
+                        help="fraction of the debug messages to keep (default: %(default)s)")
+    parser.add_argument("--log-json", action="store_true", help="write bank.log as one JSON object per line")
+
+
+def configure_logging_from(args, path="bank.log"):
+    """Calls configure_logging with the options added by add_logging_arguments.
+
+    Args:
+        args (Namespace): parsed command line
+        path (str, optional): log file. Defaults to "bank.log".
+
+    Returns:
+        QueueListener: the running listener
+    """
+    return configure_logging(path, args.log_level, dict(args.log), args.log_sample, args.log_json)
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+
+
+def migrate(engine, metadata):
+    """Brings the tables of an existing database file up to date with the models.
+
+    create_all() only creates missing tables, so columns and indexes added to a
+    model after a bank.db was first created are added here. New columns are
+    nullable and the models fill them in the first time they are used, unless
+    they have a server default, which existing rows are given.
+
+    Args:
+        engine (Engine): engine bound to the database file
+        metadata (MetaData): metadata of the models, usually Base.metadata
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                    if column.server_default is not None:
+                        ddl += f" DEFAULT {column.server_default.arg}"
+                    conn.execute(text(ddl))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
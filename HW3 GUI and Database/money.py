@@ -0,0 +1,251 @@
+from bisect import bisect_right
+from decimal import Decimal, InvalidOperation, setcontext, BasicContext
+
+# Amounts are Decimals unless integer money is turned on with use_integer_money,
+# then they are Money: a whole number of micro-cents (1e-8 dollars). Money
+# rounds every result the way Decimal does under BasicContext, to 9
+# significant digits with ROUND_HALF_UP, so both modes give the same figures
+# for amounts with at most 8 decimal places. Longer amounts, such as some
+# interest, are rounded to a micro-cent in Money mode only, so the Decimal
+# mode keeps its figures exactly as they were.
+
+UNITS_PER_DOLLAR = 10 ** 8
+PLACES = 8
+PRECISION = 9
+
+# _POWERS[k] is 10 ** (k + 1), so bisect_right(_POWERS, n) is the number of digits of n, less one
+_POWERS = tuple(10 ** k for k in range(1, 80))
+
+_integer_money = False
+
+
+def use_integer_money(enabled=True):
+    """Chooses what amounts are kept as from now on. Set it once at startup, before any amount is made.
+
+    Args:
+        enabled (bool, optional): True for Money, False for Decimal. Defaults to True.
+    """
+    global _integer_money
+    _integer_money = enabled
+
+
+def integer_money_enabled():
+    "Returns whether amounts are kept as Money"
+    return _integer_money
+
+
+def start_worker(integer_money):
+    """Gives a worker process the same decimal context and kind of amounts as the CLI. Pass it as the initializer
+    of a process pool, with integer_money_enabled() as its argument.
+
+    Args:
+        integer_money (bool): whether the process that started the worker keeps amounts as Money
+    """
+    setcontext(BasicContext)
+    use_integer_money(integer_money)
+
+
+def add_money_argument(parser):
+    """Adds --money, the kind of amounts to keep, to a command line parser. Pass its value to use_integer_money."""
+    parser.add_argument("--money", choices=["decimal", "integer"], default="decimal",
+                        help="keep amounts as Decimal or as integer micro-cents; both give the same figures "
+                             "(default: %(default)s)")
+
+
+def amount(value):
+    """Converts a Decimal, int or Money to the kind of amount in use.
+
+    Args:
+        value (Decimal, int or Money): amount to convert
+
+    Returns:
+        Money or Decimal: the amount
+    """
+    if _integer_money:
+        return value if isinstance(value, Money) else Money.from_decimal(value)
+    return value.to_decimal() if isinstance(value, Money) else Decimal(value)
+
+
+def interest(balance, rate):
+    """Multiplies a balance by a monthly interest rate. A Decimal balance gives balance * rate in the current
+    context. A Money balance gives the product rounded to 9 significant digits, as BasicContext does, then half up
+    to a micro-cent, since Money can't keep more places.
+
+    Args:
+        balance (Decimal or Money): balance the interest is earned on
+        rate (Decimal): interest rate
+
+    Returns:
+        Decimal or Money: interest, the same kind as balance
+    """
+    return balance * rate
+
+
+def _divide_half_up(n, divisor):
+    "Divides a non-negative integer by a power of ten, rounding half up"
+    q, r = divmod(n, divisor)
+    return q + 1 if r * 2 >= divisor else q
+
+
+def _round_significant(units):
+    "Rounds a number of micro-cents to PRECISION significant digits, half up"
+    n = units if units >= 0 else -units
+    if n < _POWERS[PRECISION - 1]:
+        return units
+    factor = _POWERS[bisect_right(_POWERS, n) - PRECISION]
+    n = _divide_half_up(n, factor) * factor
+    return n if units >= 0 else -n
+
+
+class Money:
+    """An amount of money as a whole number of micro-cents. Adding, subtracting, negating and multiplying round the
+    result like Decimal under BasicContext. Money mixes with int and Decimal operands, which are converted exactly
+    when they have at most 8 decimal places.
+    """
+
+    __slots__ = ("units",)
+
+    def __init__(self, units=0):
+        """
+        Args:
+            units (int, optional): amount in micro-cents. Defaults to 0.
+        """
+        self.units = units
+
+    @classmethod
+    def from_decimal(cls, value):
+        """Converts an int or Decimal, rounding half up to a micro-cent.
+
+        Args:
+            value (int or Decimal): amount in dollars
+
+        Returns:
+            Money: the amount
+        """
+        if isinstance(value, int):
+            return cls(value * UNITS_PER_DOLLAR)
+        value = Decimal(value)
+        if not value.is_finite():
+            raise InvalidOperation(f"{value} is not an amount of money")
+        sign, digits, exponent = value.as_tuple()
+        n = int("".join(map(str, digits)))
+        shift = exponent + PLACES
+        n = n * 10 ** shift if shift >= 0 else _divide_half_up(n, 10 ** -shift)
+        return cls(-n if sign else n)
+
+    def to_decimal(self):
+        "Returns the exact amount as a Decimal with 8 decimal places"
+        return Decimal(f"{self.units}E-{PLACES}")
+
+    def _units_of(self, other):
+        "Micro-cents of the other operand, or None if it is not an amount"
+        if isinstance(other, Money):
+            return other.units
+        if isinstance(other, (int, Decimal)):
+            return Money.from_decimal(other).units
+        return None
+
+    def __add__(self, other):
+        units = self._units_of(other)
+        if units is None:
+            return NotImplemented
+        return Money(_round_significant(self.units + units))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        units = self._units_of(other)
+        if units is None:
+            return NotImplemented
+        return Money(_round_significant(self.units - units))
+
+    def __rsub__(self, other):
+        units = self._units_of(other)
+        if units is None:
+            return NotImplemented
+        return Money(_round_significant(units - self.units))
+
+    def __neg__(self):
+        return Money(_round_significant(-self.units))
+
+    def __pos__(self):
+        return Money(_round_significant(self.units))
+
+    def __abs__(self):
+        return Money(_round_significant(abs(self.units)))
+
+    def __mul__(self, rate):
+        """Multiplies by a Decimal or int, rounding to 9 significant digits and then half up to a micro-cent"""
+        if isinstance(rate, int):
+            rate = Decimal(rate)
+        if not isinstance(rate, Decimal):
+            return NotImplemented
+        sign, digits, exponent = rate.as_tuple()
+        product = self.units * int("".join(map(str, digits)))
+        if sign:
+            product = -product
+        ## the product has -exponent more places than a micro-cent
+        product = _round_significant(product)
+        if exponent < 0:
+            n = _divide_half_up(abs(product), 10 ** -exponent)
+            product = n if product >= 0 else -n
+        else:
+            product = _round_significant(product * 10 ** exponent)
+        return Money(product)
+
+    __rmul__ = __mul__
+
+    def _compare(self, other):
+        "Returns (self, other) as comparable numbers"
+        if isinstance(other, Money):
+            return self.units, other.units
+        if isinstance(other, int):
+            return self.units, other * UNITS_PER_DOLLAR
+        return self.to_decimal(), other
+
+    def __eq__(self, other):
+        if not isinstance(other, (Money, int, Decimal)):
+            return NotImplemented
+        a, b = self._compare(other)
+        return a == b
+
+    def __lt__(self, other):
+        if not isinstance(other, (Money, int, Decimal)):
+            return NotImplemented
+        a, b = self._compare(other)
+        return a < b
+
+    def __le__(self, other):
+        if not isinstance(other, (Money, int, Decimal)):
+            return NotImplemented
+        a, b = self._compare(other)
+        return a <= b
+
+    def __gt__(self, other):
+        if not isinstance(other, (Money, int, Decimal)):
+            return NotImplemented
+        a, b = self._compare(other)
+        return a > b
+
+    def __ge__(self, other):
+        if not isinstance(other, (Money, int, Decimal)):
+            return NotImplemented
+        a, b = self._compare(other)
+        return a >= b
+
+    def __hash__(self):
+        # equal to the Decimal with the same value, so it must hash like it
+        return hash(self.to_decimal())
+
+    def __bool__(self):
+        return self.units != 0
+
+    def __format__(self, spec):
+        # formatted as the exact Decimal, so a format such as ",.2f" rounds the same way in both modes
+        return format(self.to_decimal(), spec)
+
+    def __str__(self):
+        return str(self.to_decimal())
+
+    def __repr__(self):
+        return f"Money('{self.to_decimal()}')"
@@ -0,0 +1,132 @@
+import os
+import logging
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from bank import Bank
+from money import amount, integer_money_enabled, start_worker
+from storage import create_read_only_engine, has_uncommitted_writes
+from transactions import last_day_of_month
+from exceptions import TransactionSequenceError
+
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger("bank.month_end")
+
+# Month end in a pool of processes. The accounts are split into ranges of
+# account numbers, one per worker. Each worker opens bank.db read-only, decides
+# which of its accounts to assess with the checks of Bank.run_month_end and
+# computes their interest and fees with Account._month_end_amounts, the rules
+# of _assess_interest and _assess_fees. This process is the only writer: it
+# records the amounts on its own accounts in account number order and inserts
+# them in one batch, so the rows, their ids, the balances and the statements
+# are the same as Bank.run_month_end gives.
+
+
+def run_month_end_in_processes(bank, month, session, workers=None):
+    """Does what Bank.run_month_end does, computing the interest and fees in a pool of processes.
+    The workers only see what is committed, so the session must not have uncommitted writes: commit them
+    first, outside the unit of work this runs in. The caller commits the month end.
+
+    An account that changed after its worker read it, which its version number shows, is assessed
+    again here from its current balance.
+
+    Args:
+        bank (Bank): bank to assess, stored in a database file
+        month (Date): any day in the month to assess
+        session (Session): session the bank was loaded in
+        workers (int, optional): number of processes. Defaults to None for one per CPU.
+
+    Returns:
+        list: (account number, TransactionSequenceError) for each account that was skipped
+    """
+    month_end = last_day_of_month(month)
+    if has_uncommitted_writes(session):
+        raise RuntimeError("Commit the session before running month end in processes")
+    path = session.get_bind().url.database
+    accounts = sorted(bank.show_accounts(), key=lambda x: x.account_number)
+    ranges = number_ranges([x.account_number for x in accounts], workers or os.cpu_count() or 1)
+
+    versions = {}
+    planned = {}
+    if ranges:
+        firsts, lasts = zip(*ranges)
+        with ProcessPoolExecutor(len(ranges), initializer=start_worker, initargs=(integer_money_enabled(),)) as pool:
+            for range_versions, range_plan in pool.map(_assess_range, repeat(path), repeat(bank._id), firsts, lasts,
+                                                       repeat(month_end)):
+                versions.update(range_versions)
+                planned.update((acct_num, (amounts, latest_date)) for acct_num, amounts, latest_date in range_plan)
+
+    ## merge in account number order, as Bank.run_month_end assesses them
+    bank._load_statements([x for x in accounts if planned.get(x.account_number, (None, None))[0] is not None],
+                          month_end, session)
+    errors = []
+    transactions = []
+    for x in accounts:
+        if versions.get(x.account_number) == x._version:
+            if x.account_number not in planned:
+                # nothing to assess on an account without transactions
+                continue
+            amounts, latest_date = planned[x.account_number]
+            if latest_date is not None:
+                errors.append((x.account_number, TransactionSequenceError(latest_date)))
+            else:
+                transactions.extend(x._month_end_transactions(month_end, [amount(Decimal(a)) for a in amounts]))
+            continue
+        logger.debug("Account %s changed after its worker read it, assessing it here", x.account_number)
+        for account, error in bank._month_end_plan(month_end, session, [x]):
+            if error is not None:
+                errors.append((account.account_number, error))
+            else:
+                transactions.extend(account._month_end_transactions(month_end))
+    bank._insert_month_end(transactions, session)
+    return errors
+
+
+def number_ranges(numbers, count):
+    """Splits account numbers into at most count ranges with about as many accounts each.
+
+    Args:
+        numbers (list): account numbers in increasing order
+        count (int): number of ranges wanted
+
+    Returns:
+        list: (first, last) account numbers of each range, in order
+    """
+    count = min(count, len(numbers))
+    ranges = []
+    for i in range(count):
+        start, end = i * len(numbers) // count, (i + 1) * len(numbers) // count
+        ranges.append((numbers[start], numbers[end - 1]))
+    return ranges
+
+
+def _assess_range(path, bank_id, first, last, month_end):
+    """Worker: reads the accounts numbered first to last from the database file and computes their month end.
+
+    Returns:
+        tuple: dict of the version of every account read by account number, and (account number, amounts as
+        strings, None) for each account to assess or (account number, None, latest date of the
+        TransactionSequenceError) for each one to skip
+    """
+    engine = create_read_only_engine(path)
+    session = sessionmaker(bind=engine)()
+    try:
+        # filling in missing latest dates and balances only changes objects in
+        # memory, which must not be flushed to the read-only file
+        with session.no_autoflush:
+            bank = session.get(Bank, bank_id)
+            accounts = bank._accounts_in_range_query(session, first, last).all()
+            versions = {x.account_number: x._version for x in accounts}
+            plan = []
+            for x, error in bank._month_end_plan(month_end, session, accounts):
+                if error is not None:
+                    plan.append((x.account_number, None, error.latest_date))
+                else:
+                    plan.append((x.account_number, [str(a) for a in x._month_end_amounts(x.get_balance())], None))
+            return versions, plan
+    finally:
+        session.rollback()
+        session.close()
+        engine.dispose()
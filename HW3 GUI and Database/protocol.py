@@ -0,0 +1,77 @@
+import json
+from datetime import date
+
+from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError, AccountNotFoundError
+
+# the bank server speaks one JSON object per line in each direction. A request
+# is {"op": ..., **arguments}, a response is {"ok": true, "result": ...} or
+# {"ok": false, "error": <exception class name>, **exception attributes}.
+# Amounts travel as strings so that no precision is lost to floats.
+
+DEFAULT_PORT = 8327
+
+
+def encode(message):
+    "Serializes a request or response as one line"
+    return json.dumps(message).encode() + b"\n"
+
+
+def decode(line):
+    "Parses a line written by encode"
+    return json.loads(line)
+
+
+def parse_address(address):
+    """Splits a server address into (host, port), or returns it unchanged if it is a Unix socket path.
+
+    Args:
+        address (str): "host:port", ":port", "host" or a path containing a "/"
+    """
+    if "/" in address:
+        return address
+    host, _, port = address.partition(":")
+    return host or "127.0.0.1", int(port or DEFAULT_PORT)
+
+
+def encode_error(ex):
+    """Describes an exception raised by a bank operation so the client can raise it again.
+
+    Args:
+        ex (Exception): exception raised while handling a request
+
+    Returns:
+        dict: error response
+    """
+    response = {"ok": False, "error": ex.__class__.__name__}
+    if isinstance(ex, TransactionLimitError):
+        response.update(limit_type=ex.limit_type, limit=ex.limit)
+    elif isinstance(ex, TransactionSequenceError):
+        response.update(latest_date=ex.latest_date.isoformat())
+    elif isinstance(ex, AccountNotFoundError):
+        response.update(account_number=ex.account_number)
+    else:
+        response.update(message=str(ex))
+    return response
+
+
+def decode_error(response):
+    """Rebuilds the exception described by an error response.
+
+    Args:
+        response (dict): error response from encode_error
+
+    Returns:
+        Exception: the bank exception, ValueError for bad requests or RuntimeError for anything else
+    """
+    error = response["error"]
+    if error == "OverdrawError":
+        return OverdrawError()
+    if error == "TransactionLimitError":
+        return TransactionLimitError(response["limit_type"], response["limit"])
+    if error == "TransactionSequenceError":
+        return TransactionSequenceError(date.fromisoformat(response["latest_date"]))
+    if error == "AccountNotFoundError":
+        return AccountNotFoundError(response["account_number"])
+    if error in ("ValueError", "InvalidOperation", "KeyError", "TypeError"):
+        return ValueError(response.get("message", error))
+    return RuntimeError(f"{error}: {response.get('message', '')}")
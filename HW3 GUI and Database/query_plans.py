@@ -0,0 +1,47 @@
+from datetime import date
+
+from accounts import Account, TRANSACTION_PAGE_SIZE
+from transactions import last_day_of_month
+
+
+def hot_queries(session, bank):
+    """Builds the queries the bank runs most often, for the first account and the current month.
+
+    Args:
+        session (Session): session to build the queries with
+        bank (Bank): bank the queries are for
+
+    Returns:
+        list: (description, Query) pairs, empty if the bank has no accounts
+    """
+    account = session.query(Account).filter(Account._bank_id == bank._id).first()
+    if account is None:
+        return []
+    # the pages after the first are the ones filtered by the (date, id) key
+    first_page = account._transaction_page(None, 1, False)
+    return [
+        ("select account", bank._account_query(session, account.account_number)),
+        ("list transactions", account._transaction_page_query(first_page[-1] if first_page else None,
+                                                              TRANSACTION_PAGE_SIZE, False)),
+        ("latest transaction date", account._latest_date_query(session)),
+        ("transaction limit counts", account._counts_query(session)),
+        ("interest and fee months", account._exempt_dates_query(session)),
+        ("month end assessed accounts", bank._assessed_query(session, last_day_of_month(date.today()))),
+    ]
+
+
+def explain(session, query):
+    """Asks SQLite how it would run a query.
+
+    Args:
+        session (Session): session connected to the SQLite database
+        query (Query): query to explain
+
+    Returns:
+        list: detail column of each EXPLAIN QUERY PLAN row, e.g. 'SEARCH transactions USING INDEX ...'
+    """
+    compiled = query.statement.compile(dialect=session.bind.dialect)
+    params = compiled.construct_params()
+    args = tuple(params[name] for name in compiled.positiontup)
+    rows = session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), args)
+    return [row[-1] for row in rows]
@@ -0,0 +1,406 @@
+import asyncio
+import argparse
+import itertools
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, localcontext, BasicContext
+
+from bank import Bank, _forget_bank_state
+from accounts import Account, _forget_account_state
+from transactions import Transaction
+from statements import MonthlyStatement
+from storage import PROFILES, DEFAULT_PROFILE, create_bank_engine, run_with_retry, has_uncommitted_writes
+from protocol import encode, decode, encode_error, parse_address
+from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError, AccountNotFoundError
+from logs import add_logging_arguments, configure_logging_from
+from money import add_money_argument, use_integer_money
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import sessionmaker
+
+# errors that are part of normal operation and go back to the client as-is
+CLIENT_ERRORS = (OverdrawError, TransactionLimitError, TransactionSequenceError, AccountNotFoundError,
+                 ValueError, InvalidOperation, KeyError, TypeError)
+
+logger = logging.getLogger("bank.server")
+
+# stands for the bank row in a set of changed account numbers, see _expire
+_BANK = "bank"
+
+
+class _BankLock:
+    """Lets any number of writes to single accounts run together, or one write that touches every account.
+    Writes to the same account are further serialized by a lock per account.
+    """
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @asynccontextmanager
+    async def shared(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._exclusive)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def exclusive(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._exclusive and self._shared == 0)
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+class _Worker:
+    """A database thread with a session kept for the life of the server. The accounts it loads keep their counts,
+    statement and latest date from one request to the next, instead of building them again for every request.
+    """
+
+    def __init__(self, Session):
+        """
+        Args:
+            Session (sessionmaker): creates sessions on the bank database
+        """
+        self.executor = ThreadPoolExecutor(1)
+        # nothing is expired at commit, what other workers change is expired by _expire instead
+        self.session = Session(expire_on_commit=False)
+        self.bank = None
+        # what other workers committed since this one last ran a job, see _expire
+        self.changed = set()
+
+    def run(self, job, args, changed):
+        """Runs job(session, bank, *args) on this worker's thread after expiring what changed, committing if it succeeds.
+        The job is retried if another process changed the same account first."""
+        _expire(self.session, changed)
+
+        def work():
+            if self.bank is None:
+                self.bank = self.session.query(Bank).first()
+            try:
+                return job(self.session, self.bank, *args), None
+            except CLIENT_ERRORS as ex:
+                if has_uncommitted_writes(self.session):
+                    raise
+                # a request refused before it wrote anything commits its reads instead
+                # of rolling back, which would drop the counts of every account
+                return None, ex
+
+        # decimal contexts are per thread
+        with localcontext(BasicContext):
+            result, error = run_with_retry(self.session, work)
+        if error is not None:
+            try:
+                raise error
+            finally:
+                # the traceback holds this frame, which would keep the error alive, and with it the
+                # account lock held by the request that raised it
+                del error
+        return result
+
+
+class BankServer:
+    """Serves one bank database to many clients over a socket.
+
+    Requests run on worker threads, each with a session it keeps. The requests about one account always
+    go to the same worker, the others to the workers in turn. Reads run concurrently. Writes to an account
+    wait for earlier writes to the same account, so the balance and limit checks of one transaction cannot
+    interleave with another's. Operations on every account (month end, import, reconcile) run alone.
+    Once a write is committed, the other workers expire what it changed before their next request. The server
+    expects to be the only process writing bank.db: a write from elsewhere is still caught by the version checks
+    of the accounts it changed, but reads may not show it.
+    """
+
+    def __init__(self, Session, workers=8):
+        """
+        Args:
+            Session (sessionmaker): creates sessions on the bank database
+            workers (int, optional): threads that run database work. Defaults to 8.
+        """
+        self._workers = [_Worker(Session) for _ in range(workers)]
+        self._turns = itertools.count()
+        self._bank_lock = _BankLock()
+        # a lock lives as long as a write to its account holds it or waits for it
+        self._account_locks = weakref.WeakValueDictionary()
+        self._open_lock = asyncio.Lock()
+
+        self._ops = {
+            "summary": self._summary,
+            "account": self._account,
+            "transactions": self._transactions,
+            "statement": self._statement,
+            "totals": self._totals,
+            "balance": self._balance,
+            "open": self._open,
+            "transaction": self._transaction,
+            "interest": self._interest,
+            "month_end": self._month_end,
+            "import": self._import,
+            "reconcile": self._reconcile,
+            "reconcile_statements": self._reconcile_statements,
+        }
+
+    async def serve(self, address):
+        """Accepts clients until cancelled.
+
+        Args:
+            address (tuple or str): (host, port) for TCP or a path for a Unix socket
+        """
+        if isinstance(address, str):
+            server = await asyncio.start_unix_server(self.handle_client, path=address)
+        else:
+            server = await asyncio.start_server(self.handle_client, *address)
+        logger.info("Bank server listening on %s", address)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        "Answers the requests of one client in order until it disconnects"
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(encode(await self.dispatch(decode(line))))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        """Runs one request.
+
+        Args:
+            request (dict): {"op": name, **arguments}
+
+        Returns:
+            dict: response
+        """
+        op = self._ops.get(request.get("op"))
+        try:
+            if op is None:
+                raise ValueError(f"Unknown operation {request.get('op')!r}")
+            return {"ok": True, "result": await op(request)}
+        except CLIENT_ERRORS as ex:
+            return encode_error(ex)
+        except Exception as ex:
+            logger.error("%s: %r", ex.__class__.__name__, str(ex))
+            return encode_error(ex)
+
+    async def _run(self, job, *args, account=None, changes=frozenset()):
+        """Runs job(session, bank, *args) on a worker thread in the worker's session, committing if it succeeds.
+
+        Args:
+            account (int, optional): account the job is about, whose worker runs it. Defaults to None for any worker.
+            changes (set, optional): what the job changes, for the other workers to expire once it succeeded:
+                account numbers and _BANK for the bank row, or None for anything. Defaults to nothing.
+        """
+        i = (next(self._turns) if account is None else account) % len(self._workers)
+        worker = self._workers[i]
+        changed, worker.changed = worker.changed, set()
+        result = await asyncio.get_running_loop().run_in_executor(worker.executor, worker.run, job, args, changed)
+        if changes is None or changes:
+            for other in self._workers:
+                if other is not worker and other.changed is not None:
+                    other.changed = None if changes is None else other.changed | changes
+        return result
+
+    async def _read(self, job, *args, account=None):
+        return await self._run(job, *args, account=account)
+
+    async def _write_account(self, acct_num, job, *args):
+        async with self._bank_lock.shared():
+            lock = self._account_locks.get(acct_num)
+            if lock is None:
+                lock = self._account_locks[acct_num] = asyncio.Lock()
+            async with lock:
+                return await self._run(job, *args, account=acct_num, changes={acct_num})
+
+    async def _write_bank(self, job, *args):
+        async with self._bank_lock.exclusive():
+            return await self._run(job, *args, changes=None)
+
+    ## Reads
+
+    async def _summary(self, request):
+        return await self._read(_summary)
+
+    async def _account(self, request):
+        acct_num = int(request["account"])
+        return await self._read(_account, acct_num, account=acct_num)
+
+    async def _transactions(self, request):
+        acct_num = int(request["account"])
+        return await self._read(_transactions, acct_num, request.get("after"),
+                                request.get("limit"), bool(request.get("newest_first")), account=acct_num)
+
+    async def _statement(self, request):
+        acct_num = int(request["account"])
+        return await self._read(_statement, acct_num, int(request["year"]), int(request["month"]), account=acct_num)
+
+    async def _balance(self, request):
+        acct_num = int(request["account"])
+        return await self._read(_balance, acct_num, date.fromisoformat(request["date"]), account=acct_num)
+
+    async def _totals(self, request):
+        return await self._read(_totals, datetime.strptime(request["month"], "%Y-%m").date())
+
+    ## Writes
+
+    async def _open(self, request):
+        # account numbers come from one counter on the bank
+        async with self._bank_lock.shared():
+            async with self._open_lock:
+                return await self._run(_open, request["type"], changes={_BANK})
+
+    async def _transaction(self, request):
+        acct_num = int(request["account"])
+        return await self._write_account(acct_num, _transaction, acct_num, Decimal(request["amount"]),
+                                         date.fromisoformat(request["date"]))
+
+    async def _interest(self, request):
+        acct_num = int(request["account"])
+        return await self._write_account(acct_num, _interest, acct_num)
+
+    async def _month_end(self, request):
+        return await self._write_bank(_month_end, datetime.strptime(request["month"], "%Y-%m").date())
+
+    async def _import(self, request):
+        return await self._write_bank(_import, request["rows"])
+
+    async def _reconcile(self, request):
+        return await self._write_bank(_reconcile)
+
+    async def _reconcile_statements(self, request):
+        return await self._write_bank(_reconcile_statements)
+
+
+def _expire(session, changed):
+    """Expires what other workers changed in a worker's session, so it is read again when it is next used.
+    An account whose version changed rebuilds its counts, see Account._check_state_version.
+
+    Args:
+        session (Session): the worker's session
+        changed (set): numbers of the accounts that changed and _BANK if the bank row did, or None if anything may have
+    """
+    if changed is None:
+        session.expire_all()
+        _forget_account_state(session)
+        _forget_bank_state(session)
+        return
+    if not changed:
+        return
+    for obj in list(session.identity_map.values()):
+        # only what is still loaded is looked at, reading an expired attribute would load it again
+        loaded = inspect(obj).dict
+        if isinstance(obj, Account):
+            if loaded.get("_account_number") in changed:
+                session.expire(obj)
+        elif isinstance(obj, MonthlyStatement):
+            if loaded.get("_acct_num") in changed:
+                session.expire(obj)
+        elif isinstance(obj, Bank) and _BANK in changed:
+            session.expire(obj)
+
+
+## Jobs run on the worker threads, each gets its worker's session and bank
+
+def _describe(account):
+    return {"number": account.account_number, "summary": str(account)}
+
+def _get_account(bank, acct_num):
+    account = bank.get_account(acct_num)
+    if account is None:
+        raise AccountNotFoundError(acct_num)
+    return account
+
+def _summary(session, bank):
+    return [_describe(x) for x in bank.show_accounts()]
+
+def _account(session, bank, acct_num):
+    account = bank.get_account(acct_num)
+    return _describe(account) if account else None
+
+def _transactions(session, bank, acct_num, after, limit, newest_first):
+    if after is not None:
+        after = session.get(Transaction, int(after))
+    return [{"id": t.id, "date": t.date.isoformat(), "amount": str(t._amt), "text": str(t)}
+            for t in _get_account(bank, acct_num).iter_transactions(after, limit, newest_first)]
+
+def _statement(session, bank, acct_num, year, month):
+    statement = _get_account(bank, acct_num).get_statement(year, month)
+    return str(statement) if statement else None
+
+def _balance(session, bank, acct_num, day):
+    return str(_get_account(bank, acct_num).balance_as_of(day))
+
+def _totals(session, bank, month):
+    return {key: value if key == "transactions" else str(value) for key, value in bank.month_totals(month, session).items()}
+
+def _open(session, bank, acct_type):
+    account = bank.add_account(acct_type, session)
+    return account.account_number if account else None
+
+def _transaction(session, bank, acct_num, amt, day):
+    account = _get_account(bank, acct_num)
+    account.add_transaction(amt, day, session)
+    return _describe(account)
+
+def _interest(session, bank, acct_num):
+    account = _get_account(bank, acct_num)
+    account.assess_interest_and_fees(session)
+    return _describe(account)
+
+def _month_end(session, bank, month):
+    return [[acct_num, ex.latest_date.isoformat()] for acct_num, ex in bank.run_month_end(month, session)]
+
+def _import(session, bank, rows):
+    return [[row_num, encode_error(ex)] for row_num, ex in bank.import_transactions(rows, session)]
+
+def _reconcile(session, bank):
+    return [[acct_num, str(drift)] for acct_num, drift in bank.reconcile(session).items()]
+
+def _reconcile_statements(session, bank):
+    return [[acct_num, months] for acct_num, months in bank.reconcile_statements(session).items()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve bank.db to CLI and GUI clients")
+    parser.add_argument("--address", default="127.0.0.1",
+                        help="host:port to listen on, or a path for a Unix socket (default: %(default)s)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="SQLite storage profile (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=8, help="database threads (default: %(default)s)")
+    add_money_argument(parser)
+    add_logging_arguments(parser)
+    args = parser.parse_args()
+    configure_logging_from(args)
+    use_integer_money(args.money == "integer")
+
+    engine = create_bank_engine("bank.db", PROFILES[args.profile])
+    Session = sessionmaker(bind=engine)
+    # the bank row is created once here so concurrent requests never race to create it
+    with Session() as session:
+        if not session.query(Bank).first():
+            session.add(Bank())
+            session.commit()
+
+    try:
+        asyncio.run(BankServer(Session, args.workers).serve(parse_address(args.address)))
+    except KeyboardInterrupt:
+        pass
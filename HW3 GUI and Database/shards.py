@@ -0,0 +1,269 @@
+import os
+import logging
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from bank import Bank, _forget_bank_state
+from accounts import _forget_account_state
+from money import amount, integer_money_enabled, start_worker
+from exceptions import TransactionSequenceError
+from storage import PROFILES, create_bank_engine, run_with_retry, has_uncommitted_writes
+
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger("bank.shards")
+
+# A sharded bank keeps its accounts in several database files, bank-0.db,
+# bank-1.db and so on, each holding a whole Bank with its own accounts,
+# transactions and statements. Account number n lives in shard (n - 1) % count,
+# so any account is found without asking the other shards. The number of shards
+# is saved in every file and cannot change once accounts exist.
+
+
+def shard_paths(path, count):
+    """Names the database files of a bank split into shards.
+
+    Args:
+        path (str): database file of the unsharded bank, e.g. "bank.db"
+        count (int): number of shards
+
+    Returns:
+        list: file of each shard, e.g. ["bank-0.db", "bank-1.db"]
+    """
+    root, ext = os.path.splitext(path)
+    return [f"{root}-{i}{ext}" for i in range(count)]
+
+
+def shard_of(acct_num, count):
+    "Returns the index of the shard that holds an account number"
+    return (acct_num - 1) % count
+
+
+def open_sharded_bank(path, count, profile):
+    """Opens, or creates, every shard of a bank.
+
+    Args:
+        path (str): database file of the unsharded bank, e.g. "bank.db"
+        count (int): number of shards
+        profile (str): name of the storage profile for every shard
+
+    Returns:
+        tuple: (ShardedSession, ShardedBank)
+
+    Raises:
+        ValueError: a file belongs to a bank with a different number of shards, or to an unsharded bank
+    """
+    paths = shard_paths(path, count)
+    sessions = []
+    banks = []
+    for i, shard_path in enumerate(paths):
+        session = sessionmaker(bind=create_bank_engine(shard_path, PROFILES[profile]))()
+        bank = session.query(Bank).first()
+        if bank is None:
+            bank = Bank(i, count)
+            session.add(bank)
+            session.commit()
+        elif (bank._shard, bank._shard_count) != (i, count):
+            raise ValueError(f"{shard_path} is not shard {i} of a bank with {count} shards")
+        sessions.append(session)
+        banks.append(bank)
+    logger.debug("Opened %s shards of %s", count, path)
+    return ShardedSession(sessions), ShardedBank(banks, sessions, paths, profile)
+
+
+class ShardedSession:
+    """Stands in for a Session when the bank is split into shards, with one real session per shard.
+
+    Commits and rollbacks go to every shard. A commit is not atomic across shards, but only month end,
+    import and reconcile write to more than one, and each of those can be run again safely.
+    """
+
+    def __init__(self, sessions):
+        """
+        Args:
+            sessions (list): session of each shard, in shard order
+        """
+        self.sessions = sessions
+
+    def session_for(self, acct_num):
+        "Returns the session of the shard that holds an account number"
+        return self.sessions[shard_of(acct_num, len(self.sessions))]
+
+    def add(self, obj):
+        "Adds a new account, transaction or statement to the session of its account's shard"
+        acct_num = obj._acct_num if hasattr(obj, "_acct_num") else obj.account_number
+        self.session_for(acct_num).add(obj)
+
+    def commit(self):
+        for session in self.sessions:
+            session.commit()
+
+    def rollback(self):
+        for session in self.sessions:
+            session.rollback()
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+
+class ShardedBank:
+    """Bank split into shards, with the methods of Bank that the CLI and GUI use.
+
+    Opening, finding and changing an account goes to the one shard that holds it. Month end and
+    month_totals run on every shard at once in a pool of processes, one database file each.
+    """
+
+    def __init__(self, banks, sessions, paths, profile):
+        """
+        Args:
+            banks (list): Bank of each shard, in shard order
+            sessions (list): session each Bank was loaded in
+            paths (list): database file of each shard
+            profile (str): name of the storage profile, for the worker processes
+        """
+        self._banks = banks
+        self._sessions = sessions
+        self._paths = paths
+        self._profile = profile
+
+    def shard(self, i):
+        "Returns (session, Bank) of one shard"
+        return self._sessions[i], self._banks[i]
+
+    def add_account(self, acct_type, session):
+        """Opens an account in the shard with the lowest next account number, so numbers are handed out in order.
+        The caller commits the session.
+        """
+        i = min(range(len(self._banks)), key=lambda i: self._banks[i].next_account_number())
+        return self._banks[i].add_account(acct_type, self._sessions[i])
+
+    def show_accounts(self):
+        "Returns the accounts of every shard, by account number"
+        return sorted((x for bank in self._banks for x in bank.show_accounts()), key=lambda x: x.account_number)
+
+    def get_account(self, account_num):
+        """Fetches an account from the shard that holds it.
+
+        Args:
+            account_num (int): account number to search for
+
+        Returns:
+            Account: matching account or None if not found
+        """
+        return self._banks[shard_of(account_num, len(self._banks))].get_account(account_num)
+
+    def import_transactions(self, rows, session):
+        """Splits the rows by shard and imports each shard's rows with Bank.import_transactions.
+        The caller commits the session.
+
+        Returns:
+            list: (row number, exception) for each rejected row, counting rows from 1
+        """
+        count = len(self._banks)
+        rows_of = [[] for _ in range(count)]
+        row_nums_of = [[] for _ in range(count)]
+        for row_num, row in enumerate(rows, start=1):
+            try:
+                i = shard_of(int(row[0]), count)
+            except (ValueError, IndexError):
+                # any shard reports the row as invalid
+                i = 0
+            rows_of[i].append(row)
+            row_nums_of[i].append(row_num)
+
+        errors = []
+        for i, bank in enumerate(self._banks):
+            if rows_of[i]:
+                errors.extend((row_nums_of[i][row_num - 1], ex)
+                              for row_num, ex in bank.import_transactions(rows_of[i], self._sessions[i]))
+        return sorted(errors, key=lambda x: x[0])
+
+    def run_month_end(self, month, session):
+        """Runs Bank.run_month_end on every shard at once, each in its own process, which commits it.
+        A shard that fails leaves the others assessed; running the month again only assesses the rest.
+
+        The workers write to the files, so the sessions must not have uncommitted writes: commit them first,
+        outside the unit of work this runs in.
+
+        Returns:
+            list: (account number, TransactionSequenceError) for each account that was skipped
+        """
+        if any(has_uncommitted_writes(shard_session) for shard_session in self._sessions):
+            raise RuntimeError("Commit the session before running month end on the shards")
+        errors = []
+        for shard_errors in self._map(_month_end_of_shard, month):
+            errors.extend((acct_num, TransactionSequenceError(date.fromisoformat(latest_date)))
+                          for acct_num, latest_date in shard_errors)
+        # the accounts in memory do not know what the workers added
+        for shard_session in self._sessions:
+            shard_session.expire_all()
+            _forget_account_state(shard_session)
+            _forget_bank_state(shard_session)
+        return sorted(errors, key=lambda x: x[0])
+
+    def month_totals(self, month, session):
+        """Adds up Bank.month_totals of every shard, computed at once, each in its own process.
+
+        Returns:
+            dict: "deposits", "withdrawals", "interest", "fees" and "transactions" totals
+        """
+        totals = {"deposits": amount(0), "withdrawals": amount(0), "interest": amount(0), "fees": amount(0),
+                  "transactions": 0}
+        for shard_totals in self._map(_month_totals_of_shard, month):
+            for key, value in shard_totals.items():
+                totals[key] += amount(value) if key != "transactions" else value
+        return totals
+
+    def reconcile(self, session):
+        "Runs Bank.reconcile on every shard. The caller commits the session."
+        drifts = {}
+        for i, bank in enumerate(self._banks):
+            drifts.update(bank.reconcile(self._sessions[i]))
+        return dict(sorted(drifts.items()))
+
+    def reconcile_statements(self, session):
+        "Runs Bank.reconcile_statements on every shard. The caller commits the session."
+        fixed = {}
+        for i, bank in enumerate(self._banks):
+            fixed.update(bank.reconcile_statements(self._sessions[i]))
+        return dict(sorted(fixed.items()))
+
+    def _map(self, job, *args):
+        """Runs job(path, profile, *args) for every shard in a pool of processes.
+
+        Returns:
+            list: what job returned for each shard, in shard order
+        """
+        workers = min(len(self._paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(workers, initializer=start_worker, initargs=(integer_money_enabled(),)) as pool:
+            return list(pool.map(job, self._paths, repeat(self._profile), *(repeat(arg) for arg in args)))
+
+
+def _run_on_shard(path, profile, work):
+    """Opens one shard in a worker process and runs work(session, bank) as a unit of work.
+
+    Returns:
+        what work returned
+    """
+    engine = create_bank_engine(path, PROFILES[profile])
+    session = sessionmaker(bind=engine)()
+    try:
+        bank = session.query(Bank).first()
+        return run_with_retry(session, lambda: work(session, bank))
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _month_end_of_shard(path, profile, month):
+    "Worker: runs month end on one shard and returns the skipped accounts as (account number, latest date)"
+    errors = _run_on_shard(path, profile, lambda session, bank: bank.run_month_end(month, session))
+    return [(acct_num, ex.latest_date.isoformat()) for acct_num, ex in errors]
+
+
+def _month_totals_of_shard(path, profile, month):
+    "Worker: returns the month's totals of one shard, amounts as strings"
+    totals = _run_on_shard(path, profile, lambda session, bank: bank.month_totals(month, session))
+    return {key: value if key == "transactions" else str(value) for key, value in totals.items()}
@@ -0,0 +1,95 @@
+import calendar
+
+from money import amount
+from transactions import Base, Amount
+
+from sqlalchemy import Column, Integer, ForeignKey, Index
+
+
+class MonthlyStatement(Base):
+    """Totals of one account's transactions in one month, kept up to date as transactions are added
+    so that reporting on a past month reads one row instead of its transactions.
+    Withdrawals and fees are stored as negative totals, so closing = opening + deposits + withdrawals + interest + fees.
+    """
+
+    ## Initialize SQLAlchemy table
+    __tablename__ = 'monthly_statements'
+
+    id = Column(Integer, primary_key=True)
+    _acct_num = Column(Integer, ForeignKey("accounts._account_number"))
+    _year = Column(Integer)
+    _month = Column(Integer)
+    _opening = Column(Amount)
+    _closing = Column(Amount)
+    _deposits = Column(Amount)
+    _withdrawals = Column(Amount)
+    _interest = Column(Amount)
+    _fees = Column(Amount)
+    _count = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_monthly_statements_acct_month", "_acct_num", "_year", "_month", unique=True),
+    )
+
+    def __init__(self, acct_num, year, month, opening):
+        """
+        Args:
+            acct_num (int): account the statement is for
+            year (int): year of the month
+            month (int): month number, 1 to 12
+            opening (Decimal): balance before the first transaction of the month
+        """
+        self._acct_num = acct_num
+        self._year = year
+        self._month = month
+        self._opening = amount(opening)
+        self._closing = self._opening
+        self._deposits = amount(0)
+        self._withdrawals = amount(0)
+        self._interest = amount(0)
+        self._fees = amount(0)
+        self._count = 0
+
+    def covers(self, day):
+        "Checks whether a date falls in the month of this statement"
+        return day.year == self._year and day.month == self._month
+
+    def add(self, t):
+        """Adds a transaction in this month to the totals. Exempt transactions are interest or fees, the rest deposits or withdrawals.
+
+        Args:
+            t (Transaction): transaction being added to the account
+        """
+        if t.is_exempt():
+            if t._amt >= 0:
+                self._interest += t._amt
+            else:
+                self._fees += t._amt
+        elif t._amt >= 0:
+            self._deposits += t._amt
+        else:
+            self._withdrawals += t._amt
+        self._closing += t._amt
+        self._count += 1
+
+    def totals(self):
+        "Returns every figure on the statement, for comparing statements"
+        return (self._opening, self._closing, self._deposits, self._withdrawals,
+                self._interest, self._fees, self._count)
+
+    def copy_totals(self, other):
+        "Replaces the figures on this statement with those of another statement for the same month"
+        (self._opening, self._closing, self._deposits, self._withdrawals,
+         self._interest, self._fees, self._count) = other.totals()
+
+    def __str__(self):
+        """Formats the statement over several lines, for example
+        'January 2024: 3 transactions' followed by one line per figure
+        """
+        return "\n".join([f"{calendar.month_name[self._month]} {self._year}: {self._count} transactions",
+                          f"Opening balance: ${self._opening:,.2f}",
+                          f"Deposits: ${self._deposits:,.2f}",
+                          f"Withdrawals: ${self._withdrawals:,.2f}",
+                          f"Interest: ${self._interest:,.2f}",
+                          f"Fees: ${self._fees:,.2f}",
+                          f"Closing balance: ${self._closing:,.2f}"])
@@ -0,0 +1,154 @@
+import time
+import random
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("bank.storage")
+
+# SQLAlchemy and the models are imported inside the functions that use them, so
+# that the CLI can read the profiles without paying for them at startup
+
+
+class StorageProfile:
+    """SQLite settings applied to every connection made to a bank database."""
+
+    def __init__(self, journal_mode="WAL", synchronous="NORMAL", cache_size=-64000, mmap_size=256 * 1024 * 1024):
+        """
+        Args:
+            journal_mode (str, optional): PRAGMA journal_mode. Defaults to "WAL", so a commit appends to the log instead of rewriting pages.
+            synchronous (str, optional): PRAGMA synchronous. Defaults to "NORMAL", which in WAL mode only syncs at checkpoints.
+            cache_size (int, optional): PRAGMA cache_size, negative values are in KiB. Defaults to 64 MiB.
+            mmap_size (int, optional): PRAGMA mmap_size in bytes, 0 turns memory mapping off. Defaults to 256 MiB.
+        """
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+
+    def pragmas(self):
+        "Returns the PRAGMA statements for this profile"
+        return [f"PRAGMA journal_mode={self.journal_mode}",
+                f"PRAGMA synchronous={self.synchronous}",
+                f"PRAGMA cache_size={self.cache_size}",
+                f"PRAGMA mmap_size={self.mmap_size}"]
+
+
+PROFILES = {
+    # what bank.db used before profiles existed: SQLite's own defaults
+    "stock": StorageProfile(journal_mode="DELETE", synchronous="FULL", cache_size=-2000, mmap_size=0),
+    "wal": StorageProfile(),
+    # WAL but every commit is synced, nothing is lost on power failure
+    "durable": StorageProfile(synchronous="FULL"),
+}
+
+DEFAULT_PROFILE = "wal"
+
+
+def create_bank_engine(path="bank.db", profile=PROFILES[DEFAULT_PROFILE]):
+    """Creates an engine for a bank database file, applying the storage profile to each connection
+    and bringing the tables up to date with the models.
+
+    Args:
+        path (str, optional): database file. Defaults to "bank.db".
+        profile (StorageProfile, optional): settings to use. Defaults to the "wal" profile.
+
+    Returns:
+        Engine: engine for the database
+    """
+    from bank import Base
+    from migrations import migrate
+    from sqlalchemy import create_engine, event
+
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _apply_profile(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in profile.pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    Base.metadata.create_all(engine)
+    migrate(engine, Base.metadata)
+    return engine
+
+
+def create_read_only_engine(path="bank.db"):
+    """Creates an engine that opens a bank database read-only, for processes that only read it. Nothing is
+    migrated and no profile is applied, since both write to the file: create_bank_engine must have opened it first.
+
+    Args:
+        path (str, optional): database file. Defaults to "bank.db".
+
+    Returns:
+        Engine: engine whose connections fail on any write
+    """
+    from pathlib import Path
+    from sqlalchemy import create_engine
+
+    return create_engine(f"sqlite:///{Path(path).resolve().as_uri()}?mode=ro&uri=true")
+
+
+@contextmanager
+def unit_of_work(session):
+    """Commits everything done in the block once at the end, or rolls it all back if the block or the commit raises.
+
+    Args:
+        session (Session): session the block works in
+    """
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+
+
+def has_uncommitted_writes(session):
+    """Flushes the session and tells whether its database transaction has written anything that is not
+    committed yet. Other processes can't see those rows, and can't write to the file until they are committed.
+
+    Args:
+        session (Session): session to check
+
+    Returns:
+        bool: True if the session has writes to commit or roll back
+    """
+    session.flush()
+    if not session.in_transaction():
+        return False
+    # sqlite3 only begins a transaction on the connection for a write
+    return session.connection().connection.dbapi_connection.in_transaction
+
+
+def run_with_retry(session, work, attempts=5):
+    """Runs work() as a unit of work, starting it over when another process changed the same rows first.
+
+    Accounts carry a version number, so committing changes based on an account that another process has
+    updated since it was read raises StaleDataError. SQLite reports a write that waited too long for
+    another writer as "database is locked". Either way the session is rolled back, which reloads the
+    accounts, and work() runs again so its checks see the other process's changes.
+
+    Args:
+        session (Session): session the work is done in
+        work (function): does the work, called with no arguments, may run more than once
+        attempts (int, optional): how many times to try before giving up. Defaults to 5.
+
+    Returns:
+        what work() returned
+    """
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm.exc import StaleDataError
+
+    for attempt in range(1, attempts + 1):
+        try:
+            with unit_of_work(session):
+                return work()
+        except (StaleDataError, OperationalError) as ex:
+            if isinstance(ex, OperationalError) and "locked" not in str(ex):
+                raise
+            if attempt == attempts:
+                raise
+            logger.debug("Retrying after conflict (attempt %s): %s", attempt, ex.__class__.__name__)
+            # back off a little so the processes that collided do not collide again
+            time.sleep(random.uniform(0, 0.005 * 2 ** attempt))
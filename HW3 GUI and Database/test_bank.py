@@ -0,0 +1,175 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal, BasicContext, InvalidOperation, getcontext, setcontext
+
+from bank import Bank, CHECKING, SAVINGS
+from storage import create_bank_engine, unit_of_work
+from exceptions import AccountNotFoundError, OverdrawError, TransactionLimitError, TransactionSequenceError
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+
+
+class BankTestCase(unittest.TestCase):
+    """Keeps each test's bank.db in its own directory. The bank has 5 accounts: savings 1, 3 and 5, checking 2 and 4."""
+    def setUp(self):
+        self._context = getcontext()
+        setcontext(BasicContext.copy())
+        self._directory = tempfile.mkdtemp()
+        self._engine = create_bank_engine(os.path.join(self._directory, "bank.db"))
+        self._Session = sessionmaker(bind=self._engine)
+        session = self._Session()
+        bank = Bank()
+        session.add(bank)
+        with unit_of_work(session):
+            for i in range(5):
+                bank.add_account(CHECKING if i % 2 else SAVINGS, session)
+        session.close()
+
+    def tearDown(self):
+        self._engine.dispose()
+        shutil.rmtree(self._directory)
+        setcontext(self._context)
+
+
+class TestOpenAccount(BankTestCase):
+    """Focus on opening accounts in a bank saved in a database file"""
+    def setUp(self):
+        super().setUp()
+        ## every statement sent to the database from now on
+        self._statements = []
+        event.listen(self._engine, "before_cursor_execute", self._record)
+
+    def tearDown(self):
+        event.remove(self._engine, "before_cursor_execute", self._record)
+        super().tearDown()
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self._statements.append(" ".join(statement.split()))
+
+    def test_open_does_not_load_accounts(self):
+        """Test 1. Opening an account must not read the bank's other accounts"""
+        session = self._Session()
+        bank = session.query(Bank).first()
+        for acct_type in (SAVINGS, CHECKING, SAVINGS):
+            with unit_of_work(session):
+                bank.add_account(acct_type, session)
+        account_reads = [x for x in self._statements if x.startswith("SELECT") and "FROM accounts" in x]
+        self.assertEqual(account_reads, [])
+        session.close()
+
+    def test_open_continues_numbers(self):
+        session = self._Session()
+        bank = session.query(Bank).first()
+        with unit_of_work(session):
+            account = bank.add_account(CHECKING, session)
+        self.assertEqual(account.account_number, 6)
+        self.assertEqual(bank.next_account_number(), 7)
+        self.assertIs(bank.get_account(6), account)
+        self.assertEqual([x.account_number for x in bank.show_accounts()], [1, 2, 3, 4, 5, 6])
+        session.close()
+
+    def test_open_is_saved(self):
+        session = self._Session()
+        bank = session.query(Bank).first()
+        with unit_of_work(session):
+            bank.add_account(SAVINGS, session)
+        session.close()
+
+        session = self._Session()
+        bank = session.query(Bank).first()
+        self.assertEqual(str(bank.get_account(6)), "Savings#000000006,\tbalance: $0.00")
+        self.assertEqual(len(bank.show_accounts()), 6)
+        session.close()
+
+    def test_unknown_type(self):
+        session = self._Session()
+        bank = session.query(Bank).first()
+        with unit_of_work(session):
+            self.assertIsNone(bank.add_account("money market", session))
+        self.assertEqual(bank.next_account_number(), 6)
+        session.close()
+
+
+class TestImportTransactions(BankTestCase):
+    """Focus on importing many transactions with the rules of Account.add_transaction"""
+    rows = [("1", "100", "2024-01-02"), ("1", "-500", "2024-01-02"), ("1", "5", "2024-01-02"),
+            ("1", "5", "2024-01-02"), ("2", "50", "2024-01-03"), ("2", "-10", "2024-01-02"),
+            ("9", "1", "2024-01-03"), ("2", "x", "2024-01-03"), ("2", "1", "2024-02-30"),
+            ("2", "25.25", "2024-02-01"), ("3", "1", "2024-01-01"), ("3", "1", "2024-01-02"),
+            ("3", "1", "2024-01-03"), ("3", "1", "2024-01-04"), ("3", "1", "2024-01-05"), ("3", "1", "2024-01-06")]
+
+    def figures(self, bank):
+        """Balance, latest date and statements of every account"""
+        return [(x.account_number, x.get_balance(), x._latest_date,
+                 [x.get_statement(2024, month).totals() for month in (1, 2) if x.get_statement(2024, month)])
+                for x in bank.show_accounts()]
+
+    def test_same_as_add_transaction(self):
+        ## the rows one at a time, then undone
+        session = self._Session()
+        bank = session.query(Bank).first()
+        for acct_num, amt, day in self.rows:
+            account = bank.get_account(int(acct_num))
+            try:
+                account.add_transaction(Decimal(amt), date.fromisoformat(day), session)
+            except (AttributeError, ValueError, InvalidOperation, OverdrawError,
+                    TransactionLimitError, TransactionSequenceError):
+                pass
+        added = self.figures(bank)
+        session.rollback()
+        session.close()
+
+        session = self._Session()
+        bank = session.query(Bank).first()
+        with unit_of_work(session):
+            errors = bank.import_transactions(self.rows, session)
+        self.assertEqual([(row_num, type(ex)) for row_num, ex in errors],
+                         [(2, OverdrawError), (4, TransactionLimitError), (6, TransactionSequenceError),
+                          (7, AccountNotFoundError), (8, InvalidOperation), (9, ValueError), (16, TransactionLimitError)])
+        self.assertEqual(self.figures(bank), added)
+        self.assertEqual(bank.reconcile_statements(session), {})
+        session.close()
+
+    def test_accounts_see_import(self):
+        session = self._Session()
+        bank = session.query(Bank).first()
+        savings = bank.get_account(1)
+        with unit_of_work(session):
+            savings.add_transaction(Decimal("10"), date(2024, 1, 2), session)
+        self.assertEqual(savings.get_statement(2024, 1)._count, 1)
+        with unit_of_work(session):
+            rows = [(1, "2.50", "2024-01-02"), (1, "1", "2024-01-03"), (1, "1", "2024-01-03")]
+            self.assertEqual(bank.import_transactions(rows, session), [])
+        self.assertEqual(savings.get_balance(), Decimal("14.50"))
+        self.assertEqual(savings.get_statement(2024, 1)._count, 4)
+        self.assertEqual(savings.balance_as_of(date(2024, 1, 2)), Decimal("12.50"))
+        with self.assertRaises(TransactionLimitError):
+            savings.add_transaction(Decimal("1"), date(2024, 1, 3), session)
+        with self.assertRaises(TransactionSequenceError):
+            savings.add_transaction(Decimal("1"), date(2024, 1, 1), session)
+        session.close()
+
+    def test_changed_elsewhere(self):
+        session = self._Session()
+        bank = session.query(Bank).first()
+        bank.get_account(2)
+
+        other = self._Session()
+        with unit_of_work(other):
+            other.query(Bank).first().get_account(2).add_transaction(Decimal("10"), date(2024, 1, 2), other)
+        other.close()
+
+        with self.assertRaises(StaleDataError):
+            with unit_of_work(session):
+                bank.import_transactions([(2, "5", "2024-01-03")], session)
+        self.assertEqual(bank.get_account(2).get_balance(), Decimal("10"))
+        session.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
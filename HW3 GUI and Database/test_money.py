@@ -0,0 +1,183 @@
+import random
+import unittest
+from decimal import Decimal, BasicContext, InvalidOperation, getcontext, setcontext
+
+from money import Money, amount, interest, use_integer_money
+
+
+class MoneyTestCase(unittest.TestCase):
+    """Runs every test under BasicContext, the context the bank uses, so Decimal results can be compared with Money"""
+    def setUp(self):
+        self._context = getcontext()
+        setcontext(BasicContext.copy())
+
+    def tearDown(self):
+        setcontext(self._context)
+
+    def assertSameAmount(self, money, decimal):
+        """Checks that a Money result is the same figure as the Decimal one"""
+        self.assertIsInstance(money, Money)
+        self.assertEqual(money.to_decimal(), decimal)
+
+
+class TestFromDecimal(MoneyTestCase):
+    """Focus on converting amounts to micro-cents"""
+    def test_whole_dollars(self):
+        self.assertEqual(Money.from_decimal(5).units, 500000000)
+        self.assertEqual(Money.from_decimal(Decimal("-5")).units, -500000000)
+
+    def test_exact_places(self):
+        self.assertEqual(Money.from_decimal(Decimal("0.01")).units, 1000000)
+        self.assertEqual(Money.from_decimal(Decimal("1.23456789")).units, 123456789)
+        self.assertEqual(Money.from_decimal(Decimal("1E+2")).units, 10000000000)
+
+    def test_rounds_half_up_past_8_places(self):
+        self.assertEqual(Money.from_decimal(Decimal("0.000000005")).units, 1)
+        self.assertEqual(Money.from_decimal(Decimal("0.000000004999")).units, 0)
+        self.assertEqual(Money.from_decimal(Decimal("1.234567895")).units, 123456790)
+
+    def test_negative_rounds_away_from_zero(self):
+        self.assertEqual(Money.from_decimal(Decimal("-0.000000005")).units, -1)
+        self.assertEqual(Money.from_decimal(Decimal("-1.234567894")).units, -123456789)
+
+    def test_not_a_number(self):
+        with self.assertRaises(InvalidOperation):
+            Money.from_decimal(Decimal("NaN"))
+        with self.assertRaises(InvalidOperation):
+            Money.from_decimal(Decimal("Infinity"))
+
+    def test_round_trip(self):
+        for text in ("0", "0.01", "-41797.6", "123.45678901"):
+            self.assertEqual(Money.from_decimal(Decimal(text)).to_decimal(), Decimal(text))
+
+
+class TestArithmetic(MoneyTestCase):
+    """Focus on rounding: every result must be the figure Decimal gives under BasicContext"""
+    def test_add_and_sub(self):
+        a, b = Decimal("100.10"), Decimal("-41797.60")
+        self.assertSameAmount(Money.from_decimal(a) + Money.from_decimal(b), a + b)
+        self.assertSameAmount(Money.from_decimal(a) - Money.from_decimal(b), a - b)
+        self.assertSameAmount(Money.from_decimal(a) + b, a + b)
+        self.assertSameAmount(b + Money.from_decimal(a), b + a)
+        self.assertSameAmount(b - Money.from_decimal(a), b - a)
+        self.assertSameAmount(5 - Money.from_decimal(a), 5 - a)
+
+    def test_add_rounds_to_9_significant_digits(self):
+        a, b = Decimal("1234567.89"), Decimal("0.005")
+        self.assertSameAmount(Money.from_decimal(a) + b, a + b)
+        self.assertEqual(str(a + b), "1234567.90")
+        a, b = Decimal("-9999999.99"), Decimal("-0.005")
+        self.assertSameAmount(Money.from_decimal(a) + b, a + b)
+
+    def test_sub_rounds_to_9_significant_digits(self):
+        a, b = Decimal("99999999.99"), Decimal("0.01")
+        self.assertSameAmount(Money.from_decimal(a) - b, a - b)
+
+    def test_unary(self):
+        a = Decimal("-1234567.895")
+        self.assertSameAmount(-Money.from_decimal(a), -a)
+        self.assertSameAmount(+Money.from_decimal(a), +a)
+        self.assertSameAmount(abs(Money.from_decimal(a)), abs(a))
+
+    def test_mul_by_rate(self):
+        for balance in ("100.00", "12345.67", "-250.10", "0.01", "99999999.99"):
+            for rate in ("0.0041", "0.0008", "1.5", "-1", "3", "1E+2"):
+                with self.subTest(balance=balance, rate=rate):
+                    b, r = Decimal(balance), Decimal(rate)
+                    self.assertSameAmount(Money.from_decimal(b) * r, b * r)
+                    self.assertSameAmount(r * Money.from_decimal(b), r * b)
+
+    def test_mul_by_int(self):
+        self.assertSameAmount(Money.from_decimal(Decimal("2.50")) * 3, Decimal("7.50"))
+
+    def test_mul_rounds_half_up_to_a_micro_cent(self):
+        # $1 * 0.000000005 is half a micro-cent, which Money can't keep
+        self.assertEqual((Money.from_decimal(Decimal("1")) * Decimal("0.000000005")).units, 1)
+        self.assertEqual((Money.from_decimal(Decimal("-1")) * Decimal("0.000000005")).units, -1)
+
+    def test_unsupported_operands(self):
+        with self.assertRaises(TypeError):
+            Money(1) + 1.5
+        with self.assertRaises(TypeError):
+            Money(1) * "2"
+
+    def test_random_sums_match_decimal(self):
+        rng = random.Random(327)
+        for _ in range(2000):
+            a = Decimal(rng.randint(-10 ** 9, 10 ** 9)).scaleb(-2)
+            b = Decimal(rng.randint(-10 ** 9, 10 ** 9)).scaleb(-rng.randint(0, 8))
+            with self.subTest(a=a, b=b):
+                self.assertSameAmount(Money.from_decimal(a) + b, a + b)
+                self.assertSameAmount(Money.from_decimal(a) - b, a - b)
+
+
+class TestComparison(MoneyTestCase):
+    """Focus on Money standing in for Decimal in comparisons, sets and dicts"""
+    def test_equal_to_decimal_and_int(self):
+        self.assertEqual(Money.from_decimal(Decimal("5.00")), Decimal("5"))
+        self.assertEqual(Money.from_decimal(5), 5)
+        self.assertEqual(Decimal("-0.01"), Money.from_decimal(Decimal("-0.01")))
+        self.assertNotEqual(Money.from_decimal(Decimal("0.01")), Decimal("0.011"))
+        self.assertNotEqual(Money(1), "0.00000001")
+
+    def test_ordering(self):
+        small, large = Money.from_decimal(Decimal("-0.01")), Money.from_decimal(Decimal("100"))
+        self.assertLess(small, large)
+        self.assertLessEqual(small, Decimal("-0.01"))
+        self.assertGreater(large, 99)
+        self.assertGreaterEqual(large, Decimal("100.00"))
+        self.assertLess(small, 0)
+        self.assertTrue(Decimal("99.99") < large)
+        self.assertEqual(sorted([large, Money(0), small]), [small, Money(0), large])
+
+    def test_hash_matches_decimal(self):
+        for text in ("0", "5", "5.00", "-41797.6", "0.00000001"):
+            with self.subTest(text=text):
+                self.assertEqual(hash(Money.from_decimal(Decimal(text))), hash(Decimal(text)))
+        self.assertEqual(hash(Money.from_decimal(5)), hash(5))
+        self.assertIn(Money.from_decimal(Decimal("1.50")), {Decimal("1.5")})
+
+    def test_bool(self):
+        self.assertFalse(Money(0))
+        self.assertTrue(Money(-1))
+
+
+class TestFormat(MoneyTestCase):
+    """Focus on Money printing the same text as the Decimal it stands for"""
+    def test_format_like_decimal(self):
+        for text in ("0", "150.615", "-41797.6", "1234567.895", "0.005"):
+            for spec in (",.2f", ".2f", ">12,.2f", ".3f"):
+                with self.subTest(text=text, spec=spec):
+                    self.assertEqual(format(Money.from_decimal(Decimal(text)), spec),
+                                     format(Decimal(text), spec))
+
+    def test_format_rounds_half_up(self):
+        self.assertEqual(f"{Money.from_decimal(Decimal('150.615')):,.2f}", "150.62")
+        self.assertEqual(f"{Money.from_decimal(Decimal('-0.005')):,.2f}", "-0.01")
+        self.assertEqual(f"{Money.from_decimal(Decimal('1234567.895')):,.2f}", "1,234,567.90")
+
+    def test_str_and_repr(self):
+        self.assertEqual(str(Money.from_decimal(Decimal("1.5"))), "1.50000000")
+        self.assertEqual(repr(Money.from_decimal(Decimal("-1.5"))), "Money('-1.50000000')")
+
+
+class TestAmountMode(MoneyTestCase):
+    """Focus on amount() and interest() in both modes"""
+    def tearDown(self):
+        use_integer_money(False)
+        super().tearDown()
+
+    def test_decimal_mode(self):
+        use_integer_money(False)
+        self.assertEqual(amount(Money.from_decimal(Decimal("1.25"))), Decimal("1.25"))
+        self.assertIsInstance(amount(3), Decimal)
+        self.assertEqual(interest(Decimal("123.45"), Decimal("0.0041")), Decimal("123.45") * Decimal("0.0041"))
+
+    def test_integer_mode(self):
+        use_integer_money(True)
+        self.assertSameAmount(amount(Decimal("1.25")), Decimal("1.25"))
+        self.assertSameAmount(interest(amount(Decimal("123.45")), Decimal("0.0041")), Decimal("0.50614500"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,72 @@
 from datetime import date, timedelta
 import logging
 
-from sqlalchemy import Column, Integer, Date, DECIMAL, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, Date, DECIMAL, Boolean, ForeignKey, Index, TypeDecorator
 from sqlalchemy.orm import declarative_base
 from sqlalchemy import create_engine
 
+from money import Money, amount
+
 Base = declarative_base()
 
+logger = logging.getLogger("bank.transactions")
+
+def last_day_of_month(day):
+    "Returns a date corresponding to the last day in the same month as the given date"
+
+    # Creates a date on the first of the next month (being careful about
+    # wrapping around to January)
+    first_of_next_month = date(day.year + day.month // 12,
+                               day.month % 12 + 1, 1)
+    # Then subtracts one day
+    return first_of_next_month - timedelta(days=1)
+
+class Amount(TypeDecorator):
+    """DECIMAL column for an amount of money. Values are loaded as whatever money.amount makes, Decimal or Money."""
+
+    impl = DECIMAL
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value.to_decimal() if isinstance(value, Money) else value
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else amount(value)
+
 class Transaction(Base):
 
     ## Initialize SQLAlchemy table
     __tablename__ = 'transactions'
 
     id = Column(Integer, primary_key=True)
-    _amt = Column(DECIMAL)
+    _amt = Column(Amount)
     _date = Column(Date)
     _exempt = Column(Boolean)
     _acct_num = Column(Integer,  ForeignKey("accounts._account_number"))
 
+    # almost every query on this table is for one account, usually by date and
+    # often only for exempt or non-exempt transactions. Month end looks for the
+    # accounts with exempt transactions in a month, across all accounts, which
+    # the last index answers without reading the table.
+    __table_args__ = (
+        Index("ix_transactions_acct_date", "_acct_num", "_date"),
+        Index("ix_transactions_acct_exempt_date", "_acct_num", "_exempt", "_date"),
+        Index("ix_transactions_exempt_date", "_exempt", "_date", "_acct_num"),
+    )
+
     def __init__(self, amt, acct_num, date, exempt=False):
         """
         Args:
-            amt (Decimal): Decimal object representing dollar amount of the transaction.
+            amt (Decimal): Decimal object representing dollar amount of the transaction, kept as money.amount makes it.
             acct_num (int): Account number used for logging the transaction's creation.
             date (Date): Date object representing the date the transaction was created.
             exempt (bool, optional): Determines whether the transaction is exempt from account limits. Defaults to False.
         """       
-        self._amt = amt
+        self._amt = amount(amt)
         self._date = date
         self._exempt = exempt
         self._acct_num = acct_num
-        logging.debug(f"Created transaction: {acct_num}, {self._amt}")
+        logger.debug("Created transaction: %s, %s", acct_num, amt)
 
     @property
     def date(self):
@@ -82,13 +118,7 @@ class Transaction(Base):
 
     def last_day_of_month(self):
         "Returns a date corresponding to the last day in the same month as this transaction"
-
-        # Creates a date on the first of the next month (being careful about
-        # wrapping around to January)
-        first_of_next_month = date(self._date.year + self._date.month // 12,
-                                   self._date.month % 12 + 1, 1)
-        # Then subtracts one day
-        return first_of_next_month - timedelta(days=1)
+        return last_day_of_month(self._date)
 
 if __name__ == "__main__":
     # if the db file already exists, this does nothing
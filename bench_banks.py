@@ -0,0 +1,271 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from itertools import islice
+from datetime import date
+from decimal import Decimal
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# folder of each bank, its modules are imported by bare name so every one runs in its own process
+IMPLEMENTATIONS = {
+    "hw1": "HW1 BankCli",
+    "hw2": "HW2 Error Exception",
+    "hw3": "HW3 GUI and Database",
+}
+
+# transactions a savings account gets per month, under the limit of 5 every bank has
+PER_MONTH = 4
+
+# HW3 commits this many transactions at once, as cli.py --batch does
+HW3_BATCH = 1000
+
+
+def main():
+    '''
+    Runs the same synthetic workload on the HW1, HW2 and HW3 banks, each size and bank in a new process.
+    A workload opens savings and checking accounts, adds transactions to them in date order (a share of them
+    withdrawals that would overdraw and must be rejected), reads balances of random accounts and runs month end
+    on every account.
+    Input: command line options, see --help
+    Output: JSON with the options and one result per bank and size, on stdout or in --output. Counts and the
+    total balance only change when the banks' behaviour does; timings and peak RSS are measurements.
+    '''
+    parser = argparse.ArgumentParser(description="Benchmark the HW1, HW2 and HW3 banks on synthetic workloads")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="numbers of transactions, e.g. 1000 10000 100000 1000000 (default: %(default)s)")
+    parser.add_argument("--banks", nargs="+", choices=sorted(IMPLEMENTATIONS), default=sorted(IMPLEMENTATIONS),
+                        help="banks to run (default: all)")
+    parser.add_argument("--per-account", type=int, default=48,
+                        help="transactions per account, which sets the number of accounts (default: %(default)s)")
+    parser.add_argument("--savings", type=float, default=0.5, help="share of savings accounts (default: %(default)s)")
+    parser.add_argument("--reject", type=float, default=0.05,
+                        help="share of transactions that would overdraw (default: %(default)s)")
+    parser.add_argument("--queries", type=int, default=1000, help="balance reads timed (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=327, help="random seed of the workload (default: %(default)s)")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--worker", choices=sorted(IMPLEMENTATIONS), help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    config = {key: getattr(args, key) for key in ("sizes", "banks", "per_account", "savings", "reject", "queries", "seed")}
+    results = []
+    for size in args.sizes:
+        for name in args.banks:
+            print(f"{name} {size} transactions...", file=sys.stderr)
+            results.append(run_in_process(name, size, args))
+    report = {
+        "config": config,
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def run_in_process(name, size, args):
+    '''
+    Runs one bank on one workload in a new Python process, in an empty directory.
+    Input: bank name, number of transactions, parsed options
+    Output: dict of the results the worker printed
+    '''
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name, "--size", str(size),
+               "--per-account", str(args.per_account), "--savings", str(args.savings), "--reject", str(args.reject),
+               "--queries", str(args.queries), "--seed", str(args.seed)]
+    with tempfile.TemporaryDirectory() as directory:
+        result = subprocess.run(command, cwd=directory, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def make_workload(size, per_account, savings, reject, seed):
+    '''
+    Generates a synthetic ledger. Each account gets PER_MONTH transactions a month on different days, so no
+    transaction breaks a limit, and the accounts' transactions are interleaved in date order.
+    Input: number of transactions, transactions per account, share of savings accounts, share of rejected
+    transactions, random seed
+    Output: (list of account types, list of (account index, amount, date) in date order)
+    '''
+    rng = random.Random(seed)
+    accounts = max(1, -(-size // per_account))
+    types = ["savings" if rng.random() < savings else "checking" for _ in range(accounts)]
+    start = date(2020, 1, 1)
+    transactions = []
+    for i in range(size):
+        account, n = i % accounts, i // accounts
+        month = start.month - 1 + n // PER_MONTH
+        day = date(start.year + month // 12, month % 12 + 1, 1 + 7 * (n % PER_MONTH))
+        if rng.random() < reject:
+            cents = -10 ** 9
+        elif rng.random() < 0.7:
+            cents = rng.randint(1000, 50000)
+        else:
+            cents = -rng.randint(100, 5000)
+        transactions.append((account, Decimal(cents).scaleb(-2), day))
+    return types, transactions
+
+def run_worker(args):
+    '''
+    Runs the workload on one bank in this process.
+    Input: parsed options with --worker and --size
+    Output: dict of counts, total balance, timings and peak RSS
+    '''
+    types, transactions = make_workload(args.size, args.per_account, args.savings, args.reject, args.seed)
+    sys.path.insert(0, os.path.join(HERE, IMPLEMENTATIONS[args.worker]))
+    logging.disable(logging.CRITICAL)
+    bank = {"hw1": MemoryBank, "hw2": MemoryBank, "hw3": DatabaseBank}[args.worker](args.worker)
+
+    ids = [bank.open(account_type) for account_type in types]
+    start = time.perf_counter()
+    accepted = bank.add_all((ids[account], amount, day) for account, amount, day in transactions)
+    insert_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed + 1)
+    latencies = []
+    for _ in range(args.queries):
+        account = rng.choice(ids)
+        start = time.perf_counter()
+        bank.balance(account)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    bank.month_end(transactions[-1][2] if transactions else date(2020, 1, 1))
+    month_end_seconds = time.perf_counter() - start
+
+    return {
+        "bank": args.worker,
+        "transactions": len(transactions),
+        "accounts": len(ids),
+        "accepted": accepted,
+        "rejected": len(transactions) - accepted,
+        "total_balance": f"{sum((bank.balance(x) for x in ids), Decimal(0)):.2f}",
+        "insert_per_s": round(len(transactions) / insert_seconds, 1) if insert_seconds else None,
+        "balance_query_us": {"p50": round(percentile(latencies, 0.5) * 1e6, 2),
+                             "p99": round(percentile(latencies, 0.99) * 1e6, 2)},
+        "month_end_s": round(month_end_seconds, 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def percentile(values, fraction):
+    '''
+    Input: sorted list of numbers, fraction between 0 and 1
+    Output: the value at that fraction of the list, 0 if it is empty
+    '''
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def peak_rss_mb():
+    '''
+    Input: none
+    Output: largest resident set size this process has had, in MiB, or None where it can't be read
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class MemoryBank():
+    """Runs the workload on the HW1 or HW2 bank, which keep everything in memory. HW1 ignores a rejected
+    transaction silently and HW2 raises, so a transaction counts as accepted when the account has one more."""
+
+    def __init__(self, name):
+        from bank import Bank
+        self._bank = Bank({})
+        self._name = name
+
+    def open(self, account_type):
+        from account import Account
+        self._bank.open_account(account_type)
+        return Account.last_id
+
+    def add_all(self, transactions):
+        errors = ()
+        if self._name == "hw2":
+            from account import OverdrawError, TransactionLimitError, TransactionSequenceError
+            errors = (OverdrawError, TransactionLimitError, TransactionSequenceError)
+        accepted = 0
+        for id, amount, day in transactions:
+            account = self._bank.select_account(id)
+            before = len(account._transactions)
+            try:
+                account.add_transaction(amount, day)
+            except errors:
+                continue
+            accepted += len(account._transactions) > before
+        return accepted
+
+    def balance(self, id):
+        return self._bank.select_account(id).balance
+
+    def month_end(self, day):
+        for id in list(self._bank._accounts):
+            account = self._bank.select_account(id)
+            if len(account._transactions):
+                account.interest_and_fee()
+
+
+class DatabaseBank():
+    """Runs the workload on the HW3 bank in a new bank.db, committing HW3_BATCH transactions at a time."""
+
+    def __init__(self, name):
+        from decimal import setcontext, BasicContext
+        from bank import Bank
+        from storage import create_bank_engine
+        from sqlalchemy.orm import sessionmaker
+
+        setcontext(BasicContext)
+        self._session = sessionmaker(bind=create_bank_engine("bank.db"))()
+        self._bank = Bank()
+        self._session.add(self._bank)
+        self._session.commit()
+
+    def open(self, account_type):
+        account = self._bank.add_account(account_type, self._session)
+        self._session.commit()
+        return account.account_number
+
+    def add_all(self, transactions):
+        from storage import unit_of_work
+        from exceptions import OverdrawError, TransactionLimitError, TransactionSequenceError
+
+        accepted = 0
+        transactions = iter(transactions)
+        while True:
+            batch = list(islice(transactions, HW3_BATCH))
+            if not batch:
+                return accepted
+            with unit_of_work(self._session):
+                for acct_num, amount, day in batch:
+                    try:
+                        self._bank.get_account(acct_num).add_transaction(amount, day, self._session)
+                        accepted += 1
+                    except (OverdrawError, TransactionLimitError, TransactionSequenceError):
+                        pass
+
+    def balance(self, acct_num):
+        return self._bank.get_account(acct_num).get_balance()
+
+    def month_end(self, day):
+        from storage import unit_of_work
+        with unit_of_work(self._session):
+            self._bank.run_month_end(day, self._session)
+
+
+if __name__ == "__main__":
+    main()